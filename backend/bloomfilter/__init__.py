@@ -1 +1,8 @@
-from .bf_utils import *
\ No newline at end of file
+from .bf_utils import *
+from .bf_qgram import *
+from .bf_encoder import *
+from .bf_matrix import *
+from .bf_lsh import *
+from .bf_parallel import *
+from .bf_binary import *
+from .bf_blob import *
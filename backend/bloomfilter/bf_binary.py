@@ -0,0 +1,178 @@
+import json, os, shutil, struct, tempfile
+import numpy as np
+from .bf_encoder import RecordSchema
+
+
+BF_BINARY_MAGIC = b"PPRLBF"
+BF_BINARY_VERSION = 1
+# Size of the header; the filter block starts right behind it
+BF_BINARY_HEADER_SIZE = 4096
+# Magic, format version and length of the JSON header following it
+_PREFIX = struct.Struct("<6sHI")
+
+
+def _align(offset: int, alignment: int = 64) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class BFBinaryWriter:
+    '''
+    Writes the binary interchange format of bloomfilter exports (file extension ".bin"):
+
+        header      magic "PPRLBF", format version (uint16) and length (uint32) of a JSON header with the
+                    encoding version, the segments (name, bits), bytes per filter, record count, record columns
+                    and the offsets of the sections; padded to BF_BINARY_HEADER_SIZE bytes
+        filters     record count x bytes per filter uint8, the filters exactly as stored in the database,
+                    so the block can be memory-mapped as a NumPy matrix (see BFBinaryFile)
+        ids         record count int64 (little endian), 64 byte aligned
+        records     one JSON array per line with the remaining columns of a record (e.g. mdat), in filter order
+
+    The filters are streamed into the file; ids and records are spooled into temporary files and appended by close().
+    '''
+
+    def __init__(self, path, schema: RecordSchema, encoding_version: int, columns: list[str]):
+        '''
+        Parameters:
+            path (str | Path):          File to write
+            schema (RecordSchema):      Layout of the filters
+            encoding_version (int):     Encoding version of the filters (see bf_scheme_version)
+            columns (list[str]):        Names of the record columns, e.g. ["MDAT"]
+        '''
+        self.path = path
+        self.schema = schema
+        self.encoding_version = encoding_version
+        self.columns = list(columns)
+        self.count = 0
+        self._file = open(path, "wb")
+        self._file.write(bytes(BF_BINARY_HEADER_SIZE))
+        self._ids = tempfile.TemporaryFile()
+        self._records = tempfile.TemporaryFile()
+
+    def __enter__(self) -> "BFBinaryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # An incomplete file is not left behind
+        for file in (self._file, self._ids, self._records):
+            file.close()
+        os.remove(self.path)
+
+    def write(self, ids, filters, records=None) -> None:
+        '''
+        Appends records.
+
+        Parameters:
+            ids (Sequence[int]):                        IDs of the records, e.g. pid_id
+            filters (Sequence[bytes] | np.ndarray):     Their filters, as bytes or uint8 matrix (N x total_bytes)
+            records (Sequence[Sequence]) (optional):    Values of the record columns per record
+        '''
+        if not isinstance(filters, np.ndarray):
+            filters = list(filters)
+            if any(len(bf) != self.schema.total_bytes for bf in filters):
+                raise ValueError(f"BFBinaryWriter: filters need {self.schema.total_bytes} bytes")
+            filters = np.frombuffer(b"".join(filters), dtype=np.uint8)
+        filters = np.ascontiguousarray(filters, dtype=np.uint8).reshape(-1, self.schema.total_bytes)
+        ids = np.asarray(ids, dtype="<i8")
+        if len(ids) != len(filters):
+            raise ValueError(f"BFBinaryWriter: {len(ids)} ids for {len(filters)} filters")
+        records = [[] for _ in ids] if records is None else list(records)
+        if len(records) != len(ids) or any(len(record) != len(self.columns) for record in records):
+            raise ValueError(f"BFBinaryWriter: every record needs the columns {self.columns}")
+
+        self._file.write(filters.data)
+        self._ids.write(ids.data)
+        if self.columns:
+            self._records.write("".join(json.dumps(list(record), ensure_ascii=False) + "\n" for record in records).encode("utf-8"))
+        self.count += len(ids)
+
+    def close(self) -> int:
+        '''
+        Appends the ids and records and writes the header.
+
+        Returns:
+            int:    Amount of written records
+        '''
+        sections = {"filters": BF_BINARY_HEADER_SIZE}
+        for name, spool in (("ids", self._ids), ("records", self._records)):
+            offset = _align(self._file.tell())
+            self._file.write(bytes(offset - self._file.tell()))
+            spool.seek(0)
+            shutil.copyfileobj(spool, self._file)
+            sections[name] = offset
+            spool.close()
+        sections["end"] = self._file.tell()
+
+        header = json.dumps({"encoding_version": self.encoding_version,
+                             "segments": [[name, size] for name, size in zip(self.schema.names, self.schema.sizes)],
+                             "total_bytes": self.schema.total_bytes,
+                             "count": self.count,
+                             "columns": self.columns,
+                             "sections": sections}).encode("utf-8")
+        if _PREFIX.size + len(header) > BF_BINARY_HEADER_SIZE:
+            raise ValueError("BFBinaryWriter: header does not fit into BF_BINARY_HEADER_SIZE")
+        self._file.seek(0)
+        self._file.write(_PREFIX.pack(BF_BINARY_MAGIC, BF_BINARY_VERSION, len(header)) + header)
+        self._file.close()
+        return self.count
+
+
+class BFBinaryFile:
+    '''
+    Reads the binary interchange format (see BFBinaryWriter). The filters and ids are memory-mapped, not copied.
+    '''
+
+    def __init__(self, path):
+        '''
+        Parameters:
+            path (str | Path):      File to read
+        '''
+        self.path = path
+        with open(path, "rb") as file:
+            prefix = file.read(_PREFIX.size)
+            if len(prefix) < _PREFIX.size:
+                raise ValueError(f"BFBinaryFile: {path} is no bloomfilter export")
+            magic, version, length = _PREFIX.unpack(prefix)
+            if magic != BF_BINARY_MAGIC:
+                raise ValueError(f"BFBinaryFile: {path} is no bloomfilter export")
+            if version != BF_BINARY_VERSION:
+                raise ValueError(f"BFBinaryFile: format version {version} is not supported, expected {BF_BINARY_VERSION}")
+            header = json.loads(file.read(length))
+
+        self.encoding_version = header["encoding_version"]
+        self.segments = [tuple(segment) for segment in header["segments"]]
+        self.total_bytes = header["total_bytes"]
+        self.count = header["count"]
+        self.columns = header["columns"]
+        self.sections = header["sections"]
+        self.filters = self._map("filters", np.uint8, (self.count, self.total_bytes))
+        self.ids = self._map("ids", np.dtype("<i8"), (self.count,))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _map(self, section: str, dtype, shape) -> np.ndarray:
+        if not self.count:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode="r", offset=self.sections[section], shape=shape)
+
+    def check_schema(self, schema: RecordSchema) -> None:
+        '''
+        Raises a ValueError if the filters of the file do not have the segment sizes of schema.
+        '''
+        if [size for _, size in self.segments] != schema.sizes or self.total_bytes != schema.total_bytes:
+            raise ValueError(f"BFBinaryFile: segments {self.segments} do not match the schema {list(zip(schema.names, schema.sizes))}")
+
+    def records(self):
+        '''
+        Yields the record columns of every record as a list, in filter order.
+        '''
+        if not self.columns:
+            yield from ([] for _ in range(self.count))
+            return
+        with open(self.path, "rb") as file:
+            file.seek(self.sections["records"])
+            for _ in range(self.count):
+                yield json.loads(file.readline())
@@ -0,0 +1,150 @@
+import numpy as np
+
+
+# Rows unpacked to one byte per bit at once while encoding or decoding (2016 bits: 8 MiB)
+_BLOCK_ROWS = 4096
+
+def bf_blob_encode(filters: np.ndarray) -> list[bytes]:
+    '''
+    Function encoding filters for storage as BLOB, per row the shorter of two encodings:
+
+        packed      the filter bytes as they are (exactly total_bytes long)
+        sparse      the sorted positions of the set bits, delta coded as varints (7 bits per byte, the high bit
+                    marks a following byte): the first position, then the distance to the previous position
+
+    A sparse BLOB is only used if it is shorter than the packed filter, so the length tells the encodings apart
+    and existing packed BLOBs stay valid (see bf_blob_decode). Sparse pays off below about one set bit in eight.
+
+    Parameters:
+        filters (np.ndarray):   uint8 matrix (N x total_bytes) of packed filters
+
+    Returns:
+        list[bytes]:            One BLOB per row
+    '''
+    filters = np.ascontiguousarray(filters, dtype=np.uint8).reshape(len(filters), -1)
+    width = filters.shape[1]
+    blobs = [row.tobytes() for row in filters]
+    # Every set bit takes at least one byte, so only rows with less set bits than bytes are candidates
+    candidates = np.flatnonzero(np.bitwise_count(filters).sum(axis=1, dtype=np.int64) < width)
+    for start in range(0, len(candidates), _BLOCK_ROWS):
+        block = candidates[start:start + _BLOCK_ROWS]
+        sparse, encoded = _sparse_encode(filters[block])
+        for row, blob in zip(block[sparse].tolist(), encoded):
+            blobs[row] = blob
+    return blobs
+
+
+def _set_bits(filters: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Row and delta coded position of every set bit, row by row
+    bits = filters.shape[1] * 8
+    rows, positions = np.divmod(np.flatnonzero(np.unpackbits(filters, axis=1).view(bool)), bits)
+    gaps = np.diff(positions, prepend=0)
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = rows[1:] != rows[:-1]
+    gaps[first] = positions[first]
+    return rows, gaps
+
+
+def _varint_bytes(gaps: np.ndarray, bits: int) -> np.ndarray:
+    varint_bytes = np.ones(len(gaps), dtype=np.int64)
+    limit = 128
+    while limit < bits:
+        varint_bytes += gaps >= limit
+        limit <<= 7
+    return varint_bytes
+
+
+def _sparse_encode(filters: np.ndarray) -> tuple[np.ndarray, list[bytes]]:
+    # Rows whose sparse BLOB is shorter than packed and their BLOBs
+    width = filters.shape[1]
+    rows, gaps = _set_bits(filters)
+    varint_bytes = _varint_bytes(gaps, width * 8)
+    sizes = np.bincount(rows, weights=varint_bytes, minlength=len(filters)).astype(np.int64)
+    sparse = sizes < width
+    keep = sparse[rows]
+    gaps, varint_bytes = gaps[keep], varint_bytes[keep]
+
+    ends = np.cumsum(varint_bytes)
+    data = np.empty(ends[-1] if len(ends) else 0, dtype=np.uint8)
+    for byte in range(int(varint_bytes.max(initial=1))):
+        selected = varint_bytes > byte
+        data[ends[selected] - varint_bytes[selected] + byte] = \
+            ((gaps[selected] >> (7 * byte)) & 0x7F) | np.where(varint_bytes[selected] > byte + 1, 0x80, 0)
+
+    bounds = np.concatenate(([0], np.cumsum(sizes[sparse]))).tolist()
+    blob = data.tobytes()
+    return sparse, [blob[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+
+def bf_blob_decode(blobs, total_bytes: int) -> np.ndarray:
+    '''
+    Function decoding stored BLOBs of both encodings of bf_blob_encode into packed filters.
+
+    Parameters:
+        blobs (Iterable[bytes]):    BLOBs as stored; a BLOB of total_bytes is packed, every shorter one sparse
+        total_bytes (int):          Bytes of a packed filter (RecordSchema.total_bytes)
+
+    Returns:
+        np.ndarray:                 uint8 matrix (N x total_bytes)
+    '''
+    blobs = blobs if isinstance(blobs, list) else list(blobs)
+    lengths = np.fromiter(map(len, blobs), dtype=np.int64, count=len(blobs))
+    packed = lengths == total_bytes
+    if packed.all():
+        return np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(len(blobs), total_bytes)
+    if (lengths > total_bytes).any():
+        raise ValueError(f"bf_blob_decode: BLOB of {lengths.max()} bytes, expected at most {total_bytes}")
+
+    filters = np.empty((len(blobs), total_bytes), dtype=np.uint8)
+    if packed.any():
+        filters[packed] = np.frombuffer(b"".join(blob for blob, is_packed in zip(blobs, packed) if is_packed),
+                                        dtype=np.uint8).reshape(-1, total_bytes)
+
+    sparse = np.flatnonzero(~packed)
+    for start in range(0, len(sparse), _BLOCK_ROWS):
+        block = sparse[start:start + _BLOCK_ROWS].tolist()
+        filters[block] = _sparse_decode([blobs[row] for row in block], total_bytes)
+    return filters
+
+
+def _sparse_decode(blobs: list[bytes], total_bytes: int) -> np.ndarray:
+    data = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+    bounds = np.concatenate(([0], np.cumsum([len(blob) for blob in blobs])))
+    ends = data < 0x80
+    if not ends[bounds[1:][bounds[1:] > bounds[:-1]] - 1].all():
+        raise ValueError("bf_blob_decode: sparse BLOB ends inside a position")
+
+    # The last byte of a varint holds its highest 7 bits, the continuation bytes before it the lower ones
+    index = np.flatnonzero(ends)
+    values = data[index].astype(np.int64)
+    rest = np.arange(len(index))
+    back = 1
+    while len(rest):
+        before = index[rest] - back
+        rest = rest[before >= 0]
+        rest = rest[data[index[rest] - back] >= 0x80]
+        values[rest] = (values[rest] << 7) | (data[index[rest] - back] & 0x7F)
+        back += 1
+
+    # Undo the delta coding row by row: running sum minus the running sum before the row
+    counts = np.diff(np.searchsorted(index, bounds))
+    positions = np.cumsum(values)
+    positions -= np.repeat(np.concatenate(([0], positions))[np.cumsum(counts) - counts], counts)
+    if len(positions) and positions.max() >= total_bytes * 8:
+        raise ValueError(f"bf_blob_decode: bit position {positions.max()} outside of {total_bytes * 8} bits")
+    # The positions of a row ascend, so the bits of every filter byte are neighbours and OR-ed together
+    filters = np.zeros((len(blobs), total_bytes), dtype=np.uint8)
+    cells = np.repeat(np.arange(len(blobs)) * total_bytes, counts) + (positions >> 3)
+    if len(cells):
+        starts = np.flatnonzero(np.concatenate(([True], cells[1:] != cells[:-1])))
+        filters.reshape(-1)[cells[starts]] = np.bitwise_or.reduceat((0x80 >> (positions & 7)).astype(np.uint8), starts)
+    return filters
+
+
+def bf_blob_unpack(blob, total_bytes: int) -> bytes | None:
+    '''
+    Function decoding a single stored BLOB (see bf_blob_decode) into the packed filter; None stays None.
+    '''
+    if blob is None or len(blob) == total_bytes:
+        return blob
+    return bf_blob_decode([blob], total_bytes)[0].tobytes()
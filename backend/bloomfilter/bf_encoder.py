@@ -0,0 +1,209 @@
+import numpy as np
+from backend.data import gen_qgram
+from config import BLOOMFILTER_SETTINGS
+from .bf_qgram import bf_tokenize, bf_qgram_positions, bf_get_qgram_table, bf_scheme_version
+
+
+def bf_record_fields() -> list[dict]:
+    '''
+    Function building the field configuration of a patient record from BLOOMFILTER_SETTINGS.RECORD_FIELDS.
+
+    Returns:
+        list[dict]:     One dict per segment with the keys "name", "hash_runs", "hash_seeds", "array_size" and "normMode"
+    '''
+    hashing = {'name':  (BLOOMFILTER_SETTINGS.HASHRUNS_NAME, BLOOMFILTER_SETTINGS.HASH_SEEDS40),
+               'other': (BLOOMFILTER_SETTINGS.HASHRUNS_OTHER, BLOOMFILTER_SETTINGS.HASH_SEEDS20)}
+    fields = []
+    for name, group, normMode in BLOOMFILTER_SETTINGS.RECORD_FIELDS:
+        hash_runs, hash_seeds = hashing[group]
+        fields.append({"name": name,
+                       "hash_runs": hash_runs,
+                       "hash_seeds": hash_seeds,
+                       "array_size": BLOOMFILTER_SETTINGS.ARRAY_SIZES[group],
+                       "normMode": normMode})
+    return fields
+
+
+class RecordSchema:
+    '''
+    Compiled layout of a combined bloomfilter: one segment per field, concatenated in field order
+    exactly like the single get_bloomfilter filters joined with bitarray.extend.
+    '''
+
+    def __init__(self, fields: list[dict] | None = None,
+                 qSize: int = BLOOMFILTER_SETTINGS.QSIZE,
+                 padding: bool = BLOOMFILTER_SETTINGS.PADDING,
+                 scheme: str = BLOOMFILTER_SETTINGS.ENCODING_SCHEME):
+        '''
+        Parameters:
+            fields (list[dict]) (optional):     Field configuration, see bf_record_fields(); default = bf_record_fields()
+            qSize (int):                        Size of the generated q-grams
+            padding (bool):                     true = Tom -> _Tom_ , false Tom -> Tom
+            scheme (str = "seeded" | "double"): Hashing scheme of the q-grams, see bf_qgram_positions
+        '''
+        fields = fields if fields is not None else bf_record_fields()
+        self.qSize = qSize
+        self.padding = padding
+        self.scheme = scheme
+        self.version = bf_scheme_version(scheme)
+
+        self.names = [field.get("name", f"segment {i}") for i, field in enumerate(fields)]
+        self.norm_modes = [field["normMode"] for field in fields]
+        self.hash_runs = [field["hash_runs"] for field in fields]
+        self.hash_seeds = [list(field["hash_seeds"]) for field in fields]
+        self.sizes = [field["array_size"] for field in fields]
+        self.offsets = [sum(self.sizes[:i]) for i in range(len(fields))]
+
+        self.total_bits = sum(self.sizes)
+        self.total_bytes = (self.total_bits + 7) // 8
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def segments(self):
+        '''
+        Returns (name, start, end) of every segment in bits.
+        '''
+        return [(name, offset, offset + size) for name, offset, size in zip(self.names, self.offsets, self.sizes)]
+
+    def count_columns(self) -> list[str]:
+        '''
+        Returns the names of the popcount columns of a patient table: "bf_count" for the whole filter,
+        then "bf_count_<i>" for segment i.
+        '''
+        return ["bf_count"] + [f"bf_count_{i}" for i in range(len(self))]
+
+    def popcounts(self, filters) -> np.ndarray:
+        '''
+        Counts the set bits of combined bloomfilters, matching count_columns().
+
+        Parameters:
+            filters (bytes | np.ndarray):   One filter as bytes or a uint8 matrix (N x total_bytes)
+
+        Returns:
+            np.ndarray:                     int64 matrix (N x (1 + segments)); column 0 = whole filter
+        '''
+        if isinstance(filters, (bytes, bytearray, memoryview)):
+            filters = np.frombuffer(filters, dtype=np.uint8)
+        filters = np.asarray(filters, dtype=np.uint8).reshape(-1, self.total_bytes)
+        if all(offset % 8 == 0 for offset in self.offsets + [self.total_bits]):
+            counts = np.bitwise_count(filters)
+            starts = [offset // 8 for offset in self.offsets]
+        else:
+            counts = np.unpackbits(filters, axis=1)[:, :self.total_bits]
+            starts = self.offsets
+        segments = np.add.reduceat(counts, starts, axis=1, dtype=np.int64) if len(filters) \
+            else np.zeros((0, len(self)), dtype=np.int64)
+        return np.concatenate([segments.sum(axis=1, keepdims=True), segments], axis=1)
+
+
+class BloomEncoder:
+    '''
+    Encoder for complete records built once from a RecordSchema.
+
+    Every q-gram is resolved once per field into an int mask spanning the whole record, so encoding a record is
+    OR-ing a few cached masks and writing the result into one contiguous byte buffer.
+    '''
+
+    def __init__(self, schema: RecordSchema | None = None,
+                 use_table: bool = BLOOMFILTER_SETTINGS.USE_QGRAM_TABLE):
+        '''
+        Parameters:
+            schema (RecordSchema) (optional):   Layout of the records; default = RecordSchema()
+            use_table (bool):                   If True, q-gram positions are taken from the persistent q-gram tables
+        '''
+        self.schema = schema if schema is not None else RecordSchema()
+        self.buffer = bytearray(self.schema.total_bytes)
+
+        # Bit p of the record is bit (width - 1 - p) of the mask, so mask.to_bytes() yields the bitarray byte layout
+        width = self.schema.total_bytes * 8
+        self._shifts = [width - 1 - offset for offset in self.schema.offsets]
+        self._masks = [{} for _ in range(len(self.schema))]
+        self._tables = [bf_get_qgram_table(runs, seeds, size, self.schema.qSize, scheme=self.schema.scheme) if use_table else None
+                        for runs, seeds, size in zip(self.schema.hash_runs, self.schema.hash_seeds, self.schema.sizes)]
+
+    def _mask(self, field: int, qgram: str) -> int:
+        table = self._tables[field]
+        if table is not None:
+            positions = table.positions(qgram)
+        else:
+            positions = bf_qgram_positions(qgram,
+                                           self.schema.hash_runs[field],
+                                           self.schema.hash_seeds[field],
+                                           self.schema.sizes[field],
+                                           self.schema.scheme)
+        shift = self._shifts[field]
+        mask = 0
+        for ix in positions:
+            mask |= 1 << (shift - ix)
+        self._masks[field][qgram] = mask
+        return mask
+
+    def record_mask(self, record) -> int:
+        '''
+        Returns the combined bloomfilter of a record as an int; see BloomEncoder.encode.
+        '''
+        mask = 0
+        qSize, padding = self.schema.qSize, self.schema.padding
+        for field, (value, normMode, masks) in enumerate(zip(record, self.schema.norm_modes, self._masks)):
+            for val in bf_tokenize(value, normMode):
+                for qgram in gen_qgram(val, qSize, padding):
+                    qgram_mask = masks.get(qgram)
+                    mask |= qgram_mask if qgram_mask is not None else self._mask(field, qgram)
+        return mask
+
+    def encode_into(self, record, buffer, offset: int = 0) -> None:
+        '''
+        Writes the combined bloomfilter of a record into buffer[offset:offset + total_bytes].
+
+        Parameters:
+            record (Sequence[str]):     Values like (first_name, last_name, date_of_birth, gender, ...);
+                                        column i is encoded with field i of the schema, further columns are ignored
+            buffer (bytearray):         Writable buffer
+            offset (int):               Byte offset in the buffer
+        '''
+        buffer[offset:offset + self.schema.total_bytes] = self.record_mask(record).to_bytes(self.schema.total_bytes, "big")
+
+    def encode(self, record) -> bytes:
+        '''
+        Function generating the combined bloomfilter of a record; bit-for-bit equal to the concatenated get_bloomfilter segments.
+
+        Parameters:
+            record (Sequence[str]):     Values like (first_name, last_name, date_of_birth, gender, ...)
+
+        Returns:
+            bytes:                      Byte representation of the bloomfilter
+        '''
+        self.encode_into(record, self.buffer)
+        return bytes(self.buffer)
+
+    def encode_batch(self, records) -> np.ndarray:
+        '''
+        Function generating the combined bloomfilters of many records.
+
+        Parameters:
+            records (Sequence[Sequence[str]]):  Records, see BloomEncoder.encode
+
+        Returns:
+            np.ndarray:                         uint8 matrix (len(records) x total_bytes)
+        '''
+        size = self.schema.total_bytes
+        out = bytearray(len(records) * size)
+        for row, record in enumerate(records):
+            self.encode_into(record, out, row * size)
+        return np.frombuffer(out, dtype=np.uint8).reshape(len(records), size)
+
+
+_ENCODER = None
+
+def bf_get_encoder() -> BloomEncoder:
+    '''
+    Function returning the shared encoder of the configured patient record layout.
+
+    Returns:
+        BloomEncoder:   Encoder built from BLOOMFILTER_SETTINGS
+    '''
+    global _ENCODER
+    if _ENCODER is None:
+        _ENCODER = BloomEncoder()
+    return _ENCODER
@@ -0,0 +1,135 @@
+import math
+import numpy as np
+from bitarray import bitarray
+from .bf_encoder import RecordSchema
+
+
+def bf_lsh_bands(recall: float, threshold: float, fill: float, band_bits: int) -> int:
+    '''
+    Helper function returning the amount of bands a Hamming bit-sampling LSH needs to find a pair of
+    bloomfilters with the similarity threshold at least with the probability recall.
+
+    Two filters with c set bits on average and the Sorenson-Dice similarity D differ in about 2 * c * (1 - D)
+    of their d bits, so one sampled bit agrees with the probability p = 1 - 2 * fill * (1 - D), fill = c / d.
+    A band of band_bits bits matches with p ** band_bits and at least one of b bands with 1 - (1 - p ** band_bits) ** b.
+    The relink rates the mean of the segment similarities, so this is an estimate for the total similarity.
+
+    Parameters:
+        recall (float):         Wanted probability to find a pair with the similarity threshold, 0 < recall < 1
+        threshold (float):      Similarity of the pairs which have to be found
+        fill (float):           Share of set bits in the stored filters
+        band_bits (int):        Amount of bits sampled per band
+
+    Returns:
+        int:                    Amount of bands
+    '''
+    if not 0 < recall < 1: raise ValueError(f"bf_lsh_bands: recall must be between 0 and 1, got {recall}")
+    agreement = min(max(1 - 2 * fill * (1 - threshold), 1e-9), 1.0)
+    band_match = agreement ** band_bits
+    if band_match >= 1: return 1
+    return max(1, math.ceil(math.log(1 - recall) / math.log1p(-band_match)))
+
+
+def bf_mih_radius(counts: list[int], threshold: float, segments: int) -> int | None:
+    '''
+    Helper function returning the largest Hamming distance the indexed segments of a stored filter can have to a query,
+    if the mean of the Sorenson-Dice similarities of all segments is at least threshold.
+
+    The segment similarities D_i have to sum up to segments * threshold, so every D_i >= L = 1 - segments * (1 - threshold)
+    and sum(1 - D_i) <= segments * (1 - threshold). A segment with q set bits in the query and D_i >= L has at most
+    2 * q / L set bits in both filters together, and their Hamming distance is that sum times (1 - D_i).
+
+    Parameters:
+        counts (list[int]):     Set bits of the query in every indexed segment
+        threshold (float):      Minimal mean similarity
+        segments (int):         Amount of segments of the filter
+
+    Returns:
+        int | None:             Maximal Hamming distance over the indexed segments; None if the threshold does not bound it
+    '''
+    slack = segments * (1 - threshold) + 1e-9
+    lowest = 1 - slack
+    if lowest <= 0: return None
+    return math.floor(max([2 * count / lowest for count in counts], default=0) * slack)
+
+
+class BFLSH:
+    '''
+    Hamming bit-sampling LSH with banding over combined bloomfilters.
+
+    Every band samples band_bits fixed bit positions of the filter; the sampled bits of a filter form its bucket in
+    that band. Filters sharing a bucket in any band are candidates of each other.
+    With disjoint substrings as bands (see BFLSH.substrings) the same structure is a multi-index hash.
+    '''
+
+    def __init__(self, positions, schema: RecordSchema):
+        '''
+        Parameters:
+            positions (Sequence[Sequence[int]]):    Sampled bit positions, one list of band_bits positions per band
+            schema (RecordSchema):                  Layout of the filters
+        '''
+        self.positions = np.asarray(positions, dtype=np.intp)
+        if self.positions.ndim != 2 or not 0 < self.positions.shape[1] <= 62:
+            raise ValueError(f"BFLSH: positions need the shape (bands, bits per band), bits per band 1 - 62, got {self.positions.shape}")
+        if self.positions.min() < 0 or self.positions.max() >= schema.total_bits:
+            raise ValueError(f"BFLSH: positions must lie in the {schema.total_bits} bits of the filter")
+        self.schema = schema
+        self._weights = np.left_shift(np.int64(1), np.arange(self.band_bits, dtype=np.int64))
+
+    @classmethod
+    def create(cls, bands: int, band_bits: int, schema: RecordSchema, seed: int | None = None) -> "BFLSH":
+        '''
+        Samples band_bits different bit positions for each of the bands.
+        '''
+        rng = np.random.default_rng(seed)
+        return cls([rng.choice(schema.total_bits, band_bits, replace=False) for _ in range(bands)], schema)
+
+    @classmethod
+    def substrings(cls, segments: list[int], amount: int, schema: RecordSchema) -> "BFLSH":
+        '''
+        Splits the bits of the given segments into amount disjoint substrings of equal length for multi-index hashing;
+        the remaining bits are left out.
+        '''
+        bits = [bit for index in segments for bit in range(schema.offsets[index], schema.offsets[index] + schema.sizes[index])]
+        length = len(bits) // amount
+        return cls([bits[i * length:(i + 1) * length] for i in range(amount)], schema)
+
+    @property
+    def bands(self) -> int:
+        return self.positions.shape[0]
+
+    @property
+    def band_bits(self) -> int:
+        return self.positions.shape[1]
+
+    def keys(self, filters) -> np.ndarray:
+        '''
+        Bucket of every filter in every band.
+
+        Parameters:
+            filters (bytes | bitarray | np.ndarray):    One filter or a uint8 matrix (N x total_bytes)
+
+        Returns:
+            np.ndarray:     int64 matrix (N x bands)
+        '''
+        if isinstance(filters, bitarray):
+            filters = filters.tobytes()
+        if isinstance(filters, (bytes, bytearray, memoryview)):
+            filters = np.frombuffer(filters, dtype=np.uint8)
+        filters = np.asarray(filters, dtype=np.uint8).reshape(-1, self.schema.total_bytes)
+        # Bit p of a filter is bit (7 - p % 8) of byte p // 8, like bitarray stores it
+        flat = self.positions.ravel()
+        bits = (filters[:, flat // 8] >> (7 - flat % 8).astype(np.uint8)) & 1
+        return bits.reshape(len(filters), self.bands, self.band_bits).astype(np.int64) @ self._weights
+
+    def swapped_query(self, bf) -> bytes:
+        '''
+        Returns bf with the first two segments (first and last name) exchanged, to probe for swapped names.
+        '''
+        bits = bitarray()
+        bits.frombytes(bf.tobytes() if isinstance(bf, bitarray) else bytes(bf))
+        (_, a0, a1), (_, b0, b1) = self.schema.segments()[:2]
+        if a1 - a0 != b1 - b0:
+            raise ValueError("BFLSH: first and last name segments need the same size to swap them")
+        bits[a0:a1], bits[b0:b1] = bits[b0:b1], bits[a0:a1]
+        return bits.tobytes()
@@ -0,0 +1,531 @@
+import math, heapq
+import numpy as np
+from bitarray import bitarray
+from config import GLOBAL_VAL
+from .bf_encoder import RecordSchema
+from .bf_utils import bf_get_rating
+from .bf_blob import bf_blob_decode
+
+
+# Rating codes of the vectorized functions, index = code
+BF_RATINGS = np.array(["strong", "medium", "weak", "not alike"])
+BF_STRONG, BF_MEDIUM, BF_WEAK, BF_NOT_ALIKE = range(4)
+
+# Rows processed at once; keeps the temporary AND matrix in the CPU cache
+BF_MATRIX_CHUNK = 1 << 15
+
+# Tile size of the batch comparison (queries x rows); the similarity tile has queries * rows * segments floats
+BF_BATCH_QUERIES = 256
+BF_BATCH_ROWS = 2048
+
+# Rows scored at once by BFMatrix.top_k; small, so the bound of the k-th best result tightens early
+BF_TOPK_CHUNK = 4096
+
+
+def bf_check_thresholds(thresholds: list[float]) -> list[float]:
+    '''
+    Validates the thresholds like bf_extended_similarity does and returns them sorted descending.
+    '''
+    assert len(thresholds) == 3, "bf_extended_similarity: thresholds needs to be a list of 3 floats"
+    thresholds = sorted(thresholds, reverse=True)
+    # Raises the same errors as bf_get_rating for invalid thresholds
+    bf_get_rating(thresholds, 0.0)
+    return thresholds
+
+
+def bf_rate(thresholds: list[float], similarities: np.ndarray) -> np.ndarray:
+    '''
+    Vectorized bf_get_rating.
+
+    Parameters:
+        thresholds (list[float]):   List of 3 thresholds, sorted descending
+        similarities (np.ndarray):  Similarities which will be rated
+
+    Returns:
+        np.ndarray:                 uint8 rating codes, see BF_RATINGS
+    '''
+    # Same branch order as bf_get_rating, so thresholds on the boundaries are rated identically
+    t0, t1, t2 = thresholds
+    codes = np.full(similarities.shape, BF_NOT_ALIKE, dtype=np.uint8)
+    codes[(t1 > similarities) & (similarities >= t2)] = BF_WEAK
+    codes[(t0 > similarities) & (similarities >= t1)] = BF_MEDIUM
+    codes[similarities > t0] = BF_STRONG
+    return codes
+
+
+def bf_dice(intersection: np.ndarray, count_a: np.ndarray, count_b: np.ndarray) -> np.ndarray:
+    '''
+    Vectorized bf_sorenson_dice from the popcounts; empty filters have the similarity 1.0.
+    '''
+    total = count_a + count_b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total == 0, 1.0, 2 * intersection / total)
+
+
+def bf_exact_total(similarities) -> float:
+    '''
+    Total similarity of one row exactly like bf_extended_similarity computes it (math.fsum / amount of segments).
+    '''
+    return math.fsum(similarities) / len(similarities) if len(similarities) else 0.0
+
+
+def bf_merge_matches(parts, k: int | None) -> tuple[np.ndarray, ...]:
+    '''
+    Merges the matches of many queries, given as parts of (query, row, total, swapped, similarities) arrays.
+
+    Returns:
+        tuple[np.ndarray, ...]:     The same five arrays sorted by query, the most similar first and ties by the lower row,
+                                    with at most k matches per query (all for k = None)
+    '''
+    query, row, total, swapped, sims = (np.concatenate(column) for column in zip(*parts))
+    order = np.lexsort((row, -total, query))
+    columns = [column[order] for column in (query, row, total, swapped, sims)]
+    if k is not None:
+        rank = np.arange(len(order)) - np.searchsorted(columns[0], columns[0])
+        columns = [column[rank < k] for column in columns]
+    return tuple(columns)
+
+
+def bf_exact_totals(similarities: np.ndarray, thresholds: list[float]) -> np.ndarray:
+    '''
+    Mean over the last axis of the segment similarities; exact (math.fsum) wherever it decides the rating.
+    '''
+    if not similarities.shape[-1]:
+        return np.zeros(similarities.shape[:-1])
+    # The plain sum may be off by an ulp compared to math.fsum; redo the rows where that can change the rating
+    totals = similarities.mean(axis=-1)
+    near = np.zeros(totals.shape, dtype=bool)
+    for threshold in thresholds:
+        near |= np.abs(totals - threshold) <= 1e-12
+    for row in zip(*np.nonzero(near)):
+        totals[row] = bf_exact_total(similarities[row])
+    return totals
+
+
+class BFMatrix:
+    '''
+    All stored bloomfilters of a table as one packed uint64 matrix for vectorized comparisons.
+
+    Every segment of the schema is packed into its own block of 64 bit words (zero padded), so the
+    intersection popcounts of all segments are a single AND + np.bitwise_count over the whole matrix.
+    '''
+
+    def __init__(self, ids, filters: np.ndarray, schema: RecordSchema):
+        '''
+        Parameters:
+            ids (Sequence[int]):        IDs of the rows, e.g. patient_id
+            filters (np.ndarray):       uint8 matrix (len(ids) x schema.total_bytes) of the filters as stored in the database
+            schema (RecordSchema):      Layout of the filters
+        '''
+        filters = np.asarray(filters, dtype=np.uint8).reshape(-1, schema.total_bytes)
+        if len(ids) != len(filters):
+            raise ValueError(f"BFMatrix: {len(ids)} ids for {len(filters)} filters")
+        self.schema = schema
+        self.ids = np.asarray(ids, dtype=np.int64)
+
+        self.words = self.pack(filters)
+        self.word_starts = np.cumsum([0] + self.segment_words[:-1])
+        self.counts = self._segment_counts(self.words)
+        # Paths of the words, counts and ids files if the matrix is memory-mapped from them (see db_cache_load)
+        self.files = None
+
+    @classmethod
+    def from_blobs(cls, rows, schema: RecordSchema) -> "BFMatrix":
+        '''
+        Builds the matrix from (id, BF blob) rows like they are returned by the database, packed or sparse (see bf_blob_decode).
+        '''
+        rows = list(rows)
+        ids = [row_id for row_id, _ in rows]
+        for row_id, blob in rows:
+            if len(blob) > schema.total_bytes:
+                raise ValueError(f"BFMatrix: filter of row {row_id} has {len(blob)} bytes, expected {schema.total_bytes}")
+        return cls(ids, bf_blob_decode([blob for _, blob in rows], schema.total_bytes), schema)
+
+    @classmethod
+    def from_packed(cls, ids, words: np.ndarray, counts: np.ndarray, schema: RecordSchema) -> "BFMatrix":
+        '''
+        Wraps rows already in the word layout (e.g. memory-mapped) and their segment popcounts without copying them.
+        '''
+        matrix = cls.__new__(cls)
+        matrix.schema = schema
+        matrix.ids = np.asarray(ids, dtype=np.int64)
+        if words.shape != (len(matrix.ids), sum(matrix.segment_words)) or counts.shape != (len(matrix.ids), len(schema)):
+            raise ValueError(f"BFMatrix: packed rows of shape {words.shape} / {counts.shape} do not match {len(matrix.ids)} ids")
+        matrix.words = words
+        matrix.word_starts = np.cumsum([0] + matrix.segment_words[:-1])
+        matrix.counts = counts
+        matrix.files = None
+        return matrix
+
+    def view(self, start: int, stop: int) -> "BFMatrix":
+        '''
+        Matrix of the rows start to stop, sharing their memory.
+        '''
+        return BFMatrix.from_packed(self.ids[start:stop], self.words[start:stop], self.counts[start:stop], self.schema)
+
+    def subset(self, rows: np.ndarray) -> "BFMatrix":
+        '''
+        Matrix of the selected rows.
+        '''
+        return BFMatrix.from_packed(self.ids[rows], self.words[rows], self.counts[rows], self.schema)
+
+    def filters(self, rows: slice | np.ndarray = slice(None)) -> np.ndarray:
+        '''
+        Unpacks the selected rows back into the filters as stored in the database.
+
+        Returns:
+            np.ndarray:     uint8 matrix (rows x schema.total_bytes)
+        '''
+        words = np.ascontiguousarray(self.words[rows]).view(np.uint8)
+        blocks = [words[:, start * 8:(start + length) * 8] for start, length in zip(self.word_starts, self.segment_words)]
+        if all(offset % 8 == 0 for offset in self.schema.offsets + [self.schema.total_bits]):
+            return np.concatenate([block[:, :size // 8] for block, size in zip(blocks, self.schema.sizes)], axis=1)
+        bits = np.concatenate([np.unpackbits(block, axis=1)[:, :size] for block, size in zip(blocks, self.schema.sizes)], axis=1)
+        return np.packbits(bits, axis=1)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def segment_words(self) -> list[int]:
+        return [(size + 63) // 64 for size in self.schema.sizes]
+
+    def pack(self, filters: np.ndarray) -> np.ndarray:
+        '''
+        Packs filters (uint8 matrix, one row per filter) into the word layout of the matrix.
+        '''
+        filters = np.asarray(filters, dtype=np.uint8).reshape(-1, self.schema.total_bytes)
+        blocks = []
+        for (_, start, end), words in zip(self.schema.segments(), self.segment_words):
+            if start % 8 == 0 and end % 8 == 0:
+                segment = filters[:, start // 8:end // 8]
+            else:
+                segment = np.packbits(np.unpackbits(filters, axis=1)[:, start:end], axis=1)
+            block = np.zeros((len(filters), words * 8), dtype=np.uint8)
+            block[:, :segment.shape[1]] = segment
+            blocks.append(block)
+        return np.ascontiguousarray(np.concatenate(blocks, axis=1)).view(np.uint64)
+
+    def pack_query(self, bf) -> np.ndarray:
+        '''
+        Packs a single filter (bitarray or bytes) into one row of the word layout.
+        '''
+        data = bf.tobytes() if isinstance(bf, bitarray) else bytes(bf)
+        if len(data) != self.schema.total_bytes:
+            raise ValueError(f"BFMatrix: filter has {len(data)} bytes, expected {self.schema.total_bytes}")
+        return self.pack(np.frombuffer(data, dtype=np.uint8))[0]
+
+    def _segment_counts(self, words: np.ndarray) -> np.ndarray:
+        return np.add.reduceat(np.bitwise_count(words), self.word_starts, axis=1, dtype=np.int32) if len(words) \
+            else np.zeros((0, len(self.schema)), dtype=np.int32)
+
+    def intersections(self, query: np.ndarray, rows: slice | np.ndarray = slice(None)) -> np.ndarray:
+        '''
+        Per-segment popcounts of (row & query) for the selected rows.
+
+        Parameters:
+            query (np.ndarray):     Packed query, see pack_query
+            rows (slice | np.ndarray): Selected rows; default = all rows
+
+        Returns:
+            np.ndarray:             int32 matrix (rows x segments)
+        '''
+        return self._segment_counts(self.words[rows] & query)
+
+    def dice(self, bf, rows: slice | np.ndarray = slice(None)) -> np.ndarray:
+        '''
+        Sorenson-Dice similarity of every segment of the selected rows with bf.
+
+        Returns:
+            np.ndarray:     float64 matrix (rows x segments), equal to bf_sorenson_dice of the segments
+        '''
+        query = self.pack_query(bf)
+        query_counts = self._segment_counts(query[None, :])[0]
+        return bf_dice(self.intersections(query, rows), self.counts[rows], query_counts)
+
+    def filter_dice(self, bf) -> np.ndarray:
+        '''
+        Sorenson-Dice similarity of the whole filters of all rows with bf.
+
+        Returns:
+            np.ndarray:     float64, equal to bf_sorenson_dice of the complete filters
+        '''
+        query = self.pack_query(bf)
+        query_count = int(np.bitwise_count(query).sum())
+        sims = np.empty(len(self), dtype=np.float64)
+        for start in range(0, len(self), BF_MATRIX_CHUNK):
+            rows = slice(start, start + BF_MATRIX_CHUNK)
+            intersection = np.bitwise_count(self.words[rows] & query).sum(axis=1, dtype=np.int64)
+            sims[rows] = bf_dice(intersection, self.counts[rows].sum(axis=1, dtype=np.int64), query_count)
+        return sims
+
+    def _swap_dice(self, query: np.ndarray, query_counts: np.ndarray, rows: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Dice of (row first name, query last name) and (row last name, query first name)
+        a, b = (slice(self.word_starts[i], self.word_starts[i] + self.segment_words[i]) for i in (0, 1))
+        words = self.words[rows]
+        new1 = bf_dice(np.bitwise_count(words[:, a] & query[b]).sum(axis=1, dtype=np.int32), self.counts[rows, 0], query_counts[1])
+        new2 = bf_dice(np.bitwise_count(words[:, b] & query[a]).sum(axis=1, dtype=np.int32), self.counts[rows, 1], query_counts[0])
+        return new1, new2
+
+    def _swap_check(self, query: np.ndarray, query_counts: np.ndarray, sims: np.ndarray, rows: np.ndarray,
+                    thresholds: list[float], swap: bool) -> np.ndarray:
+        # Swap detection of bf_extended_similarity for the given rows; sims (rows x segments) is updated if swap is True
+        swapped = np.zeros(len(rows), dtype=bool)
+        if len(self.schema) < 4:
+            return swapped
+        ratings = bf_rate(thresholds, sims[:, :4])
+        candidates = np.flatnonzero((ratings[:, 0] >= BF_WEAK) & (ratings[:, 1] >= BF_WEAK)
+                                    & ~((ratings[:, 2] == BF_NOT_ALIKE) & (ratings[:, 3] == BF_NOT_ALIKE)))
+        if len(candidates):
+            if self.schema.sizes[0] != self.schema.sizes[1]:
+                raise ValueError(f"Bitarrays sind nicht gleich lang\n Array A: {self.schema.sizes[0]}, Array B: {self.schema.sizes[1]}")
+            new1, new2 = self._swap_dice(query, query_counts, rows[candidates])
+            hit = ((sims[candidates, 0] < new1) & (new1 > thresholds[-1])
+                   & (sims[candidates, 1] < new2) & (new2 > thresholds[-1]))
+            swapped[candidates[hit]] = True
+            if swap:
+                sims[candidates[hit], 0] = new1[hit]
+                sims[candidates[hit], 1] = new2[hit]
+        return swapped
+
+    def extended_similarity(self, bf,
+                            thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+                            swap: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Vectorized bf_extended_similarity of bf against every row of the matrix.
+
+        Parameters:
+            bf (bitarray | bytes):      Bloomfilter we want to compare to the stored ones
+            thresholds (list[float]):   List of thresholds used for the similarity rating
+            swap (bool) (optional):     If True the first/last name similarities of suspected swaps are replaced,
+                                        see bf_extended_similarity
+
+        Returns:
+            np.ndarray:     float64 matrix (rows x segments) of the segment similarities (after the swap)
+            np.ndarray:     float64 total similarity of every row; exact (math.fsum) wherever it decides the rating
+            np.ndarray:     bool, True where a first/last name swap is suspected
+        '''
+        thresholds = bf_check_thresholds(thresholds)
+
+        query = self.pack_query(bf)
+        query_counts = self._segment_counts(query[None, :])[0]
+        sims = np.empty((len(self), len(self.schema)), dtype=np.float64)
+        for start in range(0, len(self), BF_MATRIX_CHUNK):
+            rows = slice(start, start + BF_MATRIX_CHUNK)
+            sims[rows] = bf_dice(self.intersections(query, rows), self.counts[rows], query_counts)
+
+        swapped = self._swap_check(query, query_counts, sims, np.arange(len(self)), thresholds, swap)
+        return sims, bf_exact_totals(sims, thresholds), swapped
+
+    def extended_matches(self, bf,
+                         thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+                         lowest_rating: int = BF_WEAK,
+                         swap: bool = False,
+                         include_notalike: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        extended_similarity, reduced to the rows rated lowest_rating or better, the suspected swaps for BF_WEAK
+        and all rows with include_notalike.
+
+        Returns:
+            np.ndarray:     Selected rows
+            np.ndarray:     Their segment similarities, total similarities and swap flags, see extended_similarity
+        '''
+        sims, totals, swapped = self.extended_similarity(bf, thresholds, swap)
+        ratings = bf_rate(bf_check_thresholds(thresholds), totals)
+        rows = np.flatnonzero((ratings <= lowest_rating) | (swapped & (lowest_rating == BF_WEAK)) | include_notalike)
+        return rows, sims[rows], totals[rows], swapped[rows]
+
+    def top_k(self, bf, k: int,
+              thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+              lowest_rating: int = BF_WEAK,
+              swap: bool = False,
+              chunk: int = BF_TOPK_CHUNK) -> list[tuple[int, float, bool, np.ndarray]]:
+        '''
+        The k rows with the highest total similarity to bf which are rated lowest_rating or better
+        (or, for BF_WEAK, are suspected swaps), like extended_similarity rates them.
+
+        The popcounts bound every segment similarity by 2 * min(|A|, |B|) / (|A| + |B|). Rows are scored in the order
+        of their bound, segment by segment, and dropped as soon as the mean of the exact and the remaining bounded
+        segments can no longer beat the k-th best result on a bounded heap; once the bound of the next chunk is
+        too low, the scan stops.
+
+        Parameters:
+            bf (bitarray | bytes):      Bloomfilter we want to compare to the stored ones
+            k (int):                    Amount of results
+            thresholds (list[float]):   List of thresholds used for the similarity rating
+            lowest_rating (int):        Lowest rating code of a result, see BF_RATINGS
+            swap (bool) (optional):     If True the first/last name similarities of suspected swaps are replaced
+            chunk (int):                Rows scored at once
+
+        Returns:
+            list[tuple[int, float, bool, np.ndarray]]:  (row, total similarity, swap suspected, segment similarities)
+                                                        of the results, the best first; ties by the lower row
+        '''
+        if k < 1:
+            raise ValueError(f"BFMatrix: k must be at least 1, got {k}")
+        thresholds = bf_check_thresholds(thresholds)
+        segments = len(self.schema)
+        query = self.pack_query(bf)
+        query_counts = self._segment_counts(query[None, :])[0]
+
+        bounds = bf_dice(np.minimum(self.counts, query_counts), self.counts, query_counts)
+        exchange = swap and segments >= 4
+        if exchange:
+            # A swap replaces the first and last name similarities by the cross similarities, bound those as well
+            for a, b in ((0, 1), (1, 0)):
+                cross = bf_dice(np.minimum(self.counts[:, a], query_counts[b]), self.counts[:, a], query_counts[b])
+                bounds[:, a] = np.maximum(bounds[:, a], cross)
+        total_bounds = bounds.mean(axis=1) if segments else np.zeros(len(self))
+        order = np.argsort(-total_bounds, kind="stable")
+        # Without a full heap a result needs the threshold of lowest_rating, suspected swaps excepted
+        floor = -np.inf if lowest_rating == BF_WEAK else thresholds[lowest_rating]
+
+        heap = []
+        for start in range(0, len(order), chunk):
+            cutoff = heap[0][0] if len(heap) == k else floor
+            rows = order[start:start + chunk]
+            # The tolerance keeps float rounding of the bounds from dropping a row
+            if total_bounds[rows[0]] + 1e-9 < cutoff:
+                break
+            upper = bounds[rows]
+            sims = np.empty(upper.shape)
+            for segment in range(segments):
+                keep = upper.mean(axis=1) + 1e-9 >= cutoff
+                rows, upper, sims = rows[keep], upper[keep], sims[keep]
+                if not len(rows):
+                    break
+                words = slice(self.word_starts[segment], self.word_starts[segment] + self.segment_words[segment])
+                intersection = np.bitwise_count(self.words[rows, words] & query[words]).sum(axis=1, dtype=np.int32)
+                sims[:, segment] = bf_dice(intersection, self.counts[rows, segment], query_counts[segment])
+                upper[:, segment] = np.maximum(sims[:, segment], upper[:, segment]) if exchange and segment < 2 else sims[:, segment]
+            if not len(rows):
+                continue
+
+            swapped = self._swap_check(query, query_counts, sims, rows, thresholds, swap)
+            totals = bf_exact_totals(sims, thresholds)
+            ratings = bf_rate(thresholds, totals)
+            for i in np.flatnonzero((ratings <= lowest_rating) | (swapped & (lowest_rating == BF_WEAK))):
+                # Rows are unique, so the tuples never compare further than (total, -row)
+                item = (float(totals[i]), -int(rows[i]), bool(swapped[i]), sims[i])
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif item[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, item)
+        return [(-row, total, swapped, sims) for total, row, swapped, sims in sorted(heap, key=lambda item: item[:2], reverse=True)]
+
+    def pack_queries(self, filters) -> np.ndarray:
+        '''
+        Packs many filters (bitarrays, bytes or a uint8 matrix) into rows of the word layout.
+        '''
+        if not isinstance(filters, np.ndarray):
+            filters = [bf.tobytes() if isinstance(bf, bitarray) else bytes(bf) for bf in filters]
+            for data in filters:
+                if len(data) != self.schema.total_bytes:
+                    raise ValueError(f"BFMatrix: filter has {len(data)} bytes, expected {self.schema.total_bytes}")
+            filters = np.frombuffer(b"".join(filters), dtype=np.uint8)
+        return self.pack(filters)
+
+    def _segment_bits(self) -> list[slice]:
+        # Bit columns of every segment block in unpack_bits
+        return [slice(start * 64, (start + words) * 64) for start, words in zip(self.word_starts, self.segment_words)]
+
+    @staticmethod
+    def unpack_bits(words: np.ndarray) -> np.ndarray:
+        '''
+        Unpacks packed rows into one float32 column per bit, so intersections of many rows become a matrix product.
+        '''
+        return np.unpackbits(np.ascontiguousarray(words).view(np.uint8), axis=1).astype(np.float32)
+
+    def batch_extended_similarity(self, queries: np.ndarray,
+                                  thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+                                  swap: bool = False,
+                                  rows: slice = slice(None)) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        extended_similarity of a block of queries against a tile of rows at once.
+
+        The intersection popcounts of every segment are the product of the unpacked query bits with the unpacked
+        row bits; float32 is exact for them. Query and row tile should be small enough (see BF_BATCH_QUERIES and
+        BF_BATCH_ROWS) to keep the queries x rows x segments result in memory.
+
+        Parameters:
+            queries (np.ndarray):       Packed queries, see pack_queries
+            thresholds (list[float]):   List of thresholds used for the similarity rating
+            swap (bool) (optional):     If True the first/last name similarities of suspected swaps are replaced
+            rows (slice):               Tile of rows compared; default = all rows
+
+        Returns:
+            np.ndarray:     float64 array (queries x rows x segments) of the segment similarities (after the swap)
+            np.ndarray:     float64 matrix (queries x rows) of the total similarities, see extended_similarity
+            np.ndarray:     bool matrix (queries x rows), True where a first/last name swap is suspected
+        '''
+        thresholds = bf_check_thresholds(thresholds)
+        query_counts = self._segment_counts(queries)
+        counts = self.counts[rows]
+        query_bits, row_bits = self.unpack_bits(queries), self.unpack_bits(self.words[rows])
+        bits = self._segment_bits()
+
+        def dice(query_segment: int, row_segment: int) -> np.ndarray:
+            intersection = (query_bits[:, bits[query_segment]] @ row_bits[:, bits[row_segment]].T).astype(np.int32)
+            return bf_dice(intersection, query_counts[:, query_segment, None], counts[:, row_segment])
+
+        sims = np.stack([dice(i, i) for i in range(len(self.schema))], axis=-1) if len(self.schema) \
+            else np.zeros((len(queries), len(counts), 0))
+
+        swapped = np.zeros(sims.shape[:2], dtype=bool)
+        if len(self.schema) >= 4:
+            ratings = bf_rate(thresholds, sims[..., :4])
+            candidates = ((ratings[..., 0] >= BF_WEAK) & (ratings[..., 1] >= BF_WEAK)
+                          & ~((ratings[..., 2] == BF_NOT_ALIKE) & (ratings[..., 3] == BF_NOT_ALIKE)))
+            if candidates.any():
+                if self.schema.sizes[0] != self.schema.sizes[1]:
+                    raise ValueError(f"Bitarrays sind nicht gleich lang\n Array A: {self.schema.sizes[0]}, Array B: {self.schema.sizes[1]}")
+                new1, new2 = dice(1, 0), dice(0, 1)
+                swapped = (candidates & (sims[..., 0] < new1) & (new1 > thresholds[-1])
+                           & (sims[..., 1] < new2) & (new2 > thresholds[-1]))
+                if swap:
+                    sims[..., 0] = np.where(swapped, new1, sims[..., 0])
+                    sims[..., 1] = np.where(swapped, new2, sims[..., 1])
+
+        return sims, bf_exact_totals(sims, thresholds), swapped
+
+    def batch_top_k(self, queries: np.ndarray, k: int | None,
+                    thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+                    lowest_rating: int = BF_WEAK,
+                    swap: bool = False,
+                    include_notalike: bool = False,
+                    row_tile: int = BF_BATCH_ROWS) -> tuple[np.ndarray, ...]:
+        '''
+        The k best matches of every query, selected like extended_matches; the rows are compared tile by tile
+        (see batch_extended_similarity) and only the k best matches of each query are kept between the tiles.
+
+        Parameters:
+            queries (np.ndarray):       Packed queries, see pack_queries
+            k (int | None):             Amount of matches kept per query; None keeps all
+            thresholds (list[float]):   List of thresholds used for the similarity rating
+            lowest_rating (int):        Lowest rating code of a match, see BF_RATINGS
+            swap (bool) (optional):     If True the first/last name similarities of suspected swaps are replaced
+            include_notalike (bool):    If True, rows rated below lowest_rating are matches too
+            row_tile (int):             Amount of rows compared at once
+
+        Returns:
+            tuple[np.ndarray, ...]:     Matches as (query, row, total, swapped, similarities), see bf_merge_matches
+        '''
+        thresholds = bf_check_thresholds(thresholds)
+        kept = (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp), np.zeros(0), np.zeros(0, dtype=bool),
+                np.zeros((0, len(self.schema))))
+        worst = np.full(len(queries), -np.inf)
+
+        for start in range(0, len(self), row_tile):
+            sims, totals, swapped = self.batch_extended_similarity(queries, thresholds, swap, slice(start, start + row_tile))
+            ratings = bf_rate(thresholds, totals)
+            selected = (ratings <= lowest_rating) | (swapped & (lowest_rating == BF_WEAK)) | include_notalike
+            # Rows that cannot enter the top k of their query are dropped before the merge
+            query, row = np.nonzero(selected & (totals >= worst[:, None]))
+            if not len(query):
+                continue
+            kept = bf_merge_matches([kept, (query, row + start, totals[query, row], swapped[query, row], sims[query, row])], k)
+            if k is not None:
+                bounds = np.searchsorted(kept[0], np.arange(len(queries) + 1))
+                full = np.flatnonzero(np.diff(bounds) == k)
+                worst[full] = kept[2][bounds[full] + k - 1]
+        return kept
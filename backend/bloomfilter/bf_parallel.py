@@ -0,0 +1,208 @@
+import heapq
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from config import GLOBAL_VAL
+from .bf_encoder import RecordSchema
+from .bf_matrix import BFMatrix, BF_WEAK, BF_BATCH_ROWS, bf_merge_matches
+
+
+class BFMatrixHandle:
+    '''
+    Picklable reference to the arrays of a BFMatrix which worker processes open without copying them:
+    either the memory-mapped cache files of the matrix or a multiprocessing.shared_memory block (see bf_share_matrix).
+    '''
+
+    def __init__(self, location: str, arrays: dict, schema: RecordSchema, shared: bool):
+        '''
+        Parameters:
+            location (str):         Name of the shared memory block, or the directory of the files
+            arrays (dict):          (offset, dtype, shape) of "words", "counts" and "ids" in the block,
+                                    or (path, dtype, shape) of their files
+            schema (RecordSchema):  Layout of the filters
+            shared (bool):          True for a shared memory block
+        '''
+        self.location = location
+        self.arrays = arrays
+        self.schema = schema
+        self.shared = shared
+
+    @property
+    def key(self) -> tuple:
+        return (self.location, self.shared, self.arrays["ids"][2])
+
+    def open(self) -> tuple[BFMatrix, shared_memory.SharedMemory | None]:
+        '''
+        Opens the matrix; returns it together with the shared memory block it lives in (None for files).
+        '''
+        if self.shared:
+            block = shared_memory.SharedMemory(name=self.location)
+            arrays = {name: np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+                      for name, (offset, dtype, shape) in self.arrays.items()}
+        else:
+            block = None
+            arrays = {name: np.memmap(path, dtype=dtype, mode="r", shape=shape) if shape[0] else np.zeros(shape, dtype=dtype)
+                      for name, (path, dtype, shape) in self.arrays.items()}
+        return BFMatrix.from_packed(arrays["ids"].reshape(-1), arrays["words"], arrays["counts"], self.schema), block
+
+
+def bf_share_matrix(matrix: BFMatrix) -> tuple[BFMatrixHandle, shared_memory.SharedMemory | None]:
+    '''
+    Function making a BFMatrix available to worker processes.
+
+    A matrix memory-mapped from the cache files is shared through the files themselves (the pages are shared by the OS);
+    any other matrix is copied once into a new shared memory block, which the caller has to close and unlink.
+
+    Parameters:
+        matrix (BFMatrix):  Matrix to share
+
+    Returns:
+        BFMatrixHandle:                         Handle the workers open
+        shared_memory.SharedMemory | None:      The new shared memory block, None for files
+    '''
+    columns = {"words": matrix.words, "counts": matrix.counts, "ids": matrix.ids.reshape(-1, 1)}
+    if matrix.files is not None:
+        return BFMatrixHandle(str(matrix.files["words"].parent),
+                              {name: (str(matrix.files[name]), array.dtype.str, array.shape) for name, array in columns.items()},
+                              matrix.schema, False), None
+
+    arrays, size = {}, 0
+    for name, array in columns.items():
+        arrays[name] = (size, array.dtype.str, array.shape)
+        # Every array starts 8 byte aligned
+        size += (array.nbytes + 7) // 8 * 8
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, array in columns.items():
+        offset, dtype, shape = arrays[name]
+        np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)[...] = array
+    return BFMatrixHandle(block.name, arrays, matrix.schema, True), block
+
+
+# Memory-mapped matrices opened by this (worker) process, the last few are kept for the next tasks
+_OPENED = {}
+_OPENED_MAX = 2
+
+
+@contextmanager
+def _open(handle: BFMatrixHandle):
+    if not handle.shared:
+        if handle.key not in _OPENED:
+            while len(_OPENED) >= _OPENED_MAX:
+                _OPENED.pop(next(iter(_OPENED)))
+            _OPENED[handle.key] = handle.open()[0]
+        yield _OPENED[handle.key]
+        return
+
+    # A shared memory block is only used by one call, so it is not kept
+    matrix, block = handle.open()
+    try:
+        yield matrix
+    finally:
+        del matrix
+        try:
+            block.close()
+        except BufferError:
+            pass
+
+
+def _extended_shard(handle: BFMatrixHandle, start: int, stop: int, bf: bytes, thresholds, lowest_rating, swap, include_notalike):
+    with _open(handle) as matrix:
+        rows, sims, totals, swapped = matrix.view(start, stop).extended_matches(bf, thresholds, lowest_rating, swap, include_notalike)
+    return rows + start, sims, totals, swapped
+
+
+def _top_k_shard(handle: BFMatrixHandle, start: int, stop: int, bf: bytes, k, thresholds, lowest_rating, swap):
+    with _open(handle) as matrix:
+        matches = matrix.view(start, stop).top_k(bf, k, thresholds, lowest_rating, swap)
+    return [(row + start, total, swapped, sims) for row, total, swapped, sims in matches]
+
+
+def _batch_shard(handle: BFMatrixHandle, start: int, stop: int, queries, k, thresholds, lowest_rating, swap, include_notalike, row_tile):
+    with _open(handle) as matrix:
+        query, row, total, swapped, sims = matrix.view(start, stop).batch_top_k(
+            queries, k, thresholds, lowest_rating, swap, include_notalike, row_tile)
+    return query, row + start, total, swapped, sims
+
+
+_POOL = None
+_POOL_WORKERS = 0
+
+
+def bf_get_pool(workers: int) -> ProcessPoolExecutor:
+    '''
+    Function returning the shared process pool of the parallel relink, (re)created for the given amount of workers.
+    '''
+    global _POOL, _POOL_WORKERS
+    if _POOL is None or _POOL_WORKERS != workers:
+        if _POOL is not None:
+            _POOL.shutdown()
+        _POOL, _POOL_WORKERS = ProcessPoolExecutor(max_workers=workers), workers
+    return _POOL
+
+
+def bf_shutdown_pool() -> None:
+    '''
+    Function stopping the worker processes of the parallel relink.
+    '''
+    global _POOL, _POOL_WORKERS
+    if _POOL is not None:
+        _POOL.shutdown(cancel_futures=True)
+    _POOL, _POOL_WORKERS = None, 0
+
+
+def _run_shards(matrix: BFMatrix, workers: int, task, *args) -> list:
+    # Contiguous shards, two per worker so a slow shard does not hold up the others
+    handle, block = bf_share_matrix(matrix)
+    try:
+        shards = np.linspace(0, len(matrix), 2 * workers + 1).astype(int)
+        pool = bf_get_pool(workers)
+        futures = [pool.submit(task, handle, int(start), int(stop), *args)
+                   for start, stop in zip(shards[:-1], shards[1:]) if stop > start]
+        return [future.result() for future in futures]
+    finally:
+        if block is not None:
+            block.close()
+            block.unlink()
+
+
+def bf_parallel_extended_matches(matrix: BFMatrix, bf, workers: int,
+                                 thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+                                 lowest_rating: int = BF_WEAK,
+                                 swap: bool = False,
+                                 include_notalike: bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    BFMatrix.extended_matches, with the rows split into shards scored by a pool of worker processes.
+    '''
+    bf = bf.tobytes() if hasattr(bf, "tobytes") else bytes(bf)
+    parts = _run_shards(matrix, workers, _extended_shard, bf, thresholds, lowest_rating, swap, include_notalike)
+    if not parts:
+        return matrix.extended_matches(bf, thresholds, lowest_rating, swap, include_notalike)
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def bf_parallel_top_k(matrix: BFMatrix, bf, k: int, workers: int,
+                      thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+                      lowest_rating: int = BF_WEAK,
+                      swap: bool = False) -> list[tuple[int, float, bool, np.ndarray]]:
+    '''
+    BFMatrix.top_k, with every worker process finding the top k of its shard; the partial lists are merged.
+    '''
+    bf = bf.tobytes() if hasattr(bf, "tobytes") else bytes(bf)
+    parts = _run_shards(matrix, workers, _top_k_shard, bf, k, thresholds, lowest_rating, swap)
+    return heapq.nsmallest(k, (match for part in parts for match in part), key=lambda match: (-match[1], match[0]))
+
+
+def bf_parallel_batch_top_k(matrix: BFMatrix, queries: np.ndarray, k: int | None, workers: int,
+                            thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+                            lowest_rating: int = BF_WEAK,
+                            swap: bool = False,
+                            include_notalike: bool = False,
+                            row_tile: int = BF_BATCH_ROWS) -> tuple[np.ndarray, ...]:
+    '''
+    BFMatrix.batch_top_k, with every worker process comparing all queries with its shard; the partial lists are merged.
+    '''
+    parts = _run_shards(matrix, workers, _batch_shard, queries, k, thresholds, lowest_rating, swap, include_notalike, row_tile)
+    if not parts:
+        return matrix.batch_top_k(queries, k, thresholds, lowest_rating, swap, include_notalike, row_tile)
+    return bf_merge_matches(parts, k)
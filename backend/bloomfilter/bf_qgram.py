@@ -0,0 +1,250 @@
+from bitarray import bitarray
+from bitarray.util import int2ba
+import mmh3, json, os, atexit, hashlib, math
+import numpy as np
+from backend.data import normalize_date, gen_qgram
+from config import PATHS, BLOOMFILTER_SETTINGS
+
+
+def bf_tokenize(text: str, normMode: str) -> list[str]:
+    '''
+    Helper function splitting the input of a bloomfilter into the tokens which get q-grammed.
+
+    Parameters:
+        text (str):                         Any string, which will be fed into the bloomfilter
+        normMode (str = "date" | "word"):   Determines if we use the normalization for words or dates
+
+    Returns:
+        list[str]:                          Tokens of the input
+    '''
+    if normMode == "date": return [normalize_date(text)]
+    # The stored filters are built from the split words as they are
+    if normMode == "word": return text.split()
+    return list(text)
+
+
+# Version tags of the encoding schemes; filters of different versions must never be compared
+BF_SCHEME_VERSIONS = {"seeded": 1,
+                      "double": 3}
+
+
+def bf_scheme_version(scheme: str) -> int:
+    '''
+    Helper function returning the version tag of an encoding scheme.
+
+    Parameters:
+        scheme (str = "seeded" | "double"):     Encoding scheme
+
+    Returns:
+        int:                                    Version tag of the scheme
+    '''
+    if scheme not in BF_SCHEME_VERSIONS:
+        raise ValueError(f"bf_scheme_version: unknown encoding scheme {scheme!r}, use one of {list(BF_SCHEME_VERSIONS)}")
+    return BF_SCHEME_VERSIONS[scheme]
+
+
+def bf_qgram_positions(qgram: str, hash_runs: int, hash_seeds: list[int], array_size: int,
+                       scheme: str = BLOOMFILTER_SETTINGS.ENCODING_SCHEME) -> list[int]:
+    '''
+    Helper function returning the bit positions a single q-gram sets in a bloomfilter.
+
+    Parameters:
+        qgram (str):                            q-gram which will be hashed
+        hash_runs (int):                        Amount of hash runs; hash_runs - 1 positions are generated
+        hash_seeds (list[int]):                 List of Seeds, which will be used in the implemented hash-function
+        array_size (int):                       Amount of bits in the bloomfilter
+        scheme (str = "seeded" | "double"):     "seeded" = one mmh3.hash per seed,
+                                                "double" = one mmh3.hash128 with the first seed, split into two 64 bit
+                                                hashes h1, h2 and combined to h1 + i * h2 (Kirsch-Mitzenmacher),
+                                                the step h2 is non-zero and coprime to array_size
+
+    Returns:
+        list[int]:                              Bit positions of the q-gram
+    '''
+    if scheme == "double":
+        digest = mmh3.hash128(qgram, hash_seeds[0])
+        # (h1 + i * h2) % m == (h1 % m + i * (h2 % m)) % m, so the positions can be stepped with a range
+        h1, h2 = (digest & 0xFFFFFFFFFFFFFFFF) % array_size, 1 + (digest >> 64) % max(array_size - 1, 1)
+        # A step sharing a divisor with m only reaches m / gcd positions, so it is moved to the next coprime one
+        while math.gcd(h2, array_size) != 1:
+            h2 += 1
+        return [pos % array_size for pos in range(h1, h1 + (hash_runs - 1) * h2, h2)]
+    if scheme != "seeded":
+        bf_scheme_version(scheme)
+    return [mmh3.hash(qgram, seed=hash_seeds[run]) % array_size for run in range(hash_runs - 1)]
+
+
+# q-grams hashed to fingerprint the position function of a table
+_PROBE_QGRAMS = ["_a", "ab", "mü", "9_", "__"]
+
+
+class BFQGramTable:
+    '''
+    Lookup table of the bit positions of every q-gram seen so far for one (seeds, array_size, qSize, scheme) configuration.
+
+    Entries are hashed lazily on first sight, so encoding a known string is reduced to OR-ing cached masks.
+    The table lives in memory; only if a table_dir is given it is also persisted there as JSON. The files hold
+    the q-grams of the encoded names in plaintext.
+    '''
+
+    def __init__(self, hash_runs: int,
+                 hash_seeds: list[int],
+                 array_size: int,
+                 qSize: int = BLOOMFILTER_SETTINGS.QSIZE,
+                 table_dir: str | None = None,
+                 scheme: str = BLOOMFILTER_SETTINGS.ENCODING_SCHEME):
+        self.hash_runs = hash_runs
+        self.hash_seeds = list(hash_seeds[:hash_runs - 1])
+        self.array_size = array_size
+        self.qSize = qSize
+        self.scheme = scheme
+        self.version = bf_scheme_version(scheme)
+        self.probe_digest = self._probe_digest()
+
+        config = json.dumps([self.hash_seeds, array_size, qSize, self.version])
+        self.path = None if table_dir is None else \
+            os.path.join(table_dir, f"qgrams_{hashlib.sha1(config.encode()).hexdigest()[:16]}.json")
+
+        self._positions = {}
+        self._masks = {}
+        self._arrays = {}
+        self._dirty = False
+        self.load()
+
+    def _probe_digest(self) -> str:
+        # Fingerprint of the current position function, a changed hashing invalidates persisted tables
+        probes = {qgram: bf_qgram_positions(qgram, self.hash_runs, self.hash_seeds, self.array_size, self.scheme)
+                  for qgram in _PROBE_QGRAMS}
+        return hashlib.sha1(json.dumps(probes).encode()).hexdigest()
+
+    def load(self) -> None:
+        '''
+        Loads the persisted table; files written for another configuration or position function are ignored.
+        '''
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if (data.get("hash_seeds") != self.hash_seeds or data.get("array_size") != self.array_size
+                or data.get("qSize") != self.qSize or data.get("version", 1) != self.version
+                or data.get("probe_digest") != self.probe_digest):
+            return
+        for qgram, positions in data["positions"].items():
+            self._positions.setdefault(qgram, tuple(positions))
+
+    def save(self) -> None:
+        '''
+        Writes the table to disk if it is persisted and new q-grams were added since the last save.
+        '''
+        if self.path is None or not self._dirty:
+            return
+        data = {"hash_seeds": self.hash_seeds,
+                "array_size": self.array_size,
+                "qSize": self.qSize,
+                "version": self.version,
+                "probe_digest": self.probe_digest,
+                "positions": self._positions}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except OSError as e:
+            print(f"Fehler beim Speichern der q-Gram Tabelle: {e}")
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def positions(self, qgram: str) -> tuple[int, ...]:
+        '''
+        Returns the bit positions of a q-gram, hashing it on first use.
+        '''
+        positions = self._positions.get(qgram)
+        if positions is None:
+            positions = self._positions[qgram] = tuple(bf_qgram_positions(qgram, self.hash_runs, self.hash_seeds, self.array_size, self.scheme))
+            self._dirty = True
+        return positions
+
+    def positions_array(self, qgram: str) -> np.ndarray:
+        '''
+        Returns the bit positions of a q-gram as a NumPy index array.
+        '''
+        array = self._arrays.get(qgram)
+        if array is None:
+            array = self._arrays[qgram] = np.array(self.positions(qgram), dtype=np.intp)
+        return array
+
+    def mask(self, qgram: str) -> int:
+        '''
+        Returns the bits of a q-gram as an int; bit position p of the bloomfilter is bit (array_size - 1 - p) of the int.
+        '''
+        mask = self._masks.get(qgram)
+        if mask is None:
+            mask = 0
+            for ix in self.positions(qgram):
+                mask |= 1 << (self.array_size - 1 - ix)
+            self._masks[qgram] = mask
+        return mask
+
+    def encode(self, text: str, normMode: str, padding: bool = BLOOMFILTER_SETTINGS.PADDING) -> bitarray:
+        '''
+        Generates the same bloomfilter as get_bloomfilter by OR-ing the cached q-gram masks.
+
+        Parameters:
+            text (str):                         Any string, which will be fed into the bloomfilter
+            normMode (str = "date" | "word"):   Determines if we use the normalization for words or dates
+            padding (bool):                     true = Tom -> _Tom_ , false Tom -> Tom
+
+        Returns:
+            bitarray:                           Bloomfilter
+        '''
+        mask = 0
+        for val in bf_tokenize(text, normMode):
+            for qgram in gen_qgram(val, self.qSize, padding):
+                mask |= self.mask(qgram)
+        return int2ba(mask, length=self.array_size)
+
+
+_QGRAM_TABLES = {}
+
+def bf_get_qgram_table(hash_runs: int,
+                       hash_seeds: list[int],
+                       array_size: int,
+                       qSize: int = BLOOMFILTER_SETTINGS.QSIZE,
+                       table_dir: str | None = PATHS.QGRAM_TABLE_DIR if BLOOMFILTER_SETTINGS.PERSIST_QGRAM_TABLE else None,
+                       scheme: str = BLOOMFILTER_SETTINGS.ENCODING_SCHEME) -> BFQGramTable:
+    '''
+    Function returning the shared q-gram table of a configuration; the table is built once per process.
+    Persisted tables (BLOOMFILTER_SETTINGS.PERSIST_QGRAM_TABLE) are loaded on first use and saved when the interpreter exits.
+
+    Parameters:
+        hash_runs (int):            Amount of hash runs; hash_runs - 1 seeds are used
+        hash_seeds (list[int]):     List of Seeds, which will be used in the implemented hash-function
+        array_size (int):           Amount of bits in the bloomfilter
+        qSize (int):                Size of the generated q-grams
+        table_dir (str | None):     Directory the table is persisted in, None = memory only
+        scheme (str):               Encoding scheme, see bf_qgram_positions
+
+    Returns:
+        BFQGramTable:               Table of the configuration
+    '''
+    key = (tuple(hash_seeds[:hash_runs - 1]), array_size, qSize, table_dir, scheme)
+    table = _QGRAM_TABLES.get(key)
+    if table is None:
+        table = _QGRAM_TABLES[key] = BFQGramTable(hash_runs, hash_seeds, array_size, qSize, table_dir, scheme)
+    return table
+
+
+def bf_save_qgram_tables() -> None:
+    '''
+    Function persisting all q-gram tables loaded in this process.
+    '''
+    for table in _QGRAM_TABLES.values():
+        table.save()
+
+atexit.register(bf_save_qgram_tables)
@@ -1,7 +1,10 @@
 from bitarray import bitarray
-import mmh3, random, math
-from backend.data import normalize_date, normalize_string, gen_qgram
+import random, math
+import numpy as np
+from backend.data import gen_qgram
 from config import GLOBAL_VAL, BLOOMFILTER_SETTINGS
+from .bf_qgram import bf_tokenize, bf_qgram_positions, BFQGramTable
+from .bf_encoder import RecordSchema, BloomEncoder
 
 
 def get_bloomfilter(text:str , hash_runs:int,
@@ -9,7 +12,9 @@ def get_bloomfilter(text:str , hash_runs:int,
                     array_size:int,                   
                     normMode:str,
                     padding:bool = BLOOMFILTER_SETTINGS.PADDING,
-                    qSize: int = BLOOMFILTER_SETTINGS.QSIZE) -> bitarray:
+                    qSize: int = BLOOMFILTER_SETTINGS.QSIZE,
+                    qgram_table: BFQGramTable | None = None,
+                    scheme: str = BLOOMFILTER_SETTINGS.ENCODING_SCHEME) -> bitarray:
     '''
     Function generating the bloomfilter.
 
@@ -20,32 +25,98 @@ def get_bloomfilter(text:str , hash_runs:int,
         normMode (str = "date" | "word"):   Determines if we use the normalization for words or dates
         padding (bool):                     true = Tom -> _Tom_ , false Tom -> Tom
         qSize (int):                        Size of the generated q-grams; qSize = 2 -> Tom = ["To", "om"]
+        qgram_table (BFQGramTable):         If given, the filter is built from the cached q-gram masks of the table;
+                                            the table has to match hash_runs, hash_seeds, array_size, qSize and scheme
+        scheme (str = "seeded" | "double"): Hashing scheme of the q-grams, see bf_qgram_positions
 
     Returns:
         bitarray:                           Bloomfilter 
     '''
-    if normMode == "date": text = [normalize_date(text)]
-    elif normMode == "word":
-        text = text.split()
-        for val in text: val = normalize_string(val)
+    if qgram_table is not None:
+        return qgram_table.encode(text, normMode, padding)
 
     bloom_filter = bitarray(array_size)
     bloom_filter.setall(0)
 
-    index = []    
-    for val in text:
-        qgram_list = gen_qgram(val, qSize, padding)
-        for run in range(hash_runs - 1):
-            for qgram in qgram_list:
-                index += [mmh3.hash(qgram, seed=hash_seeds[run]) % array_size]
-
-    for ix in index:
-        if bloom_filter[ix] != 1:
-            bloom_filter[ix] = 1
+    for val in bf_tokenize(text, normMode):
+        for qgram in gen_qgram(val, qSize, padding):
+            for ix in bf_qgram_positions(qgram, hash_runs, hash_seeds, array_size, scheme):
+                bloom_filter[ix] = 1
 
     return bloom_filter
 
 
+def bf_encode_batch(texts: list[str],
+                    hash_runs: int,
+                    hash_seeds: list[int],
+                    array_size: int,
+                    normMode: str,
+                    padding: bool = BLOOMFILTER_SETTINGS.PADDING,
+                    qSize: int = BLOOMFILTER_SETTINGS.QSIZE,
+                    use_table: bool = BLOOMFILTER_SETTINGS.USE_QGRAM_TABLE,
+                    scheme: str = BLOOMFILTER_SETTINGS.ENCODING_SCHEME) -> np.ndarray:
+    '''
+    Function generating the bloomfilters of a whole column of strings at once.
+
+    Parameters:
+        texts (list[str]):                  Column of strings, which will be fed into the bloomfilter
+        hash_runs (int):                    Amount of hash runs; hash_runs - 1 seeds are used
+        hash_seeds (list[int]):             List of Seeds, which will be used in the implemented hash-function
+        array_size (int):                   Amount of bits in the bloomfilter
+        normMode (str = "date" | "word"):   Determines if we use the normalization for words or dates
+        padding (bool):                     true = Tom -> _Tom_ , false Tom -> Tom
+        qSize (int):                        Size of the generated q-grams
+        use_table (bool):                   If True, q-gram positions are taken from the persistent q-gram table
+        scheme (str = "seeded" | "double"): Hashing scheme of the q-grams, see bf_qgram_positions
+
+    Returns:
+        np.ndarray:                         uint8 matrix (len(texts) x bytes), row i equals get_bloomfilter(texts[i], ...).tobytes()
+    '''
+    field = {"hash_runs": hash_runs, "hash_seeds": hash_seeds, "array_size": array_size, "normMode": normMode}
+    encoder = BloomEncoder(RecordSchema([field], qSize, padding, scheme), use_table)
+    return encoder.encode_batch([(text,) for text in texts])
+
+
+def bf_encode_records(records: list,
+                      fields: list[dict] | None = None,
+                      padding: bool = BLOOMFILTER_SETTINGS.PADDING,
+                      qSize: int = BLOOMFILTER_SETTINGS.QSIZE,
+                      use_table: bool = BLOOMFILTER_SETTINGS.USE_QGRAM_TABLE,
+                      scheme: str = BLOOMFILTER_SETTINGS.ENCODING_SCHEME) -> np.ndarray:
+    '''
+    Function generating the combined bloomfilters of a list of patient records at once.
+
+    Parameters:
+        records (list):                     Records like (first_name, last_name, date_of_birth, gender, ...);
+                                            column i is encoded with fields[i], further columns are ignored
+        fields (list[dict]) (optional):     Field configuration, see bf_record_fields(); default = bf_record_fields()
+        padding (bool):                     true = Tom -> _Tom_ , false Tom -> Tom
+        qSize (int):                        Size of the generated q-grams
+        use_table (bool):                   If True, q-gram positions are taken from the persistent q-gram tables
+        scheme (str = "seeded" | "double"): Hashing scheme of the q-grams, see bf_qgram_positions
+
+    Returns:
+        np.ndarray:                         uint8 matrix (len(records) x bytes) in the layout of the concatenated segment filters
+    '''
+    encoder = BloomEncoder(RecordSchema(fields, qSize, padding, scheme), use_table)
+    return encoder.encode_batch(records)
+
+
+def bf_check_encoding_version(version_a: int, version_b: int) -> None:
+    '''
+    Function guarding comparisons; bloomfilters created with different encoding schemes are not comparable.
+
+    Parameters:
+        version_a (int):    Encoding version of the first set of bloomfilters
+        version_b (int):    Encoding version of the second set of bloomfilters
+
+    Raises:
+        ValueError:         If the versions differ
+    '''
+    if version_a != version_b:
+        raise ValueError(f"bf_check_encoding_version: bloomfilters of encoding version {version_a} and {version_b} cannot be compared")
+
+
 def bf_convert_bytes_to_01(bf_in_bytes) -> str:
     '''
     Function converting the bytes representation of a bloomfilter into zeros and ones.
@@ -61,6 +132,26 @@ def bf_convert_bytes_to_01(bf_in_bytes) -> str:
     return temp.to01()
 
 
+def bf_convert_chunk_to_01(bfs_in_bytes: list) -> list[str]:
+    '''
+    bf_convert_bytes_to_01 for a chunk of bloomfilters: filters of the same length are unpacked together
+    into one buffer of '0' and '1' characters, which is cut into the strings.
+
+    Parameters:
+        bfs_in_bytes (list[BytesLike]):   Byte representations of the bloomfilters
+
+    Returns:
+        list[str]:                        Zero One representations, in the order of bfs_in_bytes
+    '''
+    size = len(bfs_in_bytes[0]) if bfs_in_bytes else 0
+    if any(len(bf) != size for bf in bfs_in_bytes):
+        return [bf_convert_bytes_to_01(bf) for bf in bfs_in_bytes]
+    bits = size * 8
+    matrix = np.frombuffer(b"".join(bfs_in_bytes), dtype=np.uint8).reshape(len(bfs_in_bytes), size)
+    text = (np.unpackbits(matrix, axis=1) + ord("0")).tobytes().decode("ascii")
+    return [text[i:i + bits] for i in range(0, len(text), bits)] if bits else [""] * len(bfs_in_bytes)
+
+
 
 def bf_add_salt(bf:bitarray, salt_amount: int = 0, salt_fix: list[int] = None):
     '''
@@ -87,6 +178,52 @@ def bf_add_salt(bf:bitarray, salt_amount: int = 0, salt_fix: list[int] = None):
     return bf_c
 
 
+def bf_add_salt_matrix(filters: np.ndarray, salt_amount: int = 0, salt_fix: list[int] = None,
+                       rng: np.random.Generator | None = None) -> np.ndarray:
+    '''
+    bf_add_salt for many bloomfilters at once: the filters are the rows of a uint8 matrix (N x bytes per filter),
+    bit i of a filter is bit (7 - i % 8) of byte i // 8, like bitarray stores it.
+
+    Fixed salts are one OR-mask for all rows. Random salts are salt_amount different positions per row, drawn as one
+    index matrix; rows drawing a position twice are drawn again, unless salt_amount is too large for that to be rare.
+
+    Parameters:
+        filters (np.ndarray):               uint8 matrix of the bloomfilters; it is not changed
+        salt_amount (int) (optional):       Amount of random Salts per Bloomfilter; default = 0
+        salt_fix (list[int]) (optional):    List of Indices where Salts will be added; will be prefered over salt_amount
+        rng (np.random.Generator):          Random source of the random Salts; default = a new unseeded generator
+
+    Returns:
+        np.ndarray:                         uint8 matrix of the Bloomfilters with Salts
+    '''
+    filters = np.array(filters, dtype=np.uint8, ndmin=2)
+    rows, bits = filters.shape[0], filters.shape[1] * 8
+
+    if salt_fix:
+        positions = np.asarray([idx for idx in salt_fix if 0 <= idx < bits], dtype=np.intp)
+        mask = np.zeros(bits, dtype=np.uint8)
+        mask[positions] = 1
+        filters |= np.packbits(mask)
+    elif salt_amount > 0 and rows:
+        rng = np.random.default_rng() if rng is None else rng
+        amount = min(salt_amount, bits)
+        if amount * (amount - 1) > bits:
+            # Many salts per row: the first positions of a random permutation per row
+            positions = rng.random((rows, bits)).argpartition(amount - 1, axis=1)[:, :amount]
+        else:
+            positions = rng.integers(0, bits, size=(rows, amount))
+            while True:
+                ordered = np.sort(positions, axis=1)
+                again = np.flatnonzero(np.any(ordered[:, 1:] == ordered[:, :-1], axis=1))
+                if not len(again):
+                    break
+                positions[again] = rng.integers(0, bits, size=(len(again), amount))
+        salts = np.zeros((rows, bits), dtype=np.uint8)
+        salts[np.arange(rows)[:, None], positions] = 1
+        filters |= np.packbits(salts, axis=1)
+    return filters
+
+
 
 def bf_sorenson_dice(bitarrayA: bitarray, bitarrayB: bitarray) -> float:
     '''
@@ -112,6 +249,22 @@ def bf_sorenson_dice(bitarrayA: bitarray, bitarrayB: bitarray) -> float:
     return 2 * intersection / (sum_A + sum_B)
 
 
+def bf_dice_count_window(count: int, threshold: float) -> tuple[int, int | None]:
+    '''
+    Helper function returning the popcounts a filter can have to reach a Sorenson-Dice similarity of threshold
+    with a filter of count set bits; the similarity is bound by 2 * min(|A|, |B|) / (|A| + |B|).
+
+    Parameters:
+        count (int):            Amount of set bits of the compared filter
+        threshold (float):      Minimal similarity
+
+    Returns:
+        tuple[int, int | None]: Inclusive (lowest, highest) popcount, rounded outwards; highest is None without upper bound
+    '''
+    if threshold <= 0: return 0, None
+    return math.floor(count * threshold / (2 - threshold)), math.ceil(count * (2 - threshold) / threshold)
+
+
 def bf_get_rating(thresholds: list[float], similarity: float) -> str:
     '''
     Helper function which is used to give the similarity a rating
@@ -142,7 +295,9 @@ def bf_extended_similarity(bf1: bitarray,
                            array_names: list[str],
                            out_mode: str = None,
                            thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
-                           swap: bool = False):
+                           swap: bool = False,
+                           early_exit: bool = False,
+                           segment_order: list[int] | None = None):
     '''
     Extended function used for a more detailed comparison of two bloomfilters
 
@@ -158,9 +313,15 @@ def bf_extended_similarity(bf1: bitarray,
                                     out_mode != "total", returns the extended similarity for each segment on the Bloomfilter
         thresholds (list[float]):   List of thresholds used for the similarity rating
         swap (bool) (optional):     If True this function will automatically swap the first and last name if it suspects a swap
+        early_exit (bool) (optional):   Only for out_mode = "total": the segments are scored in segment_order and the
+                                        comparison stops as soon as the total can no longer reach the lowest threshold
+                                        and no swap can be detected; the result is then rated "not alike" and its
+                                        similarity is None, as the total was not computed
+        segment_order (list[int]) (optional):   Order the segments are scored in with early_exit;
+                                                default = largest (most selective) segment first
 
     Returns:
-        list[float, str, str], bool | list[tuple[float, str, str]], bool
+        list[float | None, str, str], bool | list[tuple[float, str, str]], bool
         
     '''
     swaped = False
@@ -169,24 +330,58 @@ def bf_extended_similarity(bf1: bitarray,
     assert len(thresholds) == 3, "bf_extended_similarity: thresholds needs to be a list of 3 floats"
     thresholds = sorted(thresholds, reverse=True)
 
-    bf1_dict = {}
-    bf2_dict = {}
-    section_similarity = []
-
-    start = 0
-    # Erzeuge Dictionarys und berechne Ähnlichkeiten für jeden Abschnitt.
-    for size, name in zip(array_sizes, array_names):
-        end = start + size
-        bf1_section = bf1[start:end]
-        bf2_section = bf2[start:end]
-        bf1_dict[name] = bf1_section
-        bf2_dict[name] = bf2_section
-
-        similarity = bf_sorenson_dice(bf1_section, bf2_section)
-        rating = bf_get_rating(thresholds, similarity)
-        section_similarity.append((similarity, name, rating))
-
-        start = end
+    array_sizes = [size for size, _ in zip(array_sizes, array_names)]
+    starts = [sum(array_sizes[:i]) for i in range(len(array_sizes))]
+    section_similarity = [None] * len(array_sizes)
+    cross = []
+
+    def swap_similarities() -> tuple[float, float]:
+        # Similarities of the first name of bf1 with the last name of bf2 and vice versa
+        first, last = (slice(starts[i], starts[i] + array_sizes[i]) for i in (0, 1))
+        return bf_sorenson_dice(bf1[first], bf2[last]), bf_sorenson_dice(bf1[last], bf2[first])
+
+    def score(index: int) -> None:
+        start, end = starts[index], starts[index] + array_sizes[index]
+        similarity = bf_sorenson_dice(bf1[start:end], bf2[start:end])
+        section_similarity[index] = (similarity, array_names[index], bf_get_rating(thresholds, similarity))
+
+    if early_exit and out_mode == "total":
+        order = segment_order if segment_order is not None else sorted(range(len(array_sizes)), key=lambda i: -array_sizes[i])
+        if sorted(order) != list(range(len(array_sizes))):
+            raise ValueError(f"bf_extended_similarity: segment_order must be a permutation of the {len(array_sizes)} segments")
+        # Segments not scored yet are bound by 1.0; counting their bits costs about as much as scoring them
+        bounds = [1.0] * len(array_sizes)
+
+        def swap_possible() -> bool:
+            # Mirrors the swap check below with the segments scored so far
+            if len(array_sizes) < 4:
+                return False
+            if array_sizes[0] != array_sizes[1]:
+                return True
+            for index in (0, 1):
+                if section_similarity[index] is not None and section_similarity[index][2] not in ["weak", "not alike"]:
+                    return False
+            if section_similarity[2] is not None and section_similarity[3] is not None \
+                    and section_similarity[2][2] == section_similarity[3][2] == "not alike":
+                return False
+            if section_similarity[0] is None or section_similarity[1] is None:
+                return True
+            # Both names are known, the cross similarities decide and are kept for the swap check
+            if not cross:
+                cross.extend(swap_similarities())
+            return all(section_similarity[index][0] < cross[index] > thresholds[-1] for index in (0, 1))
+
+        for index in order:
+            score(index)
+            bounds[index] = section_similarity[index][0]
+            # The tolerance keeps float rounding of the bound from stopping a comparison which reaches the threshold
+            if sum(bounds) / len(bounds) + 1e-12 < thresholds[-1] and not swap_possible():
+                return [None, "total", "not alike"], swaped
+
+    # Erzeuge die Ähnlichkeiten für jeden noch nicht berechneten Abschnitt.
+    for index in range(len(array_sizes)):
+        if section_similarity[index] is None:
+            score(index)
 
     ratings = [rating for (_, _, rating) in section_similarity]
 
@@ -195,8 +390,7 @@ def bf_extended_similarity(bf1: bitarray,
         # Überprüft, ob der Vorname von bf1 nicht ähnlich zum Nachnamen von bf2 ist.
         if ratings[0] in ["weak", "not alike"] and ratings[1] in ["weak", "not alike"]:
             if not (ratings[2] == ratings[3] == "not alike"):
-                new1 = bf_sorenson_dice(bf1_dict[array_names[0]], bf2_dict[array_names[1]])
-                new2 = bf_sorenson_dice(bf1_dict[array_names[1]], bf2_dict[array_names[0]])
+                new1, new2 = cross if cross else swap_similarities()
                 if section_similarity[0][0] < new1 > thresholds[-1] and section_similarity[1][0] < new2 > thresholds[-1]:
                     swaped = True
                     if swap:
@@ -1,5 +1,7 @@
 from config import DATA_SETTINGS
 from dateutil import parser
+from datetime import date
+from functools import lru_cache
 import re
 
 
@@ -27,11 +29,59 @@ def gen_qgram(text: str, q: int, padding: bool) -> list[str]:
         return [text[i:i + q] for i in range(len(text) - q + 1)]
 
 
+def _compile_normalizer():
+        """
+        Compile DATA_SETTINGS.REMOVE_TITLES into one regex and DATA_SETTINGS.REPLACE_LETTERS into a str.translate table.
+
+        Returns:
+                tuple:  (titles regex, translate table or None, list of (compiled pattern, replacement));
+                        the list is only used if a pattern is not a plain character class like "[àá]".
+        """
+        titles_pattern = r"|".join(map(re.escape, DATA_SETTINGS.REMOVE_TITLES))
+        titles_re = re.compile(fr"{titles_pattern}\s*")
+
+        table = {}
+        for pattern, replacement in DATA_SETTINGS.REPLACE_LETTERS.items():
+                char_class = re.fullmatch(r"\[([^\]\\^-]+)\]", pattern)
+                if not char_class:
+                        # Keep the exact sequential semantics for anything but plain character classes
+                        return titles_re, None, [(re.compile(p), r) for p, r in DATA_SETTINGS.REPLACE_LETTERS.items()]
+                for char in char_class.group(1):
+                        table.setdefault(ord(char), replacement)
+        return titles_re, table, []
+
+
+_TITLES_RE, _REPLACE_TABLE, _REPLACE_PATTERNS = _compile_normalizer()
+
+
+@lru_cache(maxsize=DATA_SETTINGS.NORMALIZE_CACHE_SIZE)
+def _normalize_string(text: str, to_upper: bool) -> str:
+        #Strip out any titles defined in DATA_SETTINGS.REMOVE_TITLES
+        text = _TITLES_RE.sub("", text)
+
+        #Replace hyphens with spaces
+        text = text.strip().replace("-", " ")
+
+        text = text.lower()
+
+        #Apply character replacements from DATA_SETTINGS.REPLACE_LETTERS
+        if _REPLACE_TABLE is not None:
+                text = text.translate(_REPLACE_TABLE)
+        else:
+                for pattern, replacement in _REPLACE_PATTERNS:
+                        text = pattern.sub(replacement, text)
+
+        return text.upper() if to_upper else text.capitalize()
+
+
 def normalize_string(text: str, to_upper: bool = True) -> str:
         """
         Remove predefined titles and hyphens, replace characters by a mapping, 
         and adjust the casing of the resulting string.
 
+        The configuration is compiled once on import (see reset_normalizer) and results are memoized
+        for the last DATA_SETTINGS.NORMALIZE_CACHE_SIZE distinct inputs.
+
         Parameters:
                 text (str):             The input string to normalize.
                 to_upper (bool):        If True, convert the final string to uppercase.
@@ -40,34 +90,92 @@ def normalize_string(text: str, to_upper: bool = True) -> str:
         Returns:
                 str:            Normalized version of the input.
         """
-        #Strip out any titles defined in DATA_SETTINGS.REMOVE_TITLES
-        titles_pattern = r"|".join(map(re.escape, DATA_SETTINGS.REMOVE_TITLES))
-        text = re.sub(fr"{titles_pattern}\s*", "", text)
-        
-        #Replace hyphens with spaces
-        text = text.strip().replace("-", " ")
+        return _normalize_string(text, to_upper)
 
-        text = text.lower()
 
-        #Apply character replacements from DATA_SETTINGS.REPLACE_LETTERS
-        for pattern, replacement in DATA_SETTINGS.REPLACE_LETTERS.items():
-                text = re.sub(pattern, replacement, text)
-        
-        return text.upper() if to_upper else text.capitalize()
+def reset_normalizer() -> None:
+        """
+        Recompile the normalizer after DATA_SETTINGS was changed at runtime and drop all memoized results.
+        """
+        global _TITLES_RE, _REPLACE_TABLE, _REPLACE_PATTERNS
+        _TITLES_RE, _REPLACE_TABLE, _REPLACE_PATTERNS = _compile_normalizer()
+        _normalize_string.cache_clear()
+
+
+_PARSER_INFO = parser.parserinfo()
+_MONTHS = {name.lower(): month for month, names in enumerate(parser.parserinfo.MONTHS, 1) for name in names}
+_WEEKDAYS = {name.lower() for names in parser.parserinfo.WEEKDAYS for name in names}
+
+
+def _ymd_iso(match):
+        return int(match[1]), int(match[3]), int(match[4])
+
+def _ymd_numeric(match):
+        # dateutil reads the first number as month unless it can only be a day
+        first, second, year = int(match[1]), int(match[3]), match[4]
+        month, day = (first, second) if first <= 12 else (second, first)
+        year = int(year) if len(year) == 4 else _PARSER_INFO.convertyear(int(year))
+        return year, month, day
+
+def _ymd_month_name(match):
+        if match[1] and match[1].lower() not in _WEEKDAYS: return None
+        month = _MONTHS.get(match[2].lower())
+        return (int(match[4]), month, int(match[3])) if month else None
+
+def _ymd_day_month_name(match):
+        month = _MONTHS.get(match[2].lower())
+        return (int(match[3]), month, int(match[1])) if month else None
+
+
+# Strict formats of our feeds (see generate_csv.zufaelliges_geburtsdatum), resolved exactly like dateutil does
+_DATE_FORMATS = [
+        (re.compile(r"(\d{4})([-/.])(\d{1,2})\2(\d{1,2})"), _ymd_iso),                                   # %Y-%m-%d, %Y/%m/%d
+        (re.compile(r"(\d{1,2})([-/.])(\d{1,2})\2(\d{4}|\d{2})"), _ymd_numeric),                         # %d.%m.%Y, %d/%m/%Y, %m-%d-%Y, %m/%d/%Y, %d.%m.%y
+        (re.compile(r"(?:([A-Za-z]+),\s*)?([A-Za-z]+)\s+(\d{1,2}),?\s+(\d{4})"), _ymd_month_name),       # %B %d, %Y, %A, %B %d, %Y
+        (re.compile(r"(\d{1,2})\s+([A-Za-z]+)\s+(\d{4})"), _ymd_day_month_name),                           # %d %B %Y
+]
+
+# Index of the format that worked last; one entry per process, an import (or import worker) reads one file at a time
+_LAST_FORMAT = 0
+
+
+@lru_cache(maxsize=DATA_SETTINGS.NORMALIZE_CACHE_SIZE)
+def _parse_date(date_str: str) -> str:
+        try:
+                parsed = parser.parse(date_str)
+                return parsed.strftime("%Y%m%d")
+        except Exception as e:
+                return date_str
 
 
 def normalize_date(date_str:str) -> str:
         """
         Parse an input date string into YYYYMMDD format, returning the original string on parse failure.
 
+        The known feed formats are matched first, starting with the one that worked last; only other inputs
+        are handed to dateutil (memoized). The result is identical to dateutil in both cases.
+
         Parameters:
                 date_str (str):   The date string to normalize (e.g. "2025-04-17", "April 17, 2025", "17/04/2025").
 
         Returns:
                 str: A string in "YYYYMMDD" format if parsing succeeds; otherwise returns the original input.
         """
-        try:
-                parsed = parser.parse(date_str)
-                return parsed.strftime("%Y%m%d")
-        except Exception as e:
-                return date_str
\ No newline at end of file
+        global _LAST_FORMAT
+        text = date_str.strip()
+        last = _LAST_FORMAT
+        for idx in [last] + [i for i in range(len(_DATE_FORMATS)) if i != last]:
+                pattern, resolve = _DATE_FORMATS[idx]
+                match = pattern.fullmatch(text)
+                if not match:
+                        continue
+                ymd = resolve(match)
+                if ymd is None:
+                        break
+                try:
+                        result = date(*ymd).strftime("%Y%m%d")
+                except ValueError:
+                        break
+                _LAST_FORMAT = idx
+                return result
+        return _parse_date(date_str)
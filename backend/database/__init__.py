@@ -1,2 +1,6 @@
 from .db_utils import *
-from .db_handler import *
\ No newline at end of file
+from .db_handler import *
+from .db_lsh import *
+from .db_mih import *
+from .db_cache import *
+from .db_connection import *
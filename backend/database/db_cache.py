@@ -0,0 +1,287 @@
+import sqlite3, json, os, uuid
+from typing import Callable
+import numpy as np
+from pathlib import Path
+from backend.bloomfilter import BFMatrix, bf_get_encoder
+
+
+# Files of the cache of one patient table: packed filters, segment popcounts, patient ids and the meta data
+BF_CACHE_FILES = {"words": np.uint64, "counts": np.int32, "ids": np.int64}
+# Rows moved at once when deleted rows are removed from the cache files (2016 bits: 16 MiB of filters)
+_SHIFT_ROWS = 1 << 16
+
+
+def _segment_words(schema) -> list[int]:
+    return [(size + 63) // 64 for size in schema.sizes]
+
+
+def db_cache_dir(conn: sqlite3.Connection, patient_table: str) -> Path | None:
+    """
+        Directory of the filter cache of a patient table, next to the database file ("<database>.bfcache/<table>").
+        None for databases without a file, e.g. in memory.
+    """
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    return Path(f"{path}.bfcache") / patient_table if path else None
+
+
+def db_get_generation(conn: sqlite3.Connection, patient_table: str) -> int | None:
+    """
+        Generation counter of a patient table: raised by a trigger for every inserted, deleted or changed filter.
+        None if the table has no counter yet (see db_create_generation_triggers).
+    """
+    try:
+        row = conn.execute("SELECT value FROM bf_meta WHERE key = ?", (f"generation:{patient_table}",)).fetchone()
+    except sqlite3.Error:
+        return None
+    return int(row[0]) if row else None
+
+
+def db_get_cache_id(conn: sqlite3.Connection, patient_table: str) -> str | None:
+    """
+        Random id of a patient table, created together with its generation counter. A recreated or restored database
+        gets a new id, so a cache written for another database is never taken for valid at the same generation.
+        None if the table has no id yet (see db_create_generation_triggers).
+    """
+    try:
+        row = conn.execute("SELECT value FROM bf_meta WHERE key = ?", (f"cache_id:{patient_table}",)).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def db_create_generation_triggers(conn: sqlite3.Connection, patient_table: str) -> None:
+    """
+        Create the generation counter and the random id of a patient table in bf_meta and the triggers raising
+        the counter, unless they exist.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database; bf_meta has to exist.
+            patient_table (str): Name of the patient table.
+
+        Returns:
+            None
+    """
+    key = f"generation:{patient_table}"
+    conn.execute("INSERT OR IGNORE INTO bf_meta (key, value) VALUES (?, '0')", (key,))
+    conn.execute("INSERT OR IGNORE INTO bf_meta (key, value) VALUES (?, ?)", (f"cache_id:{patient_table}", uuid.uuid4().hex))
+    increment = f"UPDATE bf_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = '{key}';"
+    for name, event in (("insert", "INSERT"), ("delete", "DELETE"), ("update", "UPDATE OF BF, patient_id")):
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS "trg_{patient_table}_generation_{name}" '
+                     f'AFTER {event} ON "{patient_table}" BEGIN {increment} END')
+
+
+def _read_meta(cache_dir: Path) -> dict | None:
+    try:
+        return json.loads((cache_dir / "meta.json").read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(cache_dir: Path, meta: dict) -> None:
+    # The meta data is written last and replaced atomically; data beyond its rows is ignored
+    tmp = cache_dir / "meta.json.tmp"
+    tmp.write_text(json.dumps(meta))
+    os.replace(tmp, cache_dir / "meta.json")
+
+
+def _meta_writer(conn: sqlite3.Connection, patient_table: str, cache_dir: Path, meta: dict) -> Callable[[], None]:
+    # The new meta data may only be written once the changes are committed; if the commit failed or another writer
+    # or a rebuild came in between, the generation differs or a meta file exists and the cache stays invalid
+    def write() -> None:
+        if not (cache_dir / "meta.json").exists() and db_get_generation(conn, patient_table) == meta["generation"]:
+            _write_meta(cache_dir, meta)
+    return write
+
+
+def _valid_meta(conn: sqlite3.Connection, patient_table: str, changes: int = 0) -> tuple[Path, dict] | None:
+    # The cache is valid if it was written for this database at the current generation, minus the changes made by the caller
+    cache_dir = db_cache_dir(conn, patient_table)
+    if cache_dir is None:
+        return None
+    meta = _read_meta(cache_dir)
+    generation = db_get_generation(conn, patient_table)
+    cache_id = db_get_cache_id(conn, patient_table)
+    schema = bf_get_encoder().schema
+    if meta is None or generation is None or cache_id is None or meta.get("cache_id") != cache_id \
+            or meta.get("generation") != generation - changes \
+            or meta.get("version") != schema.version or meta.get("segment_words") != _segment_words(schema):
+        return None
+    return cache_dir, meta
+
+
+def _columns(meta: dict) -> dict[str, int]:
+    return {"words": sum(meta["segment_words"]), "counts": len(meta["segment_words"]), "ids": 1}
+
+
+def _map(cache_dir: Path, meta: dict, name: str, mode: str = "r") -> np.ndarray:
+    columns = _columns(meta)[name]
+    if not meta["rows"]:
+        return np.zeros((0, columns), dtype=BF_CACHE_FILES[name])
+    return np.memmap(cache_dir / name, dtype=BF_CACHE_FILES[name], mode=mode, shape=(meta["rows"], columns))
+
+
+def db_cache_load(conn: sqlite3.Connection, patient_table: str) -> BFMatrix | None:
+    """
+        Open the filter cache of a patient table as a memory-mapped BFMatrix, without copying the filters.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+
+        Returns:
+            BFMatrix | None: All stored filters ordered by patient_id, or None if the cache is missing or outdated.
+    """
+    valid = _valid_meta(conn, patient_table)
+    if valid is None:
+        return None
+    cache_dir, meta = valid
+    try:
+        matrix = BFMatrix.from_packed(_map(cache_dir, meta, "ids")[:, 0], _map(cache_dir, meta, "words"),
+                                      _map(cache_dir, meta, "counts"), bf_get_encoder().schema)
+    except (OSError, ValueError):
+        return None
+    if meta["rows"]:
+        matrix.files = {name: cache_dir / name for name in BF_CACHE_FILES}
+    return matrix
+
+
+def db_cache_build(conn: sqlite3.Connection, patient_table: str) -> BFMatrix | None:
+    """
+        Write the filter cache of a patient table from the database and open it, see db_cache_load.
+        The generation triggers are created if they are missing.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+
+        Returns:
+            BFMatrix | None: The new cache, or None if the database has no file.
+    """
+    cache_dir = db_cache_dir(conn, patient_table)
+    if cache_dir is None:
+        return None
+    schema = bf_get_encoder().schema
+    db_create_generation_triggers(conn, patient_table)
+    conn.commit()
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    (cache_dir / "meta.json").unlink(missing_ok=True)
+    rows = 0
+    files = {name: open(cache_dir / name, "wb") for name in BF_CACHE_FILES}
+    try:
+        # Filters and generation are read in one transaction, so no writer can come in between
+        conn.execute("BEGIN")
+        generation = db_get_generation(conn, patient_table)
+        cache_id = db_get_cache_id(conn, patient_table)
+        cursor = conn.execute(f'SELECT patient_id, BF FROM "{patient_table}" ORDER BY patient_id')
+        while chunk := cursor.fetchmany(10000):
+            matrix = BFMatrix.from_blobs(chunk, schema)
+            files["words"].write(matrix.words.tobytes())
+            files["counts"].write(matrix.counts.astype(np.int32).tobytes())
+            files["ids"].write(matrix.ids.tobytes())
+            rows += len(matrix)
+        conn.commit()
+    finally:
+        for file in files.values():
+            file.close()
+
+    _write_meta(cache_dir, {"cache_id": cache_id, "generation": generation, "rows": rows, "version": schema.version,
+                            "segment_words": _segment_words(schema)})
+    return db_cache_load(conn, patient_table)
+
+
+def db_cache_matrix(conn: sqlite3.Connection, patient_table: str) -> BFMatrix | None:
+    """
+        The memory-mapped filters of a patient table; the cache is (re)built only if it is missing or outdated.
+    """
+    matrix = db_cache_load(conn, patient_table)
+    return matrix if matrix is not None else db_cache_build(conn, patient_table)
+
+
+def db_cache_insert(conn: sqlite3.Connection, patient_table: str, patient_ids: list[int],
+                    filters) -> Callable[[], None] | None:
+    """
+        Append newly inserted patients to the filter cache, inside the transaction which inserted them.
+        The cache is invalid until the returned callback is run after the commit; an outdated cache is left alone
+        and rebuilt on its next use.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+            patient_ids (list[int]): IDs of the patients.
+            filters (bytes | np.ndarray): Their Bloom filters, concatenated or as uint8 matrix, in the order of patient_ids.
+
+        Returns:
+            Callable[[], None] | None: Writes the new meta data, to be called after conn.commit(); None if nothing changed.
+    """
+    valid = _valid_meta(conn, patient_table, len(patient_ids))
+    if valid is None or not len(patient_ids):
+        return None
+    cache_dir, meta = valid
+    if isinstance(filters, (bytes, bytearray, memoryview)):
+        filters = np.frombuffer(filters, dtype=np.uint8)
+    matrix = BFMatrix(patient_ids, filters, bf_get_encoder().schema)
+
+    # The cache is ordered by patient_id; ids below the last one would need a rebuild
+    last = _map(cache_dir, meta, "ids")[-1, 0] if meta["rows"] else None
+    (cache_dir / "meta.json").unlink(missing_ok=True)
+    if (last is not None and matrix.ids[0] <= last) or np.any(np.diff(matrix.ids) <= 0):
+        return None
+
+    for name, data in (("words", matrix.words), ("counts", matrix.counts.astype(np.int32)), ("ids", matrix.ids)):
+        with open(cache_dir / name, "r+b") as file:
+            file.seek(meta["rows"] * _columns(meta)[name] * np.dtype(BF_CACHE_FILES[name]).itemsize)
+            file.write(np.ascontiguousarray(data).tobytes())
+    return _meta_writer(conn, patient_table, cache_dir,
+                        {**meta, "generation": meta["generation"] + len(patient_ids), "rows": meta["rows"] + len(matrix)})
+
+
+def _shift_rows(path: Path, deleted: np.ndarray, rows: int, row_bytes: int) -> None:
+    # Move the rows behind the first deleted one up over the deleted rows, block by block; the rows before stay untouched
+    with open(path, "r+b") as file:
+        target = int(deleted[0])
+        for start in range(target, rows, _SHIFT_ROWS):
+            stop = min(start + _SHIFT_ROWS, rows)
+            file.seek(start * row_bytes)
+            block = np.frombuffer(file.read((stop - start) * row_bytes), dtype=np.uint8).reshape(stop - start, row_bytes)
+            drop = deleted[(deleted >= start) & (deleted < stop)] - start
+            block = np.delete(block, drop, axis=0) if len(drop) else block
+            file.seek(target * row_bytes)
+            file.write(block.tobytes())
+            target += len(block)
+
+
+def db_cache_delete(conn: sqlite3.Connection, patient_table: str, patient_ids: list[int],
+                    deleted: int) -> Callable[[], None] | None:
+    """
+        Remove deleted patients from the filter cache, inside the transaction which deleted them.
+        The rows behind the first deleted one are moved up in place, so the cache files never shrink until the next rebuild.
+        The cache is invalid until the returned callback is run after the commit.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+            patient_ids (list[int]): IDs of the deleted patients.
+            deleted (int): Amount of rows actually deleted.
+
+        Returns:
+            Callable[[], None] | None: Writes the new meta data, to be called after conn.commit(); None if the cache is invalid.
+    """
+    valid = _valid_meta(conn, patient_table, deleted)
+    if valid is None:
+        return None
+    cache_dir, meta = valid
+    # The cache is ordered by patient_id, so the deleted rows are found by binary search without reading the ids
+    ids = _map(cache_dir, meta, "ids")[:, 0]
+    targets = np.unique(np.asarray(patient_ids, dtype=np.int64))
+    rows = np.searchsorted(ids, targets)
+    rows = rows[rows < len(ids)]
+    rows = rows[ids[rows] == targets[:len(rows)]] if len(rows) else rows
+    del ids
+    (cache_dir / "meta.json").unlink(missing_ok=True)
+    if len(rows) != deleted:
+        return None
+    if deleted:
+        for name in BF_CACHE_FILES:
+            _shift_rows(cache_dir / name, rows, meta["rows"], _columns(meta)[name] * np.dtype(BF_CACHE_FILES[name]).itemsize)
+    return _meta_writer(conn, patient_table, cache_dir, {**meta, "generation": meta["generation"] + deleted, "rows": meta["rows"] - deleted})
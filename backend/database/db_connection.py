@@ -0,0 +1,157 @@
+import sqlite3, os, threading
+from contextlib import contextmanager
+from backend.bloomfilter import bf_shutdown_pool, bf_blob_unpack, bf_get_encoder
+from config import DATABASE_SETTINGS
+
+
+# Pragmas of the storage profile set on every connection; journal_mode is stored in the file (see db_apply_journal_mode)
+DB_CONNECTION_PRAGMAS = ("synchronous", "mmap_size", "cache_size", "temp_store")
+
+# Pooled connections: one per thread and database file, the pragmas are set once when it is opened
+_LOCAL = threading.local()
+_LOCK = threading.Lock()
+_CONNECTIONS: list[sqlite3.Connection] = []
+# Raised by db_close_connections, so the other threads drop their closed connections on their next call
+_EPOCH = 0
+# Connections inherited by a forked child are never used or closed there, the parent still owns them
+_INHERITED: list[sqlite3.Connection] = []
+
+
+def _pool_key(db_path) -> str:
+    db_path = os.fspath(db_path)
+    return db_path if db_path in ("", ":memory:") or db_path.startswith("file:") else os.path.abspath(db_path)
+
+
+def db_storage_profile(profile: str | None = None) -> dict:
+    """
+        Pragmas of a storage profile (see DATABASE_SETTINGS.STORAGE_PROFILES); default = the configured profile.
+    """
+    profile = DATABASE_SETTINGS.STORAGE_PROFILE if profile is None else profile
+    if profile not in DATABASE_SETTINGS.STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile {profile!r}, use one of {list(DATABASE_SETTINGS.STORAGE_PROFILES)}")
+    return DATABASE_SETTINGS.STORAGE_PROFILES[profile]
+
+
+def _bf_unpack(blob):
+    return bf_blob_unpack(blob, bf_get_encoder().schema.total_bytes)
+
+
+def _open(db_path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=DATABASE_SETTINGS.BUSY_TIMEOUT, check_same_thread=False)
+    profile = db_storage_profile()
+    for pragma in DB_CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma} = {profile[pragma]}")
+    # bf_unpack(BF) returns a stored filter BLOB packed, whether it is stored packed or sparse (see DATABASE_SETTINGS.SPARSE_BLOBS)
+    conn.create_function("bf_unpack", 1, _bf_unpack, deterministic=True)
+    return conn
+
+
+def db_apply_journal_mode(conn: sqlite3.Connection, profile: str | None = None) -> str:
+    """
+        Set the journal mode of a storage profile on a database. The mode is stored in the database file,
+        so it is set once when the database is created or opened by create_db; no transaction may be open.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the database.
+            profile (str | None): Name of the storage profile; default = DATABASE_SETTINGS.STORAGE_PROFILE.
+
+        Returns:
+            str: The journal mode now in use, e.g. "memory" for in-memory databases.
+    """
+    return conn.execute(f"PRAGMA journal_mode = {db_storage_profile(profile)['journal_mode']}").fetchone()[0]
+
+
+@contextmanager
+def db_bulk_load(db_path):
+    """
+        Context manager for bulk loads into a database: like "with conn:" it commits the block or rolls it back on an exception.
+        The block runs on the pooled connection of the thread. Only if the storage profile sets another synchronous mode for
+        bulk loads ("bulk_synchronous") it runs on a dedicated connection with that mode, so the pooled connection keeps the
+        regular mode for everything else written meanwhile, e.g. from the GUI while the import reports its progress.
+
+        Parameters:
+            db_path (str | Path): Path to the SQLite database file.
+
+        Yields:
+            sqlite3.Connection: Connection without an open transaction.
+    """
+    profile = db_storage_profile()
+    if profile['bulk_synchronous'] == profile['synchronous']:
+        conn = db_connect(db_path)
+        if conn.in_transaction:
+            raise ValueError("db_bulk_load: the pooled connection has an open transaction")
+        with conn:
+            yield conn
+        return
+    conn = _open(db_path)
+    try:
+        conn.execute(f"PRAGMA synchronous = {profile['bulk_synchronous']}")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def db_connect(db_path) -> sqlite3.Connection:
+    """
+        Pooled connection of the calling thread to a database; opened with the pragmas of the storage profile
+        on first use (see DATABASE_SETTINGS.STORAGE_PROFILES) and kept open until db_close_connections.
+        It provides the SQL function bf_unpack(blob), which decodes a stored filter BLOB (see bf_blob_unpack).
+
+        The connection is shared by all callers in the thread, so it must not be closed by them. Like with sqlite3.connect,
+        "with db_connect(path) as conn:" commits the block or rolls it back on an exception.
+
+        Parameters:
+            db_path (str | Path): Path to the SQLite database file.
+
+        Returns:
+            sqlite3.Connection: The open connection.
+    """
+    if getattr(_LOCAL, "epoch", None) != _EPOCH:
+        _LOCAL.connections, _LOCAL.epoch = {}, _EPOCH
+    key = _pool_key(db_path)
+    conn = _LOCAL.connections.get(key)
+    if conn is None:
+        conn = _open(db_path)
+        with _LOCK:
+            _CONNECTIONS.append(conn)
+        _LOCAL.connections[key] = conn
+    return conn
+
+
+def db_close_connections() -> None:
+    """
+        Close the pooled connections of all threads; an open transaction is rolled back.
+        The next db_connect opens a new connection.
+    """
+    global _EPOCH
+    with _LOCK:
+        connections = list(_CONNECTIONS)
+        _CONNECTIONS.clear()
+        _EPOCH += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Error closing database connection: {e}")
+
+
+def db_shutdown() -> None:
+    """
+        Shutdown hook of the application: closes the pooled database connections and stops the
+        worker processes of the parallel relink (see bf_shutdown_pool).
+    """
+    db_close_connections()
+    bf_shutdown_pool()
+
+
+def _after_fork() -> None:
+    global _LOCAL, _LOCK, _EPOCH
+    _INHERITED.extend(_CONNECTIONS)
+    _CONNECTIONS.clear()
+    _LOCAL, _LOCK = threading.local(), threading.Lock()
+    _EPOCH += 1
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
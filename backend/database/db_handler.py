@@ -1,5 +1,10 @@
 import sqlite3
-from config import PATHS
+from config import PATHS, BLOOMFILTER_SETTINGS
+from .db_lsh import db_get_lsh, db_build_lsh_index
+from .db_mih import db_build_mih_index
+from .db_cache import db_create_generation_triggers
+from .db_connection import db_connect, db_apply_journal_mode
+from backend.bloomfilter import bf_scheme_version, bf_get_encoder, bf_blob_decode
 
 def create_db(patient_table: str = "Patientendaten",
                 patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
@@ -10,6 +15,14 @@ def create_db(patient_table: str = "Patientendaten",
         This function will:
             1. Connect to the patient database file and create a table for patient records.
             2. Connect to the PID database file and create a table for PID records.
+            3. Tag both databases with the encoding version of their bloomfilters (see bf_meta).
+            4. Add the indexed popcount columns to the patient table (see migrate_bf_counts).
+            5. Build the LSH index and the multi-index hash of the patient table if enabled
+               (BLOOMFILTER_SETTINGS.USE_LSH_INDEX, USE_MIH_INDEX) and they do not exist yet.
+            6. Create the generation counter validating the filter cache of the patient table
+               if BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE is enabled (see db_create_generation_triggers).
+            7. Set the journal mode of the storage profile on both databases (see DATABASE_SETTINGS.STORAGE_PROFILE).
+            8. Index the names of the patient table for the name lookups (see migrate_name_index).
 
         Parameters:
             patient_table (str): Name of the patient table to create. Must be a valid SQLite identifier.
@@ -44,16 +57,110 @@ def create_db(patient_table: str = "Patientendaten",
         );
     """
 
+    meta_sql = """
+        CREATE TABLE IF NOT EXISTS bf_meta (
+            key    TEXT    PRIMARY KEY,
+            value  TEXT    NOT NULL
+        );
+    """
+
     try:
-        with sqlite3.connect(patient_db_path) as conn:
+        with db_connect(patient_db_path) as conn:
             conn.execute(patient_sql)
+            conn.execute(meta_sql)
+            tag_encoding_version(conn, patient_table)
+            migrate_bf_counts(conn, patient_table)
+            migrate_name_index(conn, patient_table)
+            if BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE:
+                db_create_generation_triggers(conn, patient_table)
             conn.commit()
+            db_apply_journal_mode(conn)
+            build_lsh = BLOOMFILTER_SETTINGS.USE_LSH_INDEX and db_get_lsh(conn, patient_table) is None
+            build_mih = BLOOMFILTER_SETTINGS.USE_MIH_INDEX and db_get_lsh(conn, patient_table, "mih") is None
 
+        if build_lsh:
+            db_build_lsh_index(patient_table, patient_db_path)
+        if build_mih:
+            db_build_mih_index(patient_table, patient_db_path)
 
 
-        with sqlite3.connect(pid_db_path) as conn:
+
+        with db_connect(pid_db_path) as conn:
             conn.execute(pid_sql)
+            conn.execute(meta_sql)
+            tag_encoding_version(conn, "pidTable_main")
             conn.commit()
+            db_apply_journal_mode(conn)
 
     except sqlite3.Error as e:
-        print(f"Fehler beim erstellen der Datenbanekn: {e}")
\ No newline at end of file
+        print(f"Fehler beim erstellen der Datenbanekn: {e}")
+
+
+def tag_encoding_version(conn: sqlite3.Connection, data_table: str) -> None:
+    """
+        Store the encoding version of the bloomfilters in bf_meta, unless the database is already tagged.
+
+        Databases which already hold filters but no tag were filled before the tag existed and
+        therefore use the "seeded" scheme; empty databases are tagged with the configured scheme.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the database; bf_meta has to exist.
+            data_table (str): Table holding the bloomfilters of the database.
+
+        Returns:
+            None
+    """
+    has_rows = conn.execute(f'SELECT 1 FROM "{data_table}" LIMIT 1').fetchone()
+    version = bf_scheme_version("seeded") if has_rows else bf_scheme_version(BLOOMFILTER_SETTINGS.ENCODING_SCHEME)
+    conn.execute("INSERT OR IGNORE INTO bf_meta (key, value) VALUES ('encoding_version', ?)", (str(version),))
+
+
+def migrate_bf_counts(conn: sqlite3.Connection, patient_table: str) -> None:
+    """
+        Add the popcount columns of the bloomfilters to a patient table, fill them for rows
+        stored without counts and index them.
+
+        The columns are "bf_count" for the whole filter and "bf_count_<i>" per segment (see RecordSchema.count_columns);
+        they let the relink skip every filter which cannot reach the thresholds by its amount of set bits.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table; must be a valid SQLite identifier.
+
+        Returns:
+            None
+    """
+    schema = bf_get_encoder().schema
+    columns = schema.count_columns()
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info("{patient_table}")')}
+    for column in columns:
+        if column not in existing:
+            conn.execute(f'ALTER TABLE "{patient_table}" ADD COLUMN {column} INTEGER')
+
+    # Backfill in batches, updated rows drop out of the selection
+    select_sql = f'SELECT patient_id, BF FROM "{patient_table}" WHERE bf_count IS NULL LIMIT 10000'
+    update_sql = f'UPDATE "{patient_table}" SET {", ".join(f"{column} = ?" for column in columns)} WHERE patient_id = ?'
+    while rows := conn.execute(select_sql).fetchall():
+        counts = schema.popcounts(bf_blob_decode([bf for _, bf in rows], schema.total_bytes)).tolist()
+        conn.executemany(update_sql, [(*count, patient_id) for count, (patient_id, _) in zip(counts, rows)])
+
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{patient_table}_bf_count" ON "{patient_table}" (bf_count)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{patient_table}_bf_segment_counts" '
+                 f'ON "{patient_table}" ({", ".join(columns[1:])})')
+
+
+def migrate_name_index(conn: sqlite3.Connection, patient_table: str) -> None:
+    """
+        Index the names of a patient table, unless the index exists.
+
+        The lookups and exports by (first_name, last_name) join the selected names against this index
+        (see db_name_join) instead of scanning the table.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table; must be a valid SQLite identifier.
+
+        Returns:
+            None
+    """
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{patient_table}_name" ON "{patient_table}" (last_name, first_name)')
@@ -0,0 +1,204 @@
+import sqlite3, json
+import numpy as np
+from bitarray import bitarray
+from backend.bloomfilter import BFLSH, bf_get_encoder, bf_lsh_bands, bf_blob_decode
+from config import PATHS, GLOBAL_VAL, BLOOMFILTER_SETTINGS
+from .db_connection import db_connect
+
+
+# Kinds of bucket indexes: "lsh" (see db_build_lsh_index) and "mih" (see db_build_mih_index)
+BF_BUCKET_INDEXES = ("lsh", "mih")
+
+
+def db_lsh_table(patient_table: str, kind: str = "lsh") -> str:
+    """
+        Name of the side table holding the buckets of a patient table.
+    """
+    return f"{patient_table}_{kind}"
+
+
+def db_get_lsh(conn: sqlite3.Connection, patient_table: str = "Patientendaten", kind: str = "lsh") -> BFLSH | None:
+    """
+        Read the parameters of a bucket index of a patient table from bf_meta.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+            kind (str): Kind of the index, see BF_BUCKET_INDEXES.
+
+        Returns:
+            BFLSH | None: The bit sampling of the index, or None if the table has no such index.
+    """
+    try:
+        row = conn.execute("SELECT value FROM bf_meta WHERE key = ?", (f"{kind}:{patient_table}",)).fetchone()
+    except sqlite3.Error:
+        return None
+    return BFLSH(json.loads(row[0])["positions"], bf_get_encoder().schema) if row else None
+
+
+def db_get_bucket_indexes(conn: sqlite3.Connection, patient_table: str = "Patientendaten") -> dict[str, BFLSH]:
+    """
+        Read all bucket indexes of a patient table; the result maps the kind of each existing index to its bit sampling.
+    """
+    indexes = {kind: db_get_lsh(conn, patient_table, kind) for kind in BF_BUCKET_INDEXES}
+    return {kind: lsh for kind, lsh in indexes.items() if lsh is not None}
+
+
+def db_lsh_insert(conn: sqlite3.Connection, patient_table: str, patient_ids: list[int], filters,
+                  indexes: dict[str, BFLSH] | None = None) -> None:
+    """
+        Add the buckets of newly inserted patients to the bucket indexes; does nothing if the table has none.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+            patient_ids (list[int]): IDs of the patients.
+            filters (bytes | np.ndarray): Their Bloom filters, concatenated or as uint8 matrix, in the order of patient_ids.
+            indexes (dict[str, BFLSH] | None): Indexes to fill; default = all indexes of the table (see db_get_bucket_indexes).
+
+        Returns:
+            None
+    """
+    indexes = db_get_bucket_indexes(conn, patient_table) if indexes is None else indexes
+    if not len(patient_ids):
+        return
+    for kind, lsh in indexes.items():
+        keys = lsh.keys(filters).tolist()
+        if len(keys) != len(patient_ids):
+            raise ValueError(f"db_lsh_insert: {len(patient_ids)} ids for {len(keys)} filters")
+        conn.executemany(
+            f'INSERT OR IGNORE INTO "{db_lsh_table(patient_table, kind)}" (band, bucket, patient_id) VALUES (?, ?, ?)',
+            [(band, bucket, patient_id) for patient_id, buckets in zip(patient_ids, keys) for band, bucket in enumerate(buckets)]
+        )
+
+
+def db_lsh_delete(conn: sqlite3.Connection, patient_table: str, patient_ids: list[int]) -> None:
+    """
+        Remove deleted patients from the bucket indexes; does nothing if the table has none.
+    """
+    if not patient_ids:
+        return
+    for kind in db_get_bucket_indexes(conn, patient_table):
+        conn.execute(
+            f'DELETE FROM "{db_lsh_table(patient_table, kind)}" WHERE patient_id IN ({",".join("?" for _ in patient_ids)})',
+            list(patient_ids)
+        )
+
+
+def db_bucket_condition(patient_table: str, kind: str, probes) -> tuple[str, tuple]:
+    """
+        Build the SQL condition selecting the patients found in any of the probed buckets.
+
+        Parameters:
+            patient_table (str): Name of the patient table.
+            kind (str): Kind of the index, see BF_BUCKET_INDEXES.
+            probes (Iterable[tuple[int, int]]): Probed (band, bucket) pairs.
+
+        Returns:
+            tuple[str, tuple]: Condition on patient_id and its parameters.
+    """
+    probes = sorted(set(probes))
+    if not probes:
+        return "0", ()
+    # Joining the probes lets SQLite look every bucket up in the primary key instead of scanning the side table
+    condition = (f'patient_id IN (SELECT idx.patient_id FROM (VALUES {", ".join("(?, ?)" for _ in probes)}) AS probe '
+                 f'JOIN "{db_lsh_table(patient_table, kind)}" AS idx ON idx.band = probe.column1 AND idx.bucket = probe.column2)')
+    return condition, tuple(value for probe in probes for value in probe)
+
+
+def db_create_bucket_index(conn: sqlite3.Connection, patient_table: str, kind: str, lsh: BFLSH, meta: dict) -> None:
+    """
+        Create (or recreate) the side table of a bucket index, store its parameters in bf_meta and fill it
+        with all stored patients.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+            kind (str): Kind of the index, see BF_BUCKET_INDEXES.
+            lsh (BFLSH): Bit sampling of the index.
+            meta (dict): Further parameters stored with the sampled positions.
+
+        Returns:
+            None
+    """
+    index_table = db_lsh_table(patient_table, kind)
+    conn.execute(f'DROP TABLE IF EXISTS "{index_table}"')
+    conn.execute(f"""
+        CREATE TABLE "{index_table}" (
+            band        INTEGER NOT NULL,
+            bucket      INTEGER NOT NULL,
+            patient_id  INTEGER NOT NULL,
+            PRIMARY KEY (band, bucket, patient_id)
+        ) WITHOUT ROWID;
+    """)
+    conn.execute(f'CREATE INDEX "idx_{index_table}_patient_id" ON "{index_table}" (patient_id)')
+    conn.execute("INSERT OR REPLACE INTO bf_meta (key, value) VALUES (?, ?)",
+                 (f"{kind}:{patient_table}", json.dumps({"positions": lsh.positions.tolist(), **meta})))
+
+    cursor = conn.execute(f'SELECT patient_id, BF FROM "{patient_table}"')
+    while rows := cursor.fetchmany(10000):
+        filters = bf_blob_decode([bf for _, bf in rows], lsh.schema.total_bytes)
+        db_lsh_insert(conn, patient_table, [patient_id for patient_id, _ in rows], filters.tobytes(), {kind: lsh})
+
+
+def db_lsh_condition(conn: sqlite3.Connection, patient_table: str, bf, probe_swap: bool = True) -> tuple[str, tuple] | None:
+    """
+        Build the SQL condition selecting the LSH candidates of a query filter.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+            bf (bitarray | bytes): The query Bloom filter.
+            probe_swap (bool): If True, also probe with first and last name exchanged, so swapped names are found.
+
+        Returns:
+            tuple[str, tuple] | None: Condition on patient_id and its parameters, or None if the table has no index.
+    """
+    lsh = db_get_lsh(conn, patient_table)
+    if lsh is None:
+        return None
+    query = bf.tobytes() if isinstance(bf, bitarray) else bytes(bf)
+    if probe_swap and len(lsh.schema) >= 2:
+        query += lsh.swapped_query(query)
+    probes = [(band, bucket) for buckets in lsh.keys(np.frombuffer(query, dtype=np.uint8)).tolist()
+              for band, bucket in enumerate(buckets)]
+    return db_bucket_condition(patient_table, "lsh", probes)
+
+
+def db_build_lsh_index(
+    patient_table: str = "Patientendaten",
+    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
+    recall: float = BLOOMFILTER_SETTINGS.LSH_RECALL,
+    threshold: float = min(GLOBAL_VAL.RECORD_LINKAGE_TH),
+    band_bits: int = BLOOMFILTER_SETTINGS.LSH_BAND_BITS,
+    seed: int | None = None
+) -> BFLSH:
+    """
+        Create (or rebuild) the LSH index of a patient table in the side table "<patient_table>_lsh".
+
+        The amount of bands is chosen by bf_lsh_bands, so a pair with the similarity threshold is a candidate
+        with the probability recall; the share of set bits is taken from the stored popcounts.
+        The parameters are stored in bf_meta, afterwards the index is maintained by the insert and delete functions.
+
+        Parameters:
+            patient_table (str): Name of the patient table.
+            patient_db_path (str): Path to the patient database.
+            recall (float): Wanted probability to find a pair with the similarity threshold.
+            threshold (float): Similarity the recall refers to; default = lowest RECORD_LINKAGE_TH.
+            band_bits (int): Amount of bits sampled per band.
+            seed (int | None): Seed of the sampled bit positions.
+
+        Returns:
+            BFLSH: The LSH of the index.
+    """
+    if not patient_table.isidentifier():
+        raise ValueError(f"Invalid table name: {patient_table!r}")
+    schema = bf_get_encoder().schema
+
+    with db_connect(patient_db_path) as conn:
+        average = conn.execute(f'SELECT AVG(bf_count) FROM "{patient_table}"').fetchone()[0]
+        fill = average / schema.total_bits if average else BLOOMFILTER_SETTINGS.LSH_EXPECTED_FILL
+        lsh = BFLSH.create(bf_lsh_bands(recall, threshold, fill, band_bits), band_bits, schema, seed)
+        db_create_bucket_index(conn, patient_table, "lsh", lsh, {"recall": recall, "threshold": threshold, "fill": fill})
+        conn.commit()
+    return lsh
@@ -0,0 +1,96 @@
+import sqlite3
+from itertools import combinations
+from math import comb
+from bitarray import bitarray
+from backend.bloomfilter import BFLSH, bf_get_encoder, bf_mih_radius
+from config import PATHS, BLOOMFILTER_SETTINGS
+from .db_lsh import db_get_lsh, db_create_bucket_index, db_bucket_condition
+from .db_connection import db_connect
+
+
+def db_build_mih_index(
+    patient_table: str = "Patientendaten",
+    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
+    segments: list[str] = BLOOMFILTER_SETTINGS.MIH_SEGMENTS,
+    substrings: int = BLOOMFILTER_SETTINGS.MIH_SUBSTRINGS
+) -> BFLSH:
+    """
+        Create (or rebuild) the multi-index hash of a patient table in the side table "<patient_table>_mih".
+
+        The bits of the given segments are split into disjoint substrings, every substring is a hash index of its own.
+        Afterwards the index is maintained by the insert and delete functions like the LSH index.
+
+        Parameters:
+            patient_table (str): Name of the patient table.
+            patient_db_path (str): Path to the patient database.
+            segments (list[str]): Names of the indexed segments (see RecordSchema.names).
+            substrings (int): Amount of substrings; each has at most 62 bits.
+
+        Returns:
+            BFLSH: The substrings of the index.
+    """
+    if not patient_table.isidentifier():
+        raise ValueError(f"Invalid table name: {patient_table!r}")
+    schema = bf_get_encoder().schema
+    unknown = [name for name in segments if name not in schema.names]
+    if unknown:
+        raise ValueError(f"db_build_mih_index: unknown segments {unknown}, use some of {schema.names}")
+    indexed = [schema.names.index(name) for name in segments]
+    mih = BFLSH.substrings(indexed, substrings, schema)
+
+    with db_connect(patient_db_path) as conn:
+        db_create_bucket_index(conn, patient_table, "mih", mih, {"segments": indexed})
+        conn.commit()
+    return mih
+
+
+def db_mih_condition(
+    conn: sqlite3.Connection,
+    patient_table: str,
+    bf: bitarray,
+    threshold: float,
+    swap: bool = False,
+    max_probes: int = BLOOMFILTER_SETTINGS.MIH_MAX_PROBES
+) -> tuple[str, tuple] | None:
+    """
+        Build the SQL condition selecting every patient whose total similarity with bf can be at least threshold.
+
+        A stored filter reaching the threshold differs from bf in at most R bits of the indexed segments (see bf_mih_radius).
+        By the pigeonhole principle one of the m substrings then differs in at most R // m bits, so probing all buckets
+        within that distance of the substrings of bf finds every such filter; the result has no false negatives.
+
+        Parameters:
+            conn (sqlite3.Connection): Open connection to the patient database.
+            patient_table (str): Name of the patient table.
+            bf (bitarray): The query Bloom filter.
+            threshold (float): Minimal total similarity.
+            swap (bool): If True, also probe with first and last name exchanged, for swapped names rated on the exchanged segments.
+            max_probes (int): Maximal amount of probed buckets.
+
+        Returns:
+            tuple[str, tuple] | None: Condition on patient_id and its parameters, or None if the table has no
+                                      multi-index hash or the threshold needs more than max_probes probes.
+    """
+    mih = db_get_lsh(conn, patient_table, "mih")
+    if mih is None:
+        return None
+    schema = mih.schema
+    indexed = sorted({segment for segment in range(len(schema))
+                      for start, end in [(schema.offsets[segment], schema.offsets[segment] + schema.sizes[segment])]
+                      if ((mih.positions >= start) & (mih.positions < end)).any()})
+    counts = schema.popcounts(bf.tobytes())[0, 1:].tolist()
+    radius = bf_mih_radius([counts[segment] for segment in indexed], threshold, len(schema))
+    if radius is None:
+        return None
+    if swap and len(schema) >= 2:
+        swapped_counts = [counts[1], counts[0]] + counts[2:]
+        radius = max(radius, bf_mih_radius([swapped_counts[segment] for segment in indexed], threshold, len(schema)))
+
+    distance = radius // mih.bands
+    if mih.bands * sum(comb(mih.band_bits, flips) for flips in range(distance + 1)) * (2 if swap else 1) > max_probes:
+        return None
+    masks = [sum(1 << bit for bit in bits) for flips in range(distance + 1) for bits in combinations(range(mih.band_bits), flips)]
+
+    queries = [bf.tobytes()] + ([mih.swapped_query(bf)] if swap and len(schema) >= 2 else [])
+    probes = [(band, bucket ^ mask) for query in queries for band, bucket in enumerate(mih.keys(query)[0].tolist()) for mask in masks]
+    return db_bucket_condition(patient_table, "mih", probes)
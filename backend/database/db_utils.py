@@ -1,13 +1,43 @@
-import sqlite3, os, csv, json, re
+import sqlite3, os, csv, json, re, io
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, count
 import pandas as pd
+import numpy as np
 from bitarray import bitarray
 from datetime import datetime
-from backend.bloomfilter import get_bloomfilter, bf_sorenson_dice,bf_extended_similarity, bf_add_salt, bf_convert_bytes_to_01
+from backend.bloomfilter import bf_get_encoder, bf_extended_similarity, bf_add_salt_matrix, bf_convert_chunk_to_01, bf_scheme_version, bf_check_encoding_version
+from backend.bloomfilter import BFMatrix, BF_RATINGS, BF_WEAK, bf_rate, bf_exact_total, bf_check_thresholds, bf_dice_count_window
+from backend.bloomfilter import BF_BATCH_QUERIES, BF_BATCH_ROWS, bf_parallel_extended_matches, bf_parallel_top_k, bf_parallel_batch_top_k
+from backend.bloomfilter import BFBinaryWriter, BFBinaryFile, bf_blob_encode, bf_blob_decode
 from backend.data import normalize_date
-from config import PATHS, BLOOMFILTER_SETTINGS, GLOBAL_VAL
+from .db_lsh import db_get_bucket_indexes, db_lsh_insert, db_lsh_delete, db_lsh_condition
+from .db_mih import db_mih_condition
+from .db_cache import db_cache_matrix, db_cache_insert, db_cache_delete
+from .db_connection import db_connect, db_bulk_load
+from config import PATHS, GLOBAL_VAL, DATA_SETTINGS, BLOOMFILTER_SETTINGS, DATABASE_SETTINGS
 from sqlite3 import Error as SQLError
 from pathlib import Path
 
+def db_get_encoding_version(db_path: str = PATHS.DATABASE_PATH_PATIENT) -> int:
+    """
+        Read the encoding version tag of the bloomfilters stored in a database.
+
+        Parameters:
+            db_path (str):      Path to the patient or PID SQLite database file.
+
+        Returns:
+            int                 Encoding version of the database; untagged databases use the "seeded" scheme.
+    """
+    try:
+        with db_connect(db_path) as conn:
+            row = conn.execute("SELECT value FROM bf_meta WHERE key = 'encoding_version'").fetchone()
+    except sqlite3.Error:
+        row = None
+    return int(row[0]) if row else bf_scheme_version("seeded")
+
+
 def db_add_pid_table(
         table_name: str | None = None,
         pid_db_path: str = PATHS.DATABASE_PATH_PID
@@ -27,7 +57,7 @@ def db_add_pid_table(
     prefix = GLOBAL_VAL.PID_TABLE_PREFIX
 
     
-    with sqlite3.connect(pid_db_path) as conn:
+    with db_connect(pid_db_path) as conn:
         cursor = conn.cursor()
 
         if table_name is None:
@@ -101,30 +131,60 @@ def db_delete_pid_table(table_name: str,
         return 0
 
     try:
-        conn_pid = sqlite3.connect(pid_db_path)
-        cursor_pid = conn_pid.cursor()
+        with db_connect(pid_db_path) as conn_pid:
+            cursor_pid = conn_pid.cursor()
 
-        # Check for existence
-        cursor_pid.execute(
-            "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
-            (full_name,)
-        )
-        if not cursor_pid.fetchone():
-            print(f"Table with name '{full_name}' does not exist")
-            return 1
+            # Check for existence
+            cursor_pid.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name=?",
+                (full_name,)
+            )
+            if not cursor_pid.fetchone():
+                print(f"Table with name '{full_name}' does not exist")
+                return 1
 
-        # Drop the table
-        cursor_pid.execute(f"DROP TABLE {full_name}")
-        conn_pid.commit()
+            # Drop the table
+            cursor_pid.execute(f"DROP TABLE {full_name}")
 
     except sqlite3.Error as e:
         print(f"Error deleting table '{full_name}': {e}")
         return 0
 
-    finally:
-        conn_pid.close()
 
 
+def db_patient_insert_query(patient_table: str = "Patientendaten") -> str:
+    """
+    Build the INSERT statement of a patient row: the IDAT, mdat, the Bloom filter and its popcounts
+    (see RecordSchema.count_columns), in this order.
+
+    Parameters:
+        patient_table (str):    Name of the patient table.
+
+    Returns:
+        str: The parameterized INSERT statement.
+    """
+    columns = ["first_name", "last_name", "date_of_birth", "gender", "mdat", "BF"] + bf_get_encoder().schema.count_columns()
+    return f'INSERT INTO "{patient_table}" ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})'
+
+
+def db_filter_blobs(filters) -> list[bytes]:
+    """
+    The BLOBs stored for Bloom filters: packed, or with DATABASE_SETTINGS.SPARSE_BLOBS per row the shorter
+    of packed and sparse (see bf_blob_encode). Read them with bf_blob_decode or the SQL function bf_unpack.
+
+    Parameters:
+        filters (bytes | np.ndarray):   Packed filters, concatenated or as uint8 matrix (N x total_bytes).
+
+    Returns:
+        list[bytes]: One BLOB per filter.
+    """
+    if isinstance(filters, (bytes, bytearray, memoryview)):
+        filters = np.frombuffer(filters, dtype=np.uint8)
+    filters = np.asarray(filters, dtype=np.uint8).reshape(-1, bf_get_encoder().schema.total_bytes)
+    if DATABASE_SETTINGS.SPARSE_BLOBS:
+        return bf_blob_encode(filters)
+    return [row.tobytes() for row in filters]
+
 
 def db_insert_patient(
     first_name: str,
@@ -156,47 +216,27 @@ def db_insert_patient(
     dob = normalize_date(date_of_birth)
     if not patient_table.isidentifier():
         raise ValueError(f"Invalid table name: {patient_table!r}")
+    encoder = bf_get_encoder()
+    bf_check_encoding_version(encoder.schema.version, db_get_encoding_version(patient_db_path))
 
-    # Build and combine the Bloom filters
-    bf_list = [
-        get_bloomfilter(first_name,
-                        BLOOMFILTER_SETTINGS.HASHRUNS_NAME,
-                        BLOOMFILTER_SETTINGS.HASH_SEEDS40,
-                        BLOOMFILTER_SETTINGS.ARRAY_SIZES["name"],
-                        "word"),
-        get_bloomfilter(last_name,
-                        BLOOMFILTER_SETTINGS.HASHRUNS_NAME,
-                        BLOOMFILTER_SETTINGS.HASH_SEEDS40,
-                        BLOOMFILTER_SETTINGS.ARRAY_SIZES["name"],
-                        "word"),
-        get_bloomfilter(dob,
-                        BLOOMFILTER_SETTINGS.HASHRUNS_OTHER,
-                        BLOOMFILTER_SETTINGS.HASH_SEEDS20,
-                        BLOOMFILTER_SETTINGS.ARRAY_SIZES["other"],
-                        "date"),
-        get_bloomfilter(gender,
-                        BLOOMFILTER_SETTINGS.HASHRUNS_OTHER,
-                        BLOOMFILTER_SETTINGS.HASH_SEEDS20,
-                        BLOOMFILTER_SETTINGS.ARRAY_SIZES["other"],
-                        "word"),
-    ]
-    combined_bf = bitarray()
-    for ba in bf_list:
-        combined_bf.extend(ba)
-    bf_bytes = combined_bf.tobytes()
+    # Build the combined Bloom filter and its popcounts
+    bf_bytes = encoder.encode((first_name, last_name, dob, gender))
+    counts = encoder.schema.popcounts(bf_bytes)[0].tolist()
 
     # Prepare and execute the INSERT statement
-    query = (
-        f'INSERT INTO "{patient_table}" '
-        '(first_name, last_name, date_of_birth, gender, mdat, BF) '
-        'VALUES (?, ?, ?, ?, ?, ?);'
-    )
+    query = db_patient_insert_query(patient_table)
 
     try:
-        with sqlite3.connect(patient_db_path) as conn:
+        cache_committed = None
+        with db_connect(patient_db_path) as conn:
             cursor = conn.cursor()
-            cursor.execute(query,(first_name, last_name, dob, gender, mdat, bf_bytes))
-            return cursor.lastrowid
+            cursor.execute(query,(first_name, last_name, dob, gender, mdat, db_filter_blobs(bf_bytes)[0], *counts))
+            db_lsh_insert(conn, patient_table, [cursor.lastrowid], bf_bytes)
+            if BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE:
+                cache_committed = db_cache_insert(conn, patient_table, [cursor.lastrowid], bf_bytes)
+        if cache_committed:
+            cache_committed()
+        return cursor.lastrowid
     except SQLError as e:
         print(f"Failed to insert patient: {e}")
         return None
@@ -220,24 +260,73 @@ def db_delete_patient(
         int:                            Number of rows deleted.
     """
 
-    ids = [patient_id] if isinstance(patient_id, int) else patient_id
+    ids = [patient_id] if isinstance(patient_id, int) else list(patient_id)
 
     # Validates table name
     if not patient_table.isidentifier():
         raise ValueError(f"Invalid table name: {patient_table!r}")
 
-    query = f'DELETE FROM "{patient_table}" WHERE patient_id IN ({",".join("?" for _ in ids)})'
-
     try:
-        with sqlite3.connect(patient_db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(query, ids)
-            return cursor.rowcount
+        cache_committed = None
+        deleted = 0
+        # One transaction for all ids, so the filter cache is compacted once; each id is one SQL variable
+        with db_connect(patient_db_path) as conn:
+            for start in range(0, len(ids), DATABASE_SETTINGS.DELETE_CHUNK_SIZE):
+                chunk = ids[start:start + DATABASE_SETTINGS.DELETE_CHUNK_SIZE]
+                cursor = conn.execute(f'DELETE FROM "{patient_table}" WHERE patient_id IN ({",".join("?" for _ in chunk)})', chunk)
+                deleted += cursor.rowcount
+                db_lsh_delete(conn, patient_table, chunk)
+            if BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE:
+                cache_committed = db_cache_delete(conn, patient_table, ids, deleted)
+        if cache_committed:
+            cache_committed()
+        return deleted
     except sqlite3.Error as e:
         print(f"Failed to delete patients: {e}")
         return 0
 
 
+# Numbers the temporary name tables, so name joins can be nested on the same connection
+_NAME_TABLES = count()
+
+
+@contextmanager
+def db_name_join(conn: sqlite3.Connection, names, patient_table: str = "Patientendaten"):
+    """
+    Build the FROM clause selecting the patients with the given names from the patient table (aliased as p)
+    by a join against the name index (see migrate_name_index); use it inside the transaction of the query.
+
+    Lists up to DATABASE_SETTINGS.NAME_JOIN_VALUES pairs are joined as a VALUES list; longer lists are loaded into
+    a temporary table, which is dropped again when the context ends, so their length is not bound by the
+    variable limit of SQLite. Every patient matches once, even if its name is given several times.
+
+    Parameters:
+        conn (sqlite3.Connection):              Open connection to the patient database.
+        names (Iterable[tuple[str, str]]):      (first_name, last_name) pairs.
+        patient_table (str):                    Name of the patient table.
+
+    Yields:
+        tuple[str, tuple]: FROM clause and its parameters.
+    """
+    names = list(dict.fromkeys((first_name, last_name) for first_name, last_name in names))
+    # CROSS JOIN keeps the names as outer loop, so every name is one search in the index
+    join = f'CROSS JOIN "{patient_table}" AS p ON p.last_name = names.name_last AND p.first_name = names.name_first'
+    if 0 < len(names) <= DATABASE_SETTINGS.NAME_JOIN_VALUES:
+        yield (f'(SELECT column1 AS name_first, column2 AS name_last '
+               f'FROM (VALUES {", ".join(["(?, ?)"] * len(names))})) AS names {join}',
+               tuple(value for name in names for value in name))
+        return
+
+    table = f"_names_{next(_NAME_TABLES)}"
+    conn.execute(f'CREATE TEMP TABLE "{table}" (name_first TEXT, name_last TEXT, '
+                 f'PRIMARY KEY (name_last, name_first)) WITHOUT ROWID')
+    try:
+        conn.executemany(f'INSERT OR IGNORE INTO temp."{table}" (name_first, name_last) VALUES (?, ?)', names)
+        yield f'temp."{table}" AS names {join}', ()
+    finally:
+        conn.execute(f'DROP TABLE IF EXISTS temp."{table}"')
+
+
 def db_export_patient_into_pid(
     patient_names: tuple[str, str] | list[tuple[str, str]],
     pid_table_name: str,
@@ -269,30 +358,25 @@ def db_export_patient_into_pid(
     pid_table = pid_table_name if pid_table_name.startswith(GLOBAL_VAL.PID_TABLE_PREFIX) else GLOBAL_VAL.PID_TABLE_PREFIX + pid_table_name
     if not pid_table.isidentifier():
         raise ValueError(f"Invalid PID table name: {pid_table}")
+    bf_check_encoding_version(db_get_encoding_version(patient_db_path), db_get_encoding_version(pid_db_path))
 
     try:
-        query = (f'''
-            SELECT mdat, BF FROM "{patient_table}" 
-            WHERE (first_name, last_name) IN ({", ".join(["(?,?)"] * len(names))})
-            '''
-        )
-        params = [item for name in names for item in name]
-        with sqlite3.connect(patient_db_path) as conn_pat:
+        with db_connect(patient_db_path) as conn_pat, db_name_join(conn_pat, names, patient_table) as (source, params):
             cursor_pat = conn_pat.cursor()
-            cursor_pat.execute(query, params)
+            cursor_pat.execute(f'SELECT mdat, BF FROM {source} ORDER BY p.patient_id', params)
             rows = cursor_pat.fetchall()
 
         if not rows:
             return 0
 
-        with sqlite3.connect(pid_db_path) as conn_pid:
+        with db_connect(pid_db_path) as conn_pid:
             cur_pid = conn_pid.cursor()
             cur_pid.execute(
                 "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
                 (pid_table,)
             )
             if not cur_pid.fetchone():
-                db_add_pid_table(pid_table_name)
+                db_add_pid_table(pid_table_name, pid_db_path)
 
             # Insert into PID table
             insert_query = f'INSERT INTO "{pid_table}" (mdat, BFS) VALUES (?, ?)'
@@ -311,12 +395,16 @@ def db_insert_pid(
     salt_fixed: list[int] | None = None,
     patient_table: str = "Patientendaten",
     patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
-    pid_db_path: str = PATHS.DATABASE_PATH_PID
+    pid_db_path: str = PATHS.DATABASE_PATH_PID,
+    chunk_size: int = DATA_SETTINGS.IMPORT_CHUNK_SIZE
 ) -> int:
     
     """
     Read Bloom filters from the patient table, add salt, and insert into a PID table.
 
+    The filters are read in chunks of chunk_size rows as a uint8 matrix and salted at once (see bf_add_salt_matrix);
+    every chunk is inserted with executemany, all chunks in one transaction.
+
     Parameters:
         pid_table_name (str):           PID table name.
         salt_amount (int):              Number of random bits set to 1 in each Bloom filter.
@@ -324,6 +412,7 @@ def db_insert_pid(
         patient_table (str):            Name of the patient table.
         patient_db_path (str):          Path to the patient database.
         pid_db_path (str):              Path to the PID database.
+        chunk_size (int):               Amount of filters salted and inserted together.
 
     Returns:
         int: The number of rows successfully inserted into the PID table.
@@ -335,60 +424,157 @@ def db_insert_pid(
     for name in (patient_table, pid_table):
         if not name.isidentifier():
             raise ValueError(f"Invalid table name: {name}")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+    bf_check_encoding_version(db_get_encoding_version(patient_db_path), db_get_encoding_version(pid_db_path))
 
     inserted = 0
+    rng = np.random.default_rng()
     try:
-        # Fetch Bloom filters and medical data from patient DB
-        query = f'SELECT BF, mdat FROM "{patient_table}"'
-        with sqlite3.connect(patient_db_path) as conn_pat:
-            cursor_pat = conn_pat.cursor()
-            cursor_pat.execute(query)
-            rows = cursor_pat.fetchall()
-
-        if not rows:
-            return 0
-
-        # Insert salted filters into PID DB
-        with sqlite3.connect(pid_db_path) as conn_pid:
-            cur_pid = conn_pid.cursor()
-            query = f'INSERT INTO "{pid_table}" (mdat, BFS) VALUES (?, ?)'
-
-            for bf_bytes, mdat in rows:
-                if bf_bytes is None:
-                    continue
-                bf = bitarray()
-                bf.frombytes(bf_bytes)
-                salted = bf_add_salt(bf, salt_amount, salt_fixed)
-                cur_pid.execute(query, (mdat, salted.tobytes()))
-                inserted += 1
-
-            conn_pid.commit()
+        # Fetch Bloom filters and medical data from patient DB, insert the salted filters into PID DB
+        cursor_pat = db_connect(patient_db_path).execute(f'SELECT BF, mdat FROM "{patient_table}" WHERE BF IS NOT NULL')
+        query = f'INSERT INTO "{pid_table}" (mdat, BFS) VALUES (?, ?)'
+        with db_bulk_load(pid_db_path) as conn_pid:
+            while rows := cursor_pat.fetchmany(chunk_size):
+                filters = bf_blob_decode([bf_bytes for bf_bytes, _ in rows], bf_get_encoder().schema.total_bytes)
+                salted = bf_add_salt_matrix(filters, salt_amount, salt_fixed, rng)
+                conn_pid.executemany(query, zip((mdat for _, mdat in rows), db_filter_blobs(salted)))
+                inserted += len(rows)
 
         return inserted
 
     except sqlite3.Error as e:
         print(f"Error inserting into PID table '{pid_table}': {e}")
-        return inserted
+        return 0
 
 
 def db_insert_patient_record_helper(row,
                                     sql_cursor: sqlite3.Cursor,
                                     patient_table:str = "Patientendaten"
                                     ):
-    fname, lname, dob, gender, mdat = row
-    bf_list = [
-        get_bloomfilter(fname, BLOOMFILTER_SETTINGS.HASHRUNS_NAME, BLOOMFILTER_SETTINGS.HASH_SEEDS40, BLOOMFILTER_SETTINGS.ARRAY_SIZES['name'], 'word'),
-        get_bloomfilter(lname, BLOOMFILTER_SETTINGS.HASHRUNS_NAME, BLOOMFILTER_SETTINGS.HASH_SEEDS40, BLOOMFILTER_SETTINGS.ARRAY_SIZES['name'], 'word'),
-        get_bloomfilter(dob, BLOOMFILTER_SETTINGS.HASHRUNS_OTHER, BLOOMFILTER_SETTINGS.HASH_SEEDS20, BLOOMFILTER_SETTINGS.ARRAY_SIZES['other'], 'date'),
-        get_bloomfilter(gender, BLOOMFILTER_SETTINGS.HASHRUNS_OTHER, BLOOMFILTER_SETTINGS.HASH_SEEDS20, BLOOMFILTER_SETTINGS.ARRAY_SIZES['other'], 'word'),
-    ]
-    bf = bitarray()
-    for b in bf_list:
-        bf.extend(b)
-    sql_cursor.execute(
-        f"INSERT INTO {patient_table} (first_name, last_name, date_of_birth, gender, mdat, BF) VALUES (?, ?, ?, ?, ?, ?)",
-        (fname, lname, dob, gender, mdat or None, bf.tobytes())
-    )
+    # The caller commits; the returned callback (if any) updates the filter cache and has to be run after the commit
+    params = db_encode_patient_chunk([row])[0]
+    sql_cursor.execute(db_patient_insert_query(patient_table), params[:5] + (db_filter_blobs(params[5])[0],) + params[6:])
+    db_lsh_insert(sql_cursor.connection, patient_table, [sql_cursor.lastrowid], params[5])
+    if BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE:
+        return db_cache_insert(sql_cursor.connection, patient_table, [sql_cursor.lastrowid], params[5])
+    return None
+
+
+def db_iter_json_array(text_file, read_size: int = 1 << 16):
+    """
+    Parse a JSON array incrementally and yield its elements one by one, so only the current element is held in memory.
+
+    Parameters:
+        text_file (TextIO):     Open text file containing a JSON array.
+        read_size (int):        Amount of characters read at once.
+
+    Yields:
+        Any: The decoded elements of the array.
+    """
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r"\s*")
+    number_tail = re.compile(r"[0-9.eE+\-]*\Z")
+    buffer, pos, eof = "", 0, False
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        chunk = text_file.read(read_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+        return not eof
+
+    def next_char() -> str:
+        nonlocal pos
+        while True:
+            pos = whitespace.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                return ""
+
+    if next_char() != "[":
+        raise ValueError("JSON import requires a list of records.")
+    pos += 1
+    if next_char() == "]":
+        return
+    while True:
+        next_char()
+        try:
+            element, end = decoder.raw_decode(buffer, pos)
+            # a number reaching the end of the buffer may continue in the next read
+            if not eof and number_tail.match(buffer, end):
+                raise json.JSONDecodeError("Incomplete value", buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        pos = end
+        yield element
+        separator = next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+        pos += 1
+
+
+def db_iter_patient_rows(text_file, file_format: str = 'csv'):
+    """
+    Read patient rows from an import file one by one; invalid rows are reported and skipped.
+
+    Parameters:
+        text_file (TextIO):     Open text file (newline='' for CSV).
+        file_format (str):      'csv' or 'json'.
+
+    Yields:
+        list: Rows (first_name, last_name, date_of_birth, gender, mdat) in file order.
+    """
+    if file_format == 'csv':
+        for row in csv.reader(text_file):
+            if len(row) != 5:
+                print(f"Skipping row: {row}")
+                continue
+            yield row
+
+    elif file_format == 'json':
+        for entry in db_iter_json_array(text_file):
+            try:
+                row = [
+                    entry['first_name'],
+                    entry['last_name'],
+                    entry['date_of_birth'],
+                    entry['gender'],
+                    entry.get('mdat', None)
+                ]
+            except KeyError as ke:
+                print(f"Missing key {ke} in record: {entry}")
+                continue
+            yield row
+
+    else:
+        raise ValueError(f"Unsupported format: {file_format}. Use 'csv' or 'json'.")
+
+
+def db_encode_patient_chunk(rows: list) -> list[tuple]:
+    """
+    Encode a chunk of patient rows into parameter tuples for the INSERT of db_insert_patient_from_file.
+    Runs in the worker processes of the parallel import, so it only depends on its arguments.
+
+    Parameters:
+        rows (list):    Rows (first_name, last_name, date_of_birth, gender, mdat).
+
+    Returns:
+        list[tuple]: (first_name, last_name, date_of_birth, gender, mdat, BF, *popcounts) per row, in input order.
+    """
+    encoder = bf_get_encoder()
+    size = encoder.schema.total_bytes
+    filters = encoder.encode_batch(rows)
+    counts = encoder.schema.popcounts(filters).tolist()
+    bfs = filters.tobytes()
+    return [(fname, lname, dob, gender, mdat or None, bfs[i * size:(i + 1) * size], *counts[i])
+            for i, (fname, lname, dob, gender, mdat) in enumerate(rows)]
 
 
 def db_insert_patient_from_file(
@@ -397,11 +583,19 @@ def db_insert_patient_from_file(
     file_format: str = 'csv',
     patient_table: str = 'Patientendaten',
     patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
-    import_dir: str = PATHS.IMPORT_DIR
+    import_dir: str = PATHS.IMPORT_DIR,
+    workers: int = DATA_SETTINGS.IMPORT_WORKERS,
+    chunk_size: int = DATA_SETTINGS.IMPORT_CHUNK_SIZE,
+    progress_callback = None
 ) -> int:
     """
     Bulk import patients from a CSV or JSON file into the patient database.
 
+    The file is streamed: rows are read one by one (JSON arrays are parsed incrementally) and collected
+    into chunks of chunk_size rows, which are encoded, inserted with executemany and committed together.
+    With workers > 1 the chunks are encoded in worker processes, at most 2 * workers chunks are in flight;
+    this process stays the only writer and inserts the chunks in file order.
+
     Parameters:
         filename (str):          Name of the file to import.
         file_path (str | None):  Full path to the file; overrides import_dir if provided.
@@ -409,6 +603,11 @@ def db_insert_patient_from_file(
         patient_table (str):     Name of the patient table.
         patient_db_path (str):   Path to the patient database.
         import_dir (str):        Directory to look up the file if file_path is None.
+        workers (int):           Amount of worker processes encoding the rows; 1 = no worker processes.
+        chunk_size (int):        Amount of rows encoded and committed together.
+        progress_callback (Callable[[int, int, int], None] | None):
+                                 Called after every committed chunk with
+                                 (rows inserted so far, bytes read so far, file size in bytes).
 
     Returns:
         int: Number of rows successfully inserted.
@@ -425,48 +624,68 @@ def db_insert_patient_from_file(
     
     if not patient_table.isidentifier():
         raise ValueError(f"Invalid table name: {patient_table!r}")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+    file_format = file_format.lower()
+    if file_format not in ('csv', 'json'):
+        raise ValueError(f"Unsupported format: {file_format}. Use 'csv' or 'json'.")
+    bf_check_encoding_version(bf_get_encoder().schema.version, db_get_encoding_version(patient_db_path))
 
+    query = db_patient_insert_query(patient_table)
+    total_bytes = file_path.stat().st_size
     inserted = 0
-    file_format = file_format.lower()
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
     try:
-        with sqlite3.connect(patient_db_path) as conn:
-            cursor = conn.cursor()
-
-            if file_format == 'csv':
-                with file_path.open(newline='', encoding='utf-8') as f:
-                    reader = csv.reader(f)
-                    for row in reader:
-                        if len(row) != 5:
-                            print(f"Skipping row: {row}")
-                            continue
-                        db_insert_patient_record_helper(row, cursor)
-                        inserted += 1
-
-            elif file_format == 'json':
-                data = json.loads(file_path.read_text(encoding='utf-8'))
-                if not isinstance(data, list):
-                    raise ValueError("JSON import requires a list of records.")
-                for entry in data:
-                    try:
-                        row = [
-                            entry['first_name'],
-                            entry['last_name'],
-                            entry['date_of_birth'],
-                            entry['gender'],
-                            entry.get('mdat', None)
-                        ]
-                        db_insert_patient_record_helper(row, cursor)
-                        inserted += 1
-                    except KeyError as ke:
-                        print(f"Missing key {ke} in record: {entry}")
-                        continue
-
+        # The binary stream below the text wrapper tells how far the file has been read;
+        # the chunks are committed one by one with the bulk synchronous mode of the storage profile
+        with file_path.open('rb') as binary_file, db_bulk_load(patient_db_path) as conn:
+            text_file = io.TextIOWrapper(binary_file, encoding='utf-8', newline='')
+            rows = db_iter_patient_rows(text_file, file_format)
+            chunks = iter(lambda: list(islice(rows, chunk_size)), [])
+
+            indexes = db_get_bucket_indexes(conn, patient_table)
+            track_ids = bool(indexes) or BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE
+
+            def write(params: list[tuple]) -> None:
+                nonlocal inserted
+                filters = b"".join(row[5] for row in params)
+                cache_committed = None
+                if track_ids:
+                    last_id = conn.execute(f'SELECT MAX(patient_id) FROM "{patient_table}"').fetchone()[0] or 0
+                if DATABASE_SETTINGS.SPARSE_BLOBS:
+                    conn.executemany(query, (row[:5] + (blob,) + row[6:] for row, blob in zip(params, db_filter_blobs(filters))))
+                else:
+                    conn.executemany(query, params)
+                if track_ids:
+                    # This is the only writer, so the new rows are the ones above the previous maximum, in insert order
+                    new_ids = [row[0] for row in conn.execute(
+                        f'SELECT patient_id FROM "{patient_table}" WHERE patient_id > ? ORDER BY patient_id', (last_id,))]
+                    db_lsh_insert(conn, patient_table, new_ids, filters, indexes)
+                    if BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE:
+                        cache_committed = db_cache_insert(conn, patient_table, new_ids, filters)
+                conn.commit()
+                if cache_committed:
+                    cache_committed()
+                inserted += len(params)
+                if progress_callback:
+                    progress_callback(inserted, binary_file.tell(), total_bytes)
+
+            if pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(db_encode_patient_chunk, chunk))
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft().result())
+                while pending:
+                    write(pending.popleft().result())
             else:
-                raise ValueError(f"Unsupported format: {file_format}. Use 'csv' or 'json'.")
-
-            conn.commit()
+                for chunk in chunks:
+                    write(db_encode_patient_chunk(chunk))
     except sqlite3.Error as e:
         print(f"Error importing file '{filename}': {e}")
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
     return inserted
 
 
@@ -475,15 +694,12 @@ def db_insert_patient_from_file(
 def db_get_idat(patient_table: str = "Patientendaten",
                 patient_db_path: str = PATHS.DATABASE_PATH_PATIENT):
     try:
-        conn_patient = sqlite3.connect(patient_db_path)
-        cursor_patient = conn_patient.execute(f"SELECT first_name, last_name, date_of_birth, gender, BF FROM {patient_table}")
+        conn_patient = db_connect(patient_db_path)
+        cursor_patient = conn_patient.execute(f"SELECT first_name, last_name, date_of_birth, gender, bf_unpack(BF) FROM {patient_table}")
         rows = cursor_patient.fetchall()
         return rows
     except Exception as e:
         print(f"Fehler beim auslesen der idat: {e}")
-    finally:
-        if conn_patient:   
-            conn_patient.close()
 
 
 
@@ -511,7 +727,7 @@ def db_clear_pid_table(
         raise ValueError(f"Invalid table name: {table_name!r}")
 
     try:
-        with sqlite3.connect(pid_db_path) as conn:
+        with db_connect(pid_db_path) as conn:
             cursor = conn.cursor()
 
             # Check existence
@@ -538,6 +754,13 @@ def db_clear_pid_table(
         return 0
 
 
+def db_select_column(column: str) -> str:
+    """
+    Quoted column of a SELECT list; the filter columns BF and BFS are returned packed (see bf_unpack).
+    """
+    return f'bf_unpack("{column}") AS "{column}"' if column.upper() in ("BF", "BFS") else f'"{column}"'
+
+
 
 #Datenbank Eintrag basierend auf Vor- und Nachname
 def db_lookup_name(
@@ -576,22 +799,14 @@ def db_lookup_name(
     for col in select_columns:
         if not col.isidentifier():
             raise ValueError(f"Invalid column name: {col!r}")
-        quoted_cols.append(f'"{col}"')
+        quoted_cols.append(db_select_column(col))
     columns_str = ", ".join(quoted_cols)
 
 
-    params = [item for name in names for item in name]
-
-    query = (f'''
-            SELECT {columns_str} FROM "{patient_table}" 
-            WHERE (first_name, last_name) IN ({", ".join(["(?, ?)" for _ in names])})
-        '''
-    )
-
     try:
-        with sqlite3.connect(patient_db_path) as conn:
+        with db_connect(patient_db_path) as conn, db_name_join(conn, names, patient_table) as (source, params):
             cursor = conn.cursor()
-            cursor.execute(query, params)
+            cursor.execute(f'SELECT {columns_str} FROM {source} ORDER BY p.patient_id', params)
             return cursor.fetchall()
     except sqlite3.Error as e:
         print(f"Error looking up patients {names}: {e}")
@@ -628,7 +843,7 @@ def db_lookup_id(
     for col in select_columns:
         if not col.isidentifier():
             raise ValueError(f"Invalid column name: {col!r}")
-        quoted_cols.append(f'"{col}"')
+        quoted_cols.append(db_select_column(col))
     columns_str = ", ".join(quoted_cols)
 
     query = (
@@ -637,7 +852,7 @@ def db_lookup_id(
     )
 
     try:
-        with sqlite3.connect(patient_db_path) as conn:
+        with db_connect(patient_db_path) as conn:
             cursor = conn.cursor()
             cursor.execute(query, ids)
             return cursor.fetchall()
@@ -645,36 +860,160 @@ def db_lookup_id(
         print(f"Error looking up patient IDs {ids}: {e}")
         return []
 
+def db_load_bf_matrix(patient_table: str = "Patientendaten",
+                      patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
+                      where: str = "",
+                      params: tuple = ()) -> BFMatrix:
+    """
+    Load the stored patient Bloom filters into one packed matrix for vectorized comparisons.
+
+    With BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE the filters are taken from the memory-mapped cache (see db_cache_matrix)
+    instead of the BLOBs: all rows without a copy, for a condition only the patient_ids are read from the database.
+
+    Parameters:
+        patient_table (str):    Name of the patient table.
+        patient_db_path (str):  Path to the patient database.
+        where (str):            Optional SQL condition selecting the rows; default = all rows.
+        params (tuple):         Parameters of the condition.
+
+    Returns:
+        BFMatrix: Filters of the selected patients, with their patient_id as ids.
+    """
+    if not patient_table.isidentifier():
+        raise ValueError(f"Invalid table name: {patient_table!r}")
+    # An index used for the condition must not change the order of the rows
+    condition = (f" WHERE {where}" if where else "") + " ORDER BY patient_id"
+    with db_connect(patient_db_path) as conn:
+        if BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE:
+            matrix = db_cache_matrix(conn, patient_table)
+            if matrix is not None:
+                if not where:
+                    return matrix
+                ids = np.fromiter((row[0] for row in conn.execute(f'SELECT patient_id FROM "{patient_table}"{condition}', params)), dtype=np.int64)
+                rows = np.searchsorted(matrix.ids, ids)
+                if not len(ids) or (len(matrix) and np.array_equal(matrix.ids[np.minimum(rows, len(matrix) - 1)], ids)):
+                    return matrix.subset(rows)
+        rows = conn.execute(f'SELECT patient_id, BF FROM "{patient_table}"{condition}', params).fetchall()
+    return BFMatrix.from_blobs(rows, bf_get_encoder().schema)
+
+
+def db_relink_workers(matrix: BFMatrix, workers: int) -> bool:
+    """
+    Whether a relink over matrix is worth splitting across worker processes (see BLOOMFILTER_SETTINGS.RELINK_WORKERS).
+    """
+    return workers > 1 and len(matrix) >= BLOOMFILTER_SETTINGS.RELINK_PARALLEL_MIN_ROWS
+
+
+def db_bf_count_filter(bf: bitarray, thresholds: list[float], min_rating: str = "weak", swap: bool = False) -> tuple[str, tuple]:
+    """
+    Build the SQL condition selecting only patients whose popcounts allow a relink result with bf,
+    i.e. a total similarity of at least the threshold of min_rating, or for "weak" also a first/last name swap
+    (see bf_extended_similarity).
+
+    Every segment similarity is bound by 2 * min(|A|, |B|) / (|A| + |B|), so the mean of these bounds has to reach
+    the threshold. A segment alone has to reach n * threshold - (n - 1), which is an indexed range on its count.
+    Rows stored without counts are always selected.
+
+    Parameters:
+        bf (bitarray):              The target Bloom filter to relink.
+        thresholds (list[float]):   Three similarity thresholds, sorted descending.
+        min_rating (str):           Lowest rating of the results: "strong", "medium" or "weak".
+        swap (bool):                If True, rows reaching the threshold with exchanged first and last names are selected too.
+
+    Returns:
+        tuple[str, tuple]: Condition for db_load_bf_matrix and its parameters.
+    """
+    schema = bf_get_encoder().schema
+    counts = schema.popcounts(bf.tobytes())[0, 1:].tolist()
+    columns = schema.count_columns()[1:]
+    threshold = thresholds[db_rating_index(min_rating)]
+
+    def window(column: str, count: int, threshold: float) -> tuple[list[str], list]:
+        lo, hi = bf_dice_count_window(count, threshold)
+        if hi is None: return [], []
+        return [f"{column} BETWEEN ? AND ?"], [lo, hi]
+
+    def mean_bound(pairs: list[tuple[str, int]]) -> tuple[str, list]:
+        # Mean of the similarity bounds; the small tolerance keeps float rounding from dropping a row
+        bounds, params = [], []
+        for column, count in pairs:
+            bounds.append(f"(CASE WHEN {column} + ? = 0 THEN 1.0 ELSE 2.0 * MIN({column}, ?) / ({column} + ?) END)")
+            params += [count] * 3
+        conditions = [f"({' + '.join(bounds)}) >= ?"]
+        params.append(len(pairs) * threshold - 1e-9)
+        for column, count in pairs:
+            condition, values = window(column, count, len(pairs) * threshold - (len(pairs) - 1))
+            conditions, params = condition + conditions, values + params
+        return " AND ".join(conditions), params
+
+    branches = [mean_bound(list(zip(columns, counts)))]
+    if len(columns) >= 4:
+        if min_rating == "weak":
+            # Swap check: the first name has to reach the lowest threshold with the other last name and vice versa
+            first, first_values = window(columns[0], counts[1], threshold)
+            last, last_values = window(columns[1], counts[0], threshold)
+            branches.append((" AND ".join(first + last), first_values + last_values))
+        elif swap:
+            branches.append(mean_bound(list(zip(columns, [counts[1], counts[0]] + counts[2:]))))
+
+    branches.append(("bf_count IS NULL", []))
+    return " OR ".join(f"({condition})" for condition, _ in branches), tuple(value for _, values in branches for value in values)
+
+
+def db_rating_index(min_rating: str) -> int:
+    """
+    Index of the threshold belonging to a rating ("strong" = 0, "medium" = 1, "weak" = 2).
+    """
+    ratings = BF_RATINGS[:BF_WEAK + 1].tolist()
+    if min_rating not in ratings:
+        raise ValueError(f"Invalid rating: {min_rating!r}, use one of {ratings}")
+    return ratings.index(min_rating)
+
+
+def db_relink_candidates(bf: bitarray, thresholds: list[float], min_rating: str, swap: bool,
+                         patient_table: str, patient_db_path: str, use_lsh: bool = True) -> tuple[str, tuple]:
+    """
+    Build the SQL condition selecting the patients which have to be compared with bf for a relink down to min_rating:
+    the popcount filter (see db_bf_count_filter), restricted to the candidates of the multi-index hash for "strong"
+    or "medium" if the threshold is high enough (exact), otherwise of the LSH index (with the configured recall).
+
+    Returns:
+        tuple[str, tuple]: Condition for db_load_bf_matrix and its parameters.
+    """
+    where, params = db_bf_count_filter(bf, thresholds, min_rating, swap)
+    candidates = None
+    with db_connect(patient_db_path) as conn:
+        if min_rating != "weak":
+            candidates = db_mih_condition(conn, patient_table, bf, thresholds[db_rating_index(min_rating)], swap)
+        if candidates is None and use_lsh:
+            candidates = db_lsh_condition(conn, patient_table, bf)
+    if candidates:
+        where, params = f"{candidates[0]} AND ({where})", candidates[1] + params
+    return where, params
+
+
 #Einfache Relink variante bisher nicht verwendet
 def db_relink_bf(bf:bitarray, th: float,
                     patient_table: str = "Patientendaten",
-                    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT):
+                    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
+                    encoding_version: int | None = None):
+    if encoding_version is None: encoding_version = bf_get_encoder().schema.version
+    bf_check_encoding_version(encoding_version, db_get_encoding_version(patient_db_path))
     try:
-        conn_patient = sqlite3.connect(patient_db_path)
-        cursor = conn_patient.cursor()
-
-        cursor.execute(f"SELECT patienten_id, BF FROM {patient_table}")
-        rows = cursor.fetchall()
+        # Only filters whose popcount can exceed th are loaded
+        lo, hi = bf_dice_count_window(bf.count(1), th)
+        where, params = ("", ()) if hi is None else ("bf_count BETWEEN ? AND ? OR bf_count IS NULL", (lo, hi))
+        matrix = db_load_bf_matrix(patient_table, patient_db_path, where, params)
+        similarities = matrix.filter_dice(bf)
+        hits = np.flatnonzero(similarities > th)
 
-        matching_df = pd.DataFrame(columns=["ID", "Similarity"])
+        return pd.DataFrame({"ID": matrix.ids[hits].tolist(),
+                             "Similarity": similarities[hits].tolist()},
+                            columns=["ID", "Similarity"])
 
-        for row in rows:
-            patient_id, db_bf_blob = row
-
-            db_bf = bitarray()
-            db_bf.frombytes(db_bf_blob)
-            if bf_sorenson_dice(db_bf, bf) > th:
-                matching_df.loc[len(matching_df)] = [patient_id, bf_sorenson_dice(db_bf, bf)]
-        
-
-        return matching_df
-    
     except Exception as e:
         print(f"Fehler beim Zurückführen: {e}")
         return []
-    finally:
-        if conn_patient:
-            conn_patient.close()
 
 
 def db_extended_relink_bf(
@@ -684,13 +1023,22 @@ def db_extended_relink_bf(
     out_mode: str = "total",
     include_notalike: bool = False,
     patient_table: str = "Patientendaten",
-    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT
+    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
+    encoding_version: int | None = None,
+    use_lsh: bool = True,
+    min_rating: str = "weak",
+    workers: int = BLOOMFILTER_SETTINGS.RELINK_WORKERS
 ) -> pd.DataFrame:
     
     """
     Compare a given Bloom filter against all stored patient filters and
     compute extended similarity.
 
+    With out_mode "total" all filters are compared at once on a packed matrix (see BFMatrix);
+    the results are identical to bf_extended_similarity. Only the candidates of an index are compared:
+    for min_rating "strong" or "medium" the multi-index hash (see db_build_mih_index) if the threshold is high enough,
+    which is exact, otherwise the LSH index (see db_build_lsh_index), which finds a match with the configured recall.
+
     Parameters:
         bf (bitarray):
             The target Bloom filter to relink.
@@ -706,6 +1054,15 @@ def db_extended_relink_bf(
             Name of the patient table.
         patient_db_path (str):
             Path to the patient database.
+        encoding_version (int | None):
+            Encoding version of bf; defaults to the configured scheme. A ValueError is raised
+            if it differs from the version of the patient database.
+        use_lsh (bool):
+            If False, the LSH index is not used.
+        min_rating (str):
+            Lowest rating returned: "strong", "medium" or "weak". Suspected swaps are returned for "weak" only.
+        workers (int):
+            Worker processes scoring shards of large tables in parallel (out_mode "total"), see db_relink_workers.
 
     Returns:
         pd.DataFrame: Rows with columns ['ID', 'Rating', 'Similarity', 'Swapped'], one per matching patient.
@@ -714,28 +1071,44 @@ def db_extended_relink_bf(
     # Validate identifier
     if not patient_table.isidentifier():
         raise ValueError(f"Invalid table name: {patient_table!r}")
+    schema = bf_get_encoder().schema
+    if encoding_version is None:
+        encoding_version = schema.version
+    bf_check_encoding_version(encoding_version, db_get_encoding_version(patient_db_path))
 
     records = []
     try:
-        with sqlite3.connect(patient_db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(f'SELECT patient_id, BF FROM "{patient_table}"')
-            rows = cursor.fetchall()
+        if out_mode == "total":
+            thresholds = bf_check_thresholds(thresholds)
+            lowest_rating = db_rating_index(min_rating)
+            # Without include_notalike only rows whose popcounts allow a result have to be compared
+            where, params = ("", ()) if include_notalike else \
+                db_relink_candidates(bf, thresholds, min_rating, swap, patient_table, patient_db_path, use_lsh)
+            matrix = db_load_bf_matrix(patient_table, patient_db_path, where, params)
+            if db_relink_workers(matrix, workers):
+                selected, similarities, totals, swapped = bf_parallel_extended_matches(
+                    matrix, bf, workers, thresholds, lowest_rating, swap, include_notalike)
+            else:
+                selected, similarities, totals, swapped = matrix.extended_matches(bf, thresholds, lowest_rating, swap, include_notalike)
+
+            return pd.DataFrame({"ID": matrix.ids[selected].tolist(),
+                                 "Rating": BF_RATINGS[bf_rate(thresholds, totals)].tolist(),
+                                 "Similarity": [bf_exact_total(row) for row in similarities.tolist()],
+                                 "Swapped": np.where(swapped, "Swap detected (first/last name)", "No swap").tolist()},
+                                columns=["ID", "Rating", "Similarity", "Swapped"])
 
-        for patient_id, bf_blob in rows:
+        matrix = db_load_bf_matrix(patient_table, patient_db_path)
+        filters = matrix.filters()
+
+        for patient_id, bf_blob in zip(matrix.ids.tolist(), filters):
             db_bf = bitarray()
-            db_bf.frombytes(bf_blob)
+            db_bf.frombytes(bf_blob.tobytes())
 
             (similarity, _, rating), did_swap = bf_extended_similarity(
                 db_bf,
                 bf,
-                [
-                    BLOOMFILTER_SETTINGS.ARRAY_SIZES["name"],
-                    BLOOMFILTER_SETTINGS.ARRAY_SIZES["name"],
-                    BLOOMFILTER_SETTINGS.ARRAY_SIZES["other"],
-                    BLOOMFILTER_SETTINGS.ARRAY_SIZES["other"]
-                ],
-                ["first name", "last name", "birthdate", "gender"],
+                schema.sizes,
+                schema.names,
                 out_mode,
                 thresholds,
                 swap
@@ -760,6 +1133,387 @@ def db_extended_relink_bf(
         return pd.DataFrame(columns=["ID", "Rating", "Similarity", "Swapped"])
 
 
+class RelinkMatch:
+    """
+    One result of db_topk_relink_bf; unpacks like the tuple (id, rating, similarity, swapped).
+    """
+    __slots__ = ("id", "rating", "similarity", "swapped")
+
+    def __init__(self, id: int, rating: str, similarity: float, swapped: bool):
+        self.id = id
+        self.rating = rating
+        self.similarity = similarity
+        self.swapped = swapped
+
+    def __iter__(self):
+        return iter((self.id, self.rating, self.similarity, self.swapped))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RelinkMatch) and tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        return f"RelinkMatch(id={self.id}, rating={self.rating!r}, similarity={self.similarity}, swapped={self.swapped})"
+
+
+def db_topk_relink_bf(
+    bf: bitarray,
+    k: int = 10,
+    min_rating: str = "weak",
+    thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+    swap: bool = False,
+    patient_table: str = "Patientendaten",
+    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
+    encoding_version: int | None = None,
+    use_lsh: bool = True,
+    workers: int = BLOOMFILTER_SETTINGS.RELINK_WORKERS
+) -> list[RelinkMatch]:
+    """
+    Find the k stored patients most similar to a Bloom filter.
+
+    The rows are selected like db_extended_relink_bf (out_mode "total") selects them, but only the best k are kept
+    on a bounded heap and candidates are dropped as soon as their remaining segments cannot lift them into it
+    (see BFMatrix.top_k).
+
+    Parameters:
+        bf (bitarray):              The target Bloom filter to relink.
+        k (int):                    Amount of results.
+        min_rating (str):           Lowest rating returned: "strong", "medium" or "weak". Suspected swaps are returned for "weak" only.
+        thresholds (list[float]):   Three similarity thresholds for rating categories.
+        swap (bool):                If True, allow first/last name swap during comparison.
+        patient_table (str):        Name of the patient table.
+        patient_db_path (str):      Path to the patient database.
+        encoding_version (int | None): Encoding version of bf; defaults to the configured scheme.
+        use_lsh (bool):             If False, the LSH index is not used.
+        workers (int):              Worker processes finding the top k of shards of large tables, see db_relink_workers.
+
+    Returns:
+        list[RelinkMatch]: The matches, the most similar first; equal similarities by patient_id.
+    """
+    if not patient_table.isidentifier():
+        raise ValueError(f"Invalid table name: {patient_table!r}")
+    if encoding_version is None:
+        encoding_version = bf_get_encoder().schema.version
+    bf_check_encoding_version(encoding_version, db_get_encoding_version(patient_db_path))
+    thresholds = bf_check_thresholds(thresholds)
+    lowest_rating = db_rating_index(min_rating)
+
+    try:
+        where, params = db_relink_candidates(bf, thresholds, min_rating, swap, patient_table, patient_db_path, use_lsh)
+        matrix = db_load_bf_matrix(patient_table, patient_db_path, where, params)
+        if not len(matrix):
+            return []
+
+        matches = bf_parallel_top_k(matrix, bf, k, workers, thresholds, lowest_rating, swap) if db_relink_workers(matrix, workers) \
+            else matrix.top_k(bf, k, thresholds, lowest_rating, swap)
+        return [RelinkMatch(int(matrix.ids[row]), str(BF_RATINGS[bf_rate(thresholds, np.array([total]))[0]]),
+                            bf_exact_total(sims.tolist()), swapped)
+                for row, total, swapped, sims in matches]
+
+    except sqlite3.Error as e:
+        print(f"Database error during relink: {e}")
+        return []
+
+
+def db_batch_relink(
+    bfs_list,
+    k: int | None = 10,
+    thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+    swap: bool = False,
+    min_rating: str = "weak",
+    include_notalike: bool = False,
+    patient_table: str = "Patientendaten",
+    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
+    encoding_version: int | None = None,
+    query_block: int = BF_BATCH_QUERIES,
+    row_tile: int = BF_BATCH_ROWS,
+    workers: int = BLOOMFILTER_SETTINGS.RELINK_WORKERS
+):
+    """
+    Relink many Bloom filters in a single pass over the stored patient filters.
+
+    The stored filters are loaded once; every block of query_block queries is compared with every tile of
+    row_tile stored filters as a matrix product (see BFMatrix.batch_extended_similarity), and only the k best
+    matches of each query are kept between the tiles. Ratings, similarities and swaps are identical to
+    db_extended_relink_bf with out_mode "total"; the results of a block are yielded as soon as it is done.
+
+    Parameters:
+        bfs_list (Iterable[bitarray | bytes] | np.ndarray):
+            The Bloom filters to relink, or a uint8 matrix with one filter per row.
+        k (int | None):
+            Amount of matches kept per query, the most similar first; None keeps all.
+        thresholds (list[float]):
+            Three similarity thresholds for rating categories.
+        swap (bool):
+            If True, allow first/last name swap during comparison.
+        min_rating (str):
+            Lowest rating returned: "strong", "medium" or "weak". Suspected swaps are returned for "weak" only.
+        include_notalike (bool):
+            If True, include records rated below min_rating.
+        patient_table (str):
+            Name of the patient table.
+        patient_db_path (str):
+            Path to the patient database.
+        encoding_version (int | None):
+            Encoding version of the filters; defaults to the configured scheme.
+        query_block (int):
+            Amount of queries compared at once.
+        row_tile (int):
+            Amount of stored filters compared at once.
+        workers (int):
+            Worker processes comparing every block with shards of large tables, see db_relink_workers.
+
+    Yields:
+        tuple[int, list[tuple]]: Position of the query in bfs_list and its matches as
+        (ID, Rating, Similarity, Swapped) tuples, like the rows of db_extended_relink_bf.
+    """
+    if k is not None and k < 1:
+        raise ValueError(f"k must be at least 1, got {k}")
+    if encoding_version is None:
+        encoding_version = bf_get_encoder().schema.version
+    bf_check_encoding_version(encoding_version, db_get_encoding_version(patient_db_path))
+    thresholds = bf_check_thresholds(thresholds)
+    lowest_rating = db_rating_index(min_rating)
+
+    matrix = db_load_bf_matrix(patient_table, patient_db_path)
+    # A uint8 matrix (e.g. memory-mapped from a binary export) is packed block by block without copying its rows
+    if isinstance(bfs_list, np.ndarray):
+        blocks = (bfs_list[start:start + query_block] for start in range(0, len(bfs_list), query_block))
+    else:
+        queries = iter(bfs_list)
+        blocks = iter(lambda: list(islice(queries, query_block)), [])
+    position = 0
+    for block in blocks:
+        packed = matrix.pack_queries(block)
+        if db_relink_workers(matrix, workers):
+            kept_query, kept_row, kept_total, kept_swap, kept_sims = bf_parallel_batch_top_k(
+                matrix, packed, k, workers, thresholds, lowest_rating, swap, include_notalike, row_tile)
+        else:
+            kept_query, kept_row, kept_total, kept_swap, kept_sims = matrix.batch_top_k(
+                packed, k, thresholds, lowest_rating, swap, include_notalike, row_tile)
+
+        ratings = BF_RATINGS[bf_rate(thresholds, kept_total)].tolist()
+        bounds = np.searchsorted(kept_query, np.arange(len(block) + 1))
+        for query in range(len(block)):
+            yield position + query, [
+                (int(matrix.ids[kept_row[i]]),
+                 ratings[i],
+                 bf_exact_total(kept_sims[i].tolist()),
+                 "Swap detected (first/last name)" if kept_swap[i] else "No swap")
+                for i in range(bounds[query], bounds[query + 1])
+            ]
+        position += len(block)
+
+
+def db_relink_pid_table(
+    pid_table_name: str,
+    k: int | None = 10,
+    thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+    swap: bool = False,
+    min_rating: str = "weak",
+    patient_table: str = "Patientendaten",
+    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT,
+    pid_db_path: str = PATHS.DATABASE_PATH_PID
+):
+    """
+    Relink every entry of a PID table in one pass over the patient table, see db_batch_relink.
+
+    Parameters:
+        pid_table_name (str):       PID table name.
+        k (int | None):             Amount of matches kept per entry; None keeps all.
+        thresholds (list[float]):   Three similarity thresholds for rating categories.
+        swap (bool):                If True, allow first/last name swap during comparison.
+        min_rating (str):           Lowest rating returned: "strong", "medium" or "weak".
+        patient_table (str):        Name of the patient table.
+        patient_db_path (str):      Path to the patient database.
+        pid_db_path (str):          Path to the PID database.
+
+    Yields:
+        tuple[int, list[tuple]]: pid_id of the entry and its matches, see db_batch_relink.
+    """
+    pid_table = pid_table_name if pid_table_name.startswith(GLOBAL_VAL.PID_TABLE_PREFIX) else GLOBAL_VAL.PID_TABLE_PREFIX + pid_table_name
+    if not pid_table.isidentifier():
+        raise ValueError(f"Invalid table name: {pid_table!r}")
+
+    with db_connect(pid_db_path) as conn:
+        rows = conn.execute(f'SELECT pid_id, bfs FROM "{pid_table}" ORDER BY pid_id').fetchall()
+
+    pid_ids = [pid_id for pid_id, _ in rows]
+    filters = bf_blob_decode([bfs for _, bfs in rows], bf_get_encoder().schema.total_bytes)
+    for position, matches in db_batch_relink(filters, k, thresholds, swap, min_rating,
+                                             patient_table=patient_table,
+                                             patient_db_path=patient_db_path,
+                                             encoding_version=db_get_encoding_version(pid_db_path)):
+        yield pid_ids[position], matches
+
+
+def db_relink_binary_file(
+    file_path: str | Path,
+    k: int | None = 10,
+    thresholds: list[float] = GLOBAL_VAL.RECORD_LINKAGE_TH,
+    swap: bool = False,
+    min_rating: str = "weak",
+    patient_table: str = "Patientendaten",
+    patient_db_path: str = PATHS.DATABASE_PATH_PATIENT
+):
+    """
+    Relink every record of a binary export (see db_write_binary_export) in one pass over the patient table.
+    The filters are memory-mapped from the file and packed block by block, see db_batch_relink.
+
+    Parameters:
+        file_path (str | Path):     Path to the binary file.
+        k (int | None):             Amount of matches kept per record; None keeps all.
+        thresholds (list[float]):   Three similarity thresholds for rating categories.
+        swap (bool):                If True, allow first/last name swap during comparison.
+        min_rating (str):           Lowest rating returned: "strong", "medium" or "weak".
+        patient_table (str):        Name of the patient table.
+        patient_db_path (str):      Path to the patient database.
+
+    Yields:
+        tuple[int, list[tuple]]: id of the record in the file and its matches, see db_batch_relink.
+    """
+    export = BFBinaryFile(file_path)
+    export.check_schema(bf_get_encoder().schema)
+    for position, matches in db_batch_relink(export.filters, k, thresholds, swap, min_rating,
+                                             patient_table=patient_table,
+                                             patient_db_path=patient_db_path,
+                                             encoding_version=export.encoding_version):
+        yield int(export.ids[position]), matches
+
+
+def db_insert_pid_from_binary(
+    file_path: str | Path,
+    pid_table_name: str,
+    pid_db_path: str = PATHS.DATABASE_PATH_PID,
+    chunk_size: int = DATA_SETTINGS.IMPORT_CHUNK_SIZE
+) -> int:
+    """
+    Insert the records of a binary PID export (see db_export_pid_to_file) into a PID table, which is created if needed.
+    The filters are passed to SQLite straight from the memory-mapped file (unless DATABASE_SETTINGS.SPARSE_BLOBS re-encodes them);
+    all chunks are inserted in one transaction.
+
+    Parameters:
+        file_path (str | Path):     Path to the binary file; it needs the record column "MDAT".
+        pid_table_name (str):       PID table name.
+        pid_db_path (str):          Path to the PID database.
+        chunk_size (int):           Amount of records inserted together.
+
+    Returns:
+        int: The number of rows inserted into the PID table.
+    """
+    pid_table = pid_table_name if pid_table_name.startswith(GLOBAL_VAL.PID_TABLE_PREFIX) else GLOBAL_VAL.PID_TABLE_PREFIX + pid_table_name
+    if not pid_table.isidentifier():
+        raise ValueError(f"Invalid table name: {pid_table!r}")
+    export = BFBinaryFile(file_path)
+    export.check_schema(bf_get_encoder().schema)
+    if "MDAT" not in export.columns:
+        raise ValueError(f"db_insert_pid_from_binary: {file_path} has no MDAT column, only {export.columns}")
+    bf_check_encoding_version(export.encoding_version, db_get_encoding_version(pid_db_path))
+
+    mdat = export.columns.index("MDAT")
+    records = export.records()
+    query = f'INSERT INTO "{pid_table}" (mdat, BFS) VALUES (?, ?)'
+    try:
+        with db_connect(pid_db_path) as conn:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (pid_table,)).fetchone():
+                db_add_pid_table(pid_table_name, pid_db_path)
+        with db_bulk_load(pid_db_path) as conn:
+            for start in range(0, len(export), chunk_size):
+                filters = export.filters[start:start + chunk_size]
+                blobs = db_filter_blobs(filters) if DATABASE_SETTINGS.SPARSE_BLOBS else map(memoryview, filters)
+                conn.executemany(query, ((record[mdat], bf) for record, bf in zip(islice(records, len(filters)), blobs)))
+        return len(export)
+    except sqlite3.Error as e:
+        print(f"Error inserting into PID table '{pid_table}': {e}")
+        return 0
+
+
+def db_csv_field(value) -> str:
+    """
+    A value as CSV field, quoted only if necessary like csv.QUOTE_MINIMAL; None is an empty field.
+    """
+    text = "" if value is None else str(value)
+    return f'"{text.replace(chr(34), chr(34) * 2)}"' if any(char in text for char in ',"\r\n') else text
+
+
+def db_write_export(
+    cursor: sqlite3.Cursor,
+    export_path: Path,
+    file_format: str,
+    columns: list[str],
+    bf_column: int,
+    chunk_size: int = DATA_SETTINGS.EXPORT_CHUNK_SIZE
+) -> int:
+    """
+    Write the rows of an executed query to a CSV or JSON file while they are fetched, chunk by chunk,
+    so only one chunk is held in memory. The Bloom filters of each chunk are converted to 0/1 strings at once.
+
+    Parameters:
+        cursor (sqlite3.Cursor):    Cursor of the executed query.
+        export_path (Path):         File to write.
+        file_format (str):          'csv' (with a header row) or 'json' (an array of records).
+        columns (list[str]):        Names of the columns in the file, one per column of the query.
+        bf_column (int):            Index of the column holding the Bloom filters.
+        chunk_size (int):           Amount of rows fetched and written together.
+
+    Returns:
+        int: Amount of exported rows.
+    """
+    written = 0
+    with open(export_path, "w", newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            file.write(",".join(map(db_csv_field, columns)) + os.linesep)
+        else:
+            file.write("[")
+            separator = ""
+            keys = [f"\n    {json.dumps(column, ensure_ascii=False)}: " for column in columns]
+        while rows := cursor.fetchmany(chunk_size):
+            rows = [list(row) for row in rows]
+            for row, bf in zip(rows, bf_convert_chunk_to_01([row[bf_column] for row in rows])):
+                row[bf_column] = bf
+            if file_format == "csv":
+                # The 0/1 strings never need quotes, csv.writer would still inspect each of their characters
+                file.write("".join(",".join(value if column == bf_column else db_csv_field(value)
+                                            for column, value in enumerate(row)) + os.linesep for row in rows))
+            else:
+                # Records are pretty-printed like json.dumps(..., indent=2) inside the array, only the scalars are encoded
+                for row in rows:
+                    fields = ",".join(key + (f'"{value}"' if column == bf_column else json.dumps(value, ensure_ascii=False))
+                                      for column, (key, value) in enumerate(zip(keys, row)))
+                    file.write(f"{separator}\n  {{{fields}\n  }}")
+                    separator = ","
+            written += len(rows)
+        if file_format == "json":
+            file.write("\n]" if written else "]")
+    return written
+
+
+def db_write_binary_export(
+    cursor: sqlite3.Cursor,
+    export_path: Path,
+    columns: list[str],
+    encoding_version: int,
+    chunk_size: int = DATA_SETTINGS.EXPORT_CHUNK_SIZE
+) -> int:
+    """
+    Write the rows of an executed query to a file in the binary interchange format (see BFBinaryWriter),
+    chunk by chunk like db_write_export. The filters are written as stored, without any conversion.
+
+    Parameters:
+        cursor (sqlite3.Cursor):    Cursor of the executed query; its rows are (id, Bloom filter, *columns).
+        export_path (Path):         File to write.
+        columns (list[str]):        Names of the remaining columns of the query, stored as records.
+        encoding_version (int):     Encoding version of the filters, stored in the header.
+        chunk_size (int):           Amount of rows fetched and written together.
+
+    Returns:
+        int: Amount of exported rows.
+    """
+    with BFBinaryWriter(export_path, bf_get_encoder().schema, encoding_version, columns) as writer:
+        while rows := cursor.fetchmany(chunk_size):
+            writer.write([row[0] for row in rows], [row[1] for row in rows], [row[2:] for row in rows])
+    return writer.count
+
+
 def db_export_pid_to_file(
     table_name: str,
     file_format: str = "csv",
@@ -768,11 +1522,12 @@ def db_export_pid_to_file(
 ) -> Path:
     
     """
-    Export PID table data to a CSV or JSON file, converting Bloom filters to 0/1 strings.
+    Export PID table data to a CSV or JSON file, converting Bloom filters to 0/1 strings,
+    or to a binary file holding the packed filters (see db_write_binary_export).
 
     Parameters:
         table_name (str):   Name of the PID table.
-        file_format (str):  Fileformat of the file to export; 'csv' or 'json'.
+        file_format (str):  Fileformat of the file to export; 'csv', 'json' or 'bin'.
         pid_db_path (str):  Path to the PID database.
         export_dir (str):   Directory where the file will be exported to.
 
@@ -782,8 +1537,8 @@ def db_export_pid_to_file(
 
     # Normalize and validate file format
     format = file_format.lower()
-    if format not in ("csv", "json"):
-        raise ValueError("Format must be 'csv' or 'json'.")
+    if format not in ("csv", "json", "bin"):
+        raise ValueError("Format must be 'csv', 'json' or 'bin'.")
 
     # Validate table name
     table_name = table_name if table_name.startswith(GLOBAL_VAL.PID_TABLE_PREFIX) else GLOBAL_VAL.PID_TABLE_PREFIX + table_name
@@ -795,25 +1550,19 @@ def db_export_pid_to_file(
     filename = f"pid_{table_name}_{timestamp}.{format}"
     export_path = Path(export_dir) / filename
 
-    query = f'SELECT mdat AS MDAT, BFS FROM "{table_name}"'
+    # Stream the table into the file, converting Bloom filter bytes to 0/1 strings chunk by chunk
+    query = f'SELECT mdat, bf_unpack(BFS) FROM "{table_name}" ORDER BY pid_id'
     try:
-        with sqlite3.connect(pid_db_path) as conn:
-            df = pd.read_sql_query(query, conn)
+        export_path.parent.mkdir(parents=True, exist_ok=True)
+        with db_connect(pid_db_path) as conn:
+            if format == "bin":
+                db_write_binary_export(conn.execute(f'SELECT pid_id, bf_unpack(BFS), mdat FROM "{table_name}" ORDER BY pid_id'),
+                                       export_path, ["MDAT"], db_get_encoding_version(pid_db_path))
+            else:
+                db_write_export(conn.execute(query), export_path, format, ["MDAT", "PID"], 1)
     except sqlite3.Error as e:
         raise sqlite3.Error(f"Database error reading table '{table_name}': {e}")
-
-    # Convert Bloom filter bytes to 0/1 strings
-    df['PID'] = df['BFS'].apply(bf_convert_bytes_to_01)
-    df.drop(columns=['BFS'], inplace=True)
-
-    # Export to file
-    try:
-        export_path.parent.mkdir(parents=True, exist_ok=True)
-        if format == 'csv':
-            df.to_csv(export_path, index=False)
-        else:
-            df.to_json(export_path, orient='records', indent=2, force_ascii=False)
-    except Exception as e:
+    except OSError as e:
         raise IOError(f"Failed to write {format.upper()} file: {e}")
 
     return export_path
@@ -828,12 +1577,13 @@ def db_export_patient_to_file(
     export_dir: str = PATHS.EXPORT_DIR
 ) -> Path:
     """
-    Export patient Bloomfilters to a CSV or JSON file by name lookup.
+    Export patient Bloomfilters to a CSV or JSON file by name lookup, or to a binary file holding the filters
+    as stored with the patient_id as ids (see db_write_binary_export).
 
     Parameters:
         first_name (str | list[str]):   Single first name or list of first names.
         last_name (str | list[str]):    Single last name or list of last names.
-        file_format (str):              File format of the exported file; 'csv' or 'json'.
+        file_format (str):              File format of the exported file; 'csv', 'json' or 'bin'.
         patient_table (str):            Name of the patient table in the database.
         patient_db_path (str):          Path to the patient database.
         export_dir (str):               Directory where the file will be exported to.
@@ -844,9 +1594,10 @@ def db_export_patient_to_file(
 
     # Validate export format
     fmt = file_format.lower()
-    if fmt not in ('csv', 'json'):
-        raise ValueError("file_format must be 'csv' or 'json'.")
-
+    if fmt not in ('csv', 'json', 'bin'):
+        raise ValueError("file_format must be 'csv', 'json' or 'bin'.")
+    if not patient_table.isidentifier():
+        raise ValueError(f"Invalid table name: {patient_table!r}")
 
     # Normalize and validate name inputs
     single = isinstance(first_name, str) and isinstance(last_name, str)
@@ -857,40 +1608,40 @@ def db_export_patient_to_file(
         raise ValueError('first_name and last_name lists must have the same length')
 
     # Build SQL query and params
+    # The binary format stores the patient_id and the filter separately from the names
+    select = "p.patient_id, bf_unpack(BF), first_name, last_name" if fmt == 'bin' else "first_name, last_name, bf_unpack(BF)"
     if single:
         query = (f'''
-            SELECT first_name AS FirstName, last_name AS LastName, BF FROM '{patient_table}' 
+            SELECT {select} FROM "{patient_table}" AS p
             WHERE first_name = ? AND last_name = ?
+            ORDER BY patient_id
         '''
         )
         params = (first_name, last_name)
         base_filename = f"patient_{first_name}_{last_name}"
     else:
-        
-        query = (f'''
-            SELECT first_name AS FirstName, last_name AS LastName, BF FROM '{patient_table}' 
-            WHERE (first_name, last_name) IN ({', '.join(['(?, ?)'] * len(first_name))})'''
-        )
-        params = [val for pair in zip(first_name, last_name) for val in pair]
+        names = list(zip(first_name, last_name))
         base_filename = f"patients_{len(first_name)}"
 
-    # Load data
-    with sqlite3.connect(patient_db_path) as conn:
-        df = pd.read_sql_query(query, conn, params=params)
-
-    df['BF'] = df['BF'].apply(bf_convert_bytes_to_01)
-
     # Generate filename with timestamp
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     filename = f"{base_filename}_{timestamp}.{fmt}"
     export_path = Path(export_dir) / filename
     export_path.parent.mkdir(parents=True, exist_ok=True)
 
-    # Export file
-    if fmt == 'csv':
-        df.to_csv(export_path, index=False)
-    else:
-        df.to_json(export_path, orient='records', indent=2, force_ascii=False)
+    # Stream the rows into the file; a list of names is one join against the name index
+    def write(cursor: sqlite3.Cursor) -> None:
+        if fmt == 'bin':
+            db_write_binary_export(cursor, export_path, ["FirstName", "LastName"], db_get_encoding_version(patient_db_path))
+        else:
+            db_write_export(cursor, export_path, fmt, ["FirstName", "LastName", "BF"], 2)
+
+    with db_connect(patient_db_path) as conn:
+        if single:
+            write(conn.execute(query, params))
+        else:
+            with db_name_join(conn, names, patient_table) as (source, params):
+                write(conn.execute(f'SELECT {select} FROM {source} ORDER BY p.patient_id', params))
 
     return export_path
 
@@ -1,4 +1,5 @@
 from .bloomfilter_config import *
 from .structure_config import *
 from .global_config import *
-from .data_config import *
\ No newline at end of file
+from .data_config import *
+from .database_config import *
\ No newline at end of file
@@ -25,6 +25,13 @@ class BLOOMFILTER_SETTINGS:
     HASH_SEEDS20                = [88036, 17196, 37991, 66185, 82094, 19288, 94058, 70969, 93056, 19427, 67473, 81898, 40778, 20010, 64626, 90518, 20943, 17182, 39574, 37951]
 
 
+    # Layout of a patient record inside the combined bloomfilter: (segment name, size/seed group, normMode)
+    RECORD_FIELDS               = [ ('first name',  'name',     'word'),
+                                    ('last name',   'name',     'word'),
+                                    ('birthdate',   'other',    'date'),
+                                    ('gender',      'other',    'word')]
+
+
     SALT_AMOUNT                 = 0
     SALT_FIX                    = None
     
@@ -32,4 +39,34 @@ class BLOOMFILTER_SETTINGS:
     QSIZE                       = 2
     PADDING                     =   True
 
+    # Hashing of the q-grams: "seeded" (one hash per seed) | "double" (one 128 bit hash, Kirsch-Mitzenmacher)
+    # Filters of different schemes are tagged with different versions and are never compared
+    ENCODING_SCHEME             =   "seeded"
+
+    # Cache q-gram bit positions in memory for the batch encoder
+    USE_QGRAM_TABLE             =   True
+    # Also persist the cached q-grams in PATHS.QGRAM_TABLE_DIR; the files hold the q-grams of the names in plaintext
+    PERSIST_QGRAM_TABLE         =   False
+
+    # LSH index (Hamming bit-sampling with banding) for the relink, built by create_db if enabled
+    # The amount of bands is chosen so a pair with the lowest RECORD_LINKAGE_TH is found with LSH_RECALL
+    USE_LSH_INDEX               =   False
+    LSH_RECALL                  =   0.95
+    LSH_BAND_BITS               =   12
+    LSH_EXPECTED_FILL           =   0.32        # share of set bits, used while the table is still empty
+
+    # Multi-index hashing over the name segments: exact search for high thresholds, built by create_db if enabled
+    # The relink uses it if at most MIH_MAX_PROBES buckets have to be probed for the requested rating
+    USE_MIH_INDEX               =   False
+    MIH_SEGMENTS                =   ['first name', 'last name']
+    MIH_SUBSTRINGS              =   64
+    MIH_MAX_PROBES              =   4096
+
+    # Memory-mapped copy of the packed patient filters next to the database ("<database>.bfcache"), used by the relink
+    # It is kept up to date by the insert and delete functions and rebuilt only if the database changed otherwise
+    USE_MATRIX_CACHE            =   True
 
+    # Worker processes of the relink; tables with at least RELINK_PARALLEL_MIN_ROWS filters are split into shards
+    # which the workers score on shared memory (or the memory-mapped cache), 1 = no workers
+    RELINK_WORKERS              =   1
+    RELINK_PARALLEL_MIN_ROWS    =   200000
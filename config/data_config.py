@@ -25,6 +25,15 @@ class DATA_SETTINGS:
         r"[ß]": "ss",
         r"[þ]": "th"
 }
+    # Amount of distinct strings memoized by normalize_string / normalize_date
+    NORMALIZE_CACHE_SIZE        =   65536
+
+    # Bulk import: worker processes encoding the rows (1 = encode in the importing process) and rows per chunk
+    IMPORT_WORKERS              =   1
+    IMPORT_CHUNK_SIZE           =   5000
+
+    # Export: rows fetched, converted and written together
+    EXPORT_CHUNK_SIZE           =   5000
     
 
 
@@ -0,0 +1,37 @@
+#DATABASE Settings
+class DATABASE_SETTINGS:
+    # Storage profile of the databases, one of STORAGE_PROFILES; compare them with statistiks/bench_storage.py
+    STORAGE_PROFILE             =   'tuned'
+
+    # journal_mode is stored in the database file and set by create_db, the other pragmas are set on every
+    # pooled connection (see backend/database/db_connection.py); bulk_synchronous is used while a bulk import runs.
+    # WAL lets the GUI read while an import writes. With WAL, synchronous NORMAL can lose the last commits on a power
+    # failure but keeps the database consistent. OFF can corrupt the file and gave no measurable gain; an import
+    # commits chunk by chunk without deduplicating, so repeating an interrupted one inserts its rows twice.
+    STORAGE_PROFILES            =   {   'default'   :   {   'journal_mode'      :   'DELETE',
+                                                            'synchronous'       :   'FULL',
+                                                            'bulk_synchronous'  :   'FULL',
+                                                            'mmap_size'         :   0,
+                                                            'cache_size'        :   -2000,      # KiB, negative = size instead of pages
+                                                            'temp_store'        :   'DEFAULT'},
+                                        'tuned'     :   {   'journal_mode'      :   'WAL',
+                                                            'synchronous'       :   'NORMAL',
+                                                            'bulk_synchronous'  :   'NORMAL',
+                                                            'mmap_size'         :   1 << 28,
+                                                            'cache_size'        :   -65536,
+                                                            'temp_store'        :   'MEMORY'}}
+
+    # Name lookups join up to this many (first_name, last_name) pairs as a VALUES list, longer lists are
+    # loaded into a temporary table first (each pair is two SQL variables)
+    NAME_JOIN_VALUES            =   500
+
+    # Patients deleted per DELETE statement of db_delete_patient (each id is one SQL variable), all in one transaction
+    DELETE_CHUNK_SIZE           =   10000
+
+    # Seconds a connection waits for a lock held by another connection before raising "database is locked"
+    BUSY_TIMEOUT                =   5.0
+
+    # Store the Bloom filter BLOBs (Patientendaten.BF, pidTable_*.BFS) per row as the shorter of the packed bits and a
+    # delta coded list of the set positions (see bf_blob_encode); both are always read. Only filters with less than
+    # about one set bit in eight get shorter, the default layout sets about 30 % of the bits.
+    SPARSE_BLOBS                =   False
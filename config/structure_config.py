@@ -15,6 +15,7 @@ class PATHS:
     EXPORT_DIR                  = os.path.join(LOCAL_STORAGE_DIR, "export")
     RECEIVED_DIR                = os.path.join(LOCAL_STORAGE_DIR, "received")
     UPLOAD_DIR                  = os.path.join(LOCAL_STORAGE_DIR, "upload")
+    QGRAM_TABLE_DIR             = os.path.join(LOCAL_STORAGE_DIR, "qgram_tables")
 
     INPUT_TESTFILE_PATH         = os.path.join(IMPORT_DIR, "input.csv")
     EXPORT_TESTFILE_PATH        = os.path.join(EXPORT_DIR, "export_placeholder.txt")
@@ -3,8 +3,10 @@ from PyQt6.QtWidgets import (
 )
 from PyQt6.QtCore import Qt
 from bitarray import bitarray
+from config import PATHS
 from backend.database import (
     db_extended_relink_bf,
+    db_get_encoding_version,
     db_lookup_id
 )
 
@@ -44,7 +46,7 @@ class RelinkDialog(QDialog):
             bf = bitarray()
             bf.frombytes(self.bfs)
 
-            df = db_extended_relink_bf(bf)
+            df = db_extended_relink_bf(bf, encoding_version=db_get_encoding_version(PATHS.DATABASE_PATH_PID))
 
             if df.empty:
                 print("Keine Übereinstimmung gefunden")
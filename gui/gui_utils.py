@@ -1,6 +1,7 @@
 import sqlite3,datetime, locale, os
 from PyQt6.QtWidgets import(QPushButton)
 from config import PATHS, GLOBAL_VAL
+from backend.database import db_connect
 
 def load_stylesheet(stylesheet_name: str):
     try:
@@ -14,9 +15,9 @@ def load_stylesheet(stylesheet_name: str):
 
 def fetch_all_patients(database_path: str):
     try:
-        with sqlite3.connect(database_path) as conn:
+        with db_connect(database_path) as conn:
             cursor = conn.cursor()
-            query = "SELECT first_name, last_name, date_of_birth, gender, mdat, BF FROM Patientendaten"
+            query = "SELECT first_name, last_name, date_of_birth, gender, mdat, bf_unpack(BF) FROM Patientendaten"
             cursor.execute(query)
             patients = cursor.fetchall()
             return patients
@@ -25,9 +26,25 @@ def fetch_all_patients(database_path: str):
         return []
 
 
+# German month names for format_date: "german" on Windows, "de_DE" elsewhere; set once, the system locale is kept
+# if neither is installed
+_DATE_LOCALE = None
+
+def _set_date_locale():
+    global _DATE_LOCALE
+    for name in ("german", "de_DE.UTF-8", "de_DE"):
+        try:
+            _DATE_LOCALE = locale.setlocale(locale.LC_TIME, name)
+            return
+        except locale.Error:
+            continue
+    _DATE_LOCALE = locale.setlocale(locale.LC_TIME)
+
+
 def format_date(date_string):
     try:
-        locale.setlocale(locale.LC_TIME, "german")
+        if _DATE_LOCALE is None:
+            _set_date_locale()
 
         date_obj = datetime.datetime.strptime(date_string, "%Y%m%d")
         return date_obj.strftime("%d %B %Y")
@@ -36,7 +53,7 @@ def format_date(date_string):
     
 def fetch_pid_table_names(database_path: str):
     try:
-        with sqlite3.connect(database_path) as conn:
+        with db_connect(database_path) as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
 
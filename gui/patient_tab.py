@@ -1,28 +1,26 @@
 import os
-from functools import partial
 
 from PyQt6.QtWidgets import (
-    QWidget, QGridLayout, QTableWidget, QTableWidgetItem, QComboBox, QFileDialog,
-    QHeaderView, QCheckBox, QPlainTextEdit, QSizePolicy, QAbstractItemView
+    QWidget, QGridLayout, QTableView, QComboBox, QFileDialog,
+    QHeaderView, QPlainTextEdit, QSizePolicy, QAbstractItemView,
+    QProgressDialog, QApplication
 )
 from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6.QtGui import QFontMetrics
 
 from config import PATHS
 from gui.gui_utils import (
-    fetch_all_patients,
     load_stylesheet,
     create_button,
-    format_date,
     fetch_pid_table_names
 )
 from gui.AddPatientDialog import AddPatientDialog
+from gui.patient_table_model import PatientTableModel, CheckBoxDelegate, ButtonDelegate, MdatDelegate
 from backend.database import (
     db_insert_patient,
     db_export_patient_to_file,
     db_export_patient_into_pid,
     db_delete_patient,
-    db_lookup_name,
     db_insert_patient_from_file
 )
 
@@ -33,7 +31,6 @@ class PatientenTab(QWidget):
 
     def __init__(self):
         super().__init__()
-        self.header_all_checked = False
 
         self.setupUI()
         self.setStyleSheet(load_stylesheet("patient_tab.qss"))
@@ -108,13 +105,18 @@ class PatientenTab(QWidget):
         main_layout.addWidget(self.export_format_dropdown, 2, 3, 1, 3)
 
 
-        # Tabelle
-        self.table = QTableWidget()
-        self.table.setColumnCount(7)
-        self.table.setHorizontalHeaderLabels([
-            "☑",
-            "Vorname", "Nachname", "Geburtsdatum", "Geschlecht", "MDAT", "Bloomfilter"
-        ])
+        # Tabelle: the model fetches the patients page by page while scrolling, the delegates paint
+        # checkbox, MDAT and download button instead of one widget per cell
+        self.model = PatientTableModel(PATHS.DATABASE_PATH_PATIENT, parent=self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.checkbox_delegate = CheckBoxDelegate(self.table)
+        self.mdat_delegate = MdatDelegate(self.table)
+        self.download_delegate = ButtonDelegate(self.table)
+        self.download_delegate.clicked.connect(lambda index: self.export_bf(*self.model.row_name(index.row())))
+        self.table.setItemDelegateForColumn(PatientTableModel.CHECK_COLUMN, self.checkbox_delegate)
+        self.table.setItemDelegateForColumn(PatientTableModel.MDAT_COLUMN, self.mdat_delegate)
+        self.table.setItemDelegateForColumn(PatientTableModel.BF_COLUMN, self.download_delegate)
         self.table.setSortingEnabled(True)
         self.table.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
         self.table.setFocusPolicy(Qt.FocusPolicy.NoFocus)
@@ -122,7 +124,7 @@ class PatientenTab(QWidget):
         # select all
         self.table.horizontalHeader().sectionClicked.connect(self.on_header_section_clicked)
 
-        # resize verticalHeader
+        # resize verticalHeader; with a fixed row height the view does not measure the rows
         header = self.table.verticalHeader()
         header.setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
 
@@ -144,15 +146,8 @@ class PatientenTab(QWidget):
         self.load_data()
 
     def on_header_section_clicked(self, logical_index):
-        if logical_index == 0:
-            self.header_all_checked = not self.header_all_checked
-            row_count = self.table.rowCount()
-            for row in range(row_count):
-                cell_widget_cb = self.table.cellWidget(row, 0)
-                if cell_widget_cb:
-                    checkbox = cell_widget_cb.findChild(QCheckBox)
-                    if checkbox:
-                        checkbox.setChecked(self.header_all_checked)
+        if logical_index == PatientTableModel.CHECK_COLUMN:
+            self.model.set_all_checked(not self.model.all_checked())
 
     def adjust_column_widths(self):
         header = self.table.horizontalHeader()
@@ -168,64 +163,7 @@ class PatientenTab(QWidget):
         self.adjust_column_widths()
 
     def load_data(self):
-        patients = fetch_all_patients(PATHS.DATABASE_PATH_PATIENT)
-        self.table.setRowCount(len(patients))
-
-        example_widget = QPlainTextEdit()
-        fm_widget = QFontMetrics(example_widget.font())
-        fixed_height = int(fm_widget.lineSpacing() * 3 + 5)
-
-        for row_idx, row_data in enumerate(patients):
-            checkbox = QCheckBox()
-            cell_widget_cb = QWidget()
-            layout_cb = QGridLayout(cell_widget_cb)
-            layout_cb.addWidget(checkbox, 0, 0, 1, 1)
-            layout_cb.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            layout_cb.setContentsMargins(0, 0, 0, 0)
-            cell_widget_cb.setLayout(layout_cb)
-            self.table.setCellWidget(row_idx, 0, cell_widget_cb)
-
-            # Spalten: 1 (Vorname), 2 (Nachname), 3 (Geburtsdatum), 4 (Geschlecht)
-            for col_offset in range(4):
-                if col_offset == 2:  # Geburtsdatum formatieren (Index 2 in row_data)
-                    raw_date = row_data[col_offset]
-                    formatted_date = format_date(raw_date)
-                    item = QTableWidgetItem(formatted_date)
-                    item.setData(Qt.ItemDataRole.UserRole, int(raw_date))
-                else:
-                    item = QTableWidgetItem(str(row_data[col_offset]))
-
-                item.setTextAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter)
-                item.setToolTip(str(row_data[col_offset]))
-                self.table.setItem(row_idx, col_offset + 1, item)
-
-            # MDAT
-            mdat_text = str(row_data[4])
-            mdat_widget = QPlainTextEdit()
-            mdat_widget.setReadOnly(True)
-            mdat_widget.setPlainText(mdat_text)
-            mdat_widget.setLineWrapMode(QPlainTextEdit.LineWrapMode.WidgetWidth)
-            mdat_widget.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
-            mdat_widget.setToolTip(mdat_text)
-            mdat_widget.setFixedHeight(fixed_height)
-            self.table.setCellWidget(row_idx, 5, mdat_widget)
-
-            # Bloomfilter-Download-Button
-            button = create_button(
-                "Download",
-                "Bloomfilter für diesen Patienten herunterladen",
-                partial(self.export_bf, row_data[0], row_data[1])
-            )
-            cell_widget_btn = QWidget()
-            layout_btn = QGridLayout(cell_widget_btn)
-            layout_btn.addWidget(button, 0, 0, 1, 1)
-            layout_btn.setContentsMargins(0, 0, 0, 0)
-            layout_btn.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            cell_widget_btn.setLayout(layout_btn)
-            self.table.setCellWidget(row_idx, 6, cell_widget_btn)
-
-            # Row height
-            self.table.setRowHeight(row_idx, fixed_height)
+        self.model.refresh()
 
     def load_pid_table_names(self):
         tables = fetch_pid_table_names(PATHS.DATABASE_PATH_PID)
@@ -246,27 +184,10 @@ class PatientenTab(QWidget):
             gender=data["gender"],
             mdat=data["mdat"]
         )
-        self.load_data()
+        self.model.load_new_rows()
 
     def remove_selected_patients(self):
-        row_count = self.table.rowCount()
-        patient_ids_to_delete = []
-
-        for row_idx in range(row_count):
-            cell_widget_cb = self.table.cellWidget(row_idx, 0)
-            if not cell_widget_cb:
-                continue
-            checkbox = cell_widget_cb.findChild(QCheckBox)
-            if checkbox and checkbox.isChecked():
-                first_name_item = self.table.item(row_idx, 1)
-                last_name_item = self.table.item(row_idx, 2)
-                if first_name_item and last_name_item:
-                    fname = first_name_item.text()
-                    lname = last_name_item.text()
-                    results = db_lookup_name((fname, lname), ["patienten_id"])
-                    for row_tuple in results:
-                        pid = row_tuple[0]
-                        patient_ids_to_delete.append(pid)
+        patient_ids_to_delete = self.model.checked_ids()
 
         if not patient_ids_to_delete:
             print("Keine Patienten ausgewählt oder keine passenden Einträge gefunden.")
@@ -274,7 +195,7 @@ class PatientenTab(QWidget):
 
         try:
             db_delete_patient(patient_ids_to_delete)
-            self.load_data()
+            self.model.remove_ids(patient_ids_to_delete)
 
         except Exception as e:
             print(f"Fehler beim Löschen von Patienten: {e}")
@@ -284,20 +205,7 @@ class PatientenTab(QWidget):
         if not pid_table_name:
             return
 
-        selected_patients = []
-        row_count = self.table.rowCount()
-        for row_idx in range(row_count):
-            cell_widget_cb = self.table.cellWidget(row_idx, 0)
-            if not cell_widget_cb:
-                continue
-            checkbox = cell_widget_cb.findChild(QCheckBox)
-            if checkbox and checkbox.isChecked():
-                first_name_item = self.table.item(row_idx, 1)
-                last_name_item = self.table.item(row_idx, 2)
-                if first_name_item and last_name_item:
-                    selected_patients.append(
-                        (first_name_item.text(), last_name_item.text())
-                    )
+        selected_patients = self.model.checked_names()
 
         if not selected_patients:
             return
@@ -313,20 +221,7 @@ class PatientenTab(QWidget):
 
         export_format = self.export_format_dropdown.currentText().lower()
 
-        selected_patients = []
-        row_count = self.table.rowCount()
-        for row_idx in range(row_count):
-            cell_widget_cb = self.table.cellWidget(row_idx, 0)
-            if not cell_widget_cb:
-                continue
-            checkbox = cell_widget_cb.findChild(QCheckBox)
-            if checkbox and checkbox.isChecked():
-                first_name_item = self.table.item(row_idx, 1)
-                last_name_item = self.table.item(row_idx, 2)
-                if first_name_item and last_name_item:
-                    selected_patients.append(
-                        (first_name_item.text(), last_name_item.text())
-                    )
+        selected_patients = self.model.checked_names()
 
         if not selected_patients:
             return
@@ -381,14 +276,27 @@ class PatientenTab(QWidget):
             print(f"Dateiformat {extension} wird nicht unterstützt. Bitte CSV oder JSON wählen.")
             return
 
+        # progress of the import in per mille of the file size
+        progress = QProgressDialog("Patientendatei wird eingelesen...", None, 0, 1000, self)
+        progress.setWindowModality(Qt.WindowModality.WindowModal)
+        progress.setMinimumDuration(500)
+
+        def update_progress(inserted, bytes_read, total_bytes):
+            progress.setValue(int(1000 * bytes_read / total_bytes) if total_bytes else 1000)
+            progress.setLabelText(f"{inserted} Patienten eingelesen...")
+            QApplication.processEvents()
+
         try:
             db_insert_patient_from_file(
                 filename="",
                 file_path=file_path,
-                file_format=file_format
+                file_format=file_format,
+                progress_callback=update_progress
             )
             print(f"Datei '{file_path}' erfolgreich eingelesen.")
         except Exception as e:
             print(f"Fehler beim Einlesen der Datei '{file_path}': {e}")
+        finally:
+            progress.close()
 
-        self.load_data()
\ No newline at end of file
+        self.model.load_new_rows()
\ No newline at end of file
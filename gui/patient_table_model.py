@@ -0,0 +1,324 @@
+import sqlite3
+
+from PyQt6.QtWidgets import (
+    QApplication, QCheckBox, QPlainTextEdit, QPushButton, QStyle, QStyledItemDelegate,
+    QStyleOptionButton, QStyleOptionViewItem
+)
+from PyQt6.QtCore import Qt, QAbstractTableModel, QEvent, QModelIndex, QRect, pyqtSignal
+
+from config import PATHS
+from backend.database import db_connect
+from gui.gui_utils import format_date
+
+
+class PatientTableModel(QAbstractTableModel):
+    '''
+    Model of the patient table, the rows are fetched from SQLite page by page as the view scrolls (canFetchMore/fetchMore).
+
+    The pages follow the sort order by keyset (sort key, patient_id), so every page is an index range scan
+    independent of how many rows are already loaded. The Bloomfilter itself is not loaded, it is exported on download.
+    Checked rows are stored as the ids differing from the "all checked" state of the header, so checking all
+    patients does not load them.
+    '''
+
+    HEADERS = ["☑", "Vorname", "Nachname", "Geburtsdatum", "Geschlecht", "MDAT", "Bloomfilter"]
+    CHECK_COLUMN, DATE_COLUMN, MDAT_COLUMN, BF_COLUMN = 0, 3, 5, 6
+    # Sort keys of the sortable columns as (expression, index in the row), patient_id is appended as last key;
+    # the rows are (patient_id, first_name, last_name, date_of_birth, gender, mdat). Sorting by last name
+    # follows the name index (last_name, first_name).
+    SORT_KEYS = {1: [("first_name", 1)],
+                 2: [("last_name", 2), ("first_name", 1)],
+                 3: [("date_of_birth", 3)],
+                 4: [("COALESCE(gender, '')", 4)],
+                 5: [("COALESCE(mdat, '')", 5)]}
+    PAGE_SIZE = 500
+
+    def __init__(self, database_path: str = PATHS.DATABASE_PATH_PATIENT, patient_table: str = "Patientendaten", parent=None):
+        super().__init__(parent)
+        if not patient_table.isidentifier():
+            raise ValueError(f"Invalid table name: {patient_table!r}")
+        self.database_path = database_path
+        self.patient_table = patient_table
+        self._rows = []
+        self._dates = []
+        self._more = True
+        self._sort_column = None
+        self._descending = False
+        self._all_checked = False
+        # patient_id -> (first_name, last_name) of the rows checked differently from the header
+        self._toggled = {}
+
+    # Lazy loading
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        rows = self._fetch_page()
+        self._more = len(rows) == self.PAGE_SIZE
+        if not rows:
+            return
+        self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(rows) - 1)
+        self._rows.extend(rows)
+        self._dates.extend(format_date(row[3]) for row in rows)
+        self.endInsertRows()
+
+    def _fetch_page(self) -> list[tuple]:
+        direction, compare = ("DESC", "<") if self._descending else ("ASC", ">")
+        keys = self.SORT_KEYS.get(self._sort_column, []) + [("patient_id", 0)]
+        where, params = "", ()
+        if self._rows:
+            # The next page starts behind the last loaded row
+            where = f'WHERE ({", ".join(expression for expression, _ in keys)}) {compare} ({", ".join("?" * len(keys))})'
+            params = tuple("" if self._rows[-1][i] is None else self._rows[-1][i] for _, i in keys)
+        order = ", ".join(f"{expression} {direction}" for expression, _ in keys)
+        query = (f'SELECT patient_id, first_name, last_name, date_of_birth, gender, mdat FROM "{self.patient_table}" '
+                 f'{where} ORDER BY {order} LIMIT ?')
+        try:
+            return db_connect(self.database_path).execute(query, params + (self.PAGE_SIZE,)).fetchall()
+        except sqlite3.Error as e:
+            print(f"Fehler beim Abrufen der Patientendaten: {e}")
+            return []
+
+    def refresh(self):
+        '''
+        Drops the loaded rows and fetches the first page again.
+        '''
+        self.beginResetModel()
+        self._rows, self._dates = [], []
+        self._more = True
+        self.endResetModel()
+        self.fetchMore()
+
+    def load_new_rows(self):
+        '''
+        Shows inserted patients: in the default order they come after all loaded rows and are fetched like the next page,
+        otherwise the table is refreshed.
+        '''
+        if self._sort_column in self.SORT_KEYS or self._descending:
+            self.refresh()
+        elif not self._more:
+            self._more = True
+            self.fetchMore()
+
+    def remove_ids(self, patient_ids):
+        '''
+        Removes deleted patients from the loaded rows.
+        '''
+        patient_ids = set(patient_ids)
+        if self._all_checked or len(patient_ids) > self.PAGE_SIZE:
+            self.set_all_checked(False)
+            self.refresh()
+            return
+        for row in reversed(range(len(self._rows))):
+            if self._rows[row][0] in patient_ids:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self._rows[row], self._dates[row]
+                self.endRemoveRows()
+        for patient_id in patient_ids:
+            self._toggled.pop(patient_id, None)
+
+    # Qt model interface
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = self._rows[index.row()], index.column()
+
+        if role == Qt.ItemDataRole.CheckStateRole and column == self.CHECK_COLUMN:
+            return Qt.CheckState.Checked if self.is_checked(index.row()) else Qt.CheckState.Unchecked
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == self.DATE_COLUMN:
+                return self._dates[index.row()]
+            if column == self.BF_COLUMN:
+                return "Download"
+            if column != self.CHECK_COLUMN:
+                return "" if row[column] is None else str(row[column])
+        if role == Qt.ItemDataRole.ToolTipRole:
+            if column == self.BF_COLUMN:
+                return "Bloomfilter für diesen Patienten herunterladen"
+            if column != self.CHECK_COLUMN:
+                return "" if row[column] is None else str(row[column])
+        if role == Qt.ItemDataRole.TextAlignmentRole and column != self.CHECK_COLUMN:
+            vertical = Qt.AlignmentFlag.AlignTop if column == self.MDAT_COLUMN else Qt.AlignmentFlag.AlignVCenter
+            return Qt.AlignmentFlag.AlignLeft | vertical
+        if role == Qt.ItemDataRole.UserRole:
+            return row[0]
+        return None
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if not index.isValid() or index.column() != self.CHECK_COLUMN or role != Qt.ItemDataRole.CheckStateRole:
+            return False
+        checked = Qt.CheckState(value) == Qt.CheckState.Checked
+        if checked != self.is_checked(index.row()):
+            patient_id, first_name, last_name = self._rows[index.row()][:3]
+            if self._toggled.pop(patient_id, None) is None:
+                self._toggled[patient_id] = (first_name, last_name)
+            self.dataChanged.emit(index, index, [role])
+        return True
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        if index.column() == self.CHECK_COLUMN:
+            return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsUserCheckable
+        if index.column() == self.MDAT_COLUMN:
+            # The MDAT editor is read-only, it only shows long texts with a scroll bar (see MdatDelegate)
+            return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsEditable
+        return Qt.ItemFlag.ItemIsEnabled
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        # Checkbox and download column are not sortable, a click on the checkbox header checks all rows
+        if column not in self.SORT_KEYS:
+            return
+        self._sort_column = column
+        self._descending = order == Qt.SortOrder.DescendingOrder
+        self.refresh()
+
+    # Checked rows
+    def is_checked(self, row: int) -> bool:
+        return self._all_checked != (self._rows[row][0] in self._toggled)
+
+    def set_all_checked(self, checked: bool):
+        self._all_checked = checked
+        self._toggled.clear()
+        if self._rows:
+            self.dataChanged.emit(self.index(0, self.CHECK_COLUMN), self.index(len(self._rows) - 1, self.CHECK_COLUMN),
+                                  [Qt.ItemDataRole.CheckStateRole])
+
+    def all_checked(self) -> bool:
+        return self._all_checked
+
+    def _checked_rows(self) -> list[tuple]:
+        # (patient_id, first_name, last_name) of every checked patient, ordered by patient_id
+        if not self._all_checked:
+            return sorted((patient_id, *names) for patient_id, names in self._toggled.items())
+        try:
+            cursor = db_connect(self.database_path).execute(
+                f'SELECT patient_id, first_name, last_name FROM "{self.patient_table}" ORDER BY patient_id')
+            return [row for row in cursor if row[0] not in self._toggled]
+        except sqlite3.Error as e:
+            print(f"Fehler beim Abrufen der ausgewählten Patienten: {e}")
+            return []
+
+    def checked_ids(self) -> list[int]:
+        return [row[0] for row in self._checked_rows()]
+
+    def checked_names(self) -> list[tuple[str, str]]:
+        return [(first_name, last_name) for _, first_name, last_name in self._checked_rows()]
+
+    def row_name(self, row: int) -> tuple[str, str]:
+        return self._rows[row][1], self._rows[row][2]
+
+
+class CheckBoxDelegate(QStyledItemDelegate):
+    '''
+    Paints the check state of a cell as a centered checkbox and toggles it on click.
+    '''
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Hidden checkbox, so the indicator is painted with the QCheckBox rules of the stylesheet
+        self._checkbox = QCheckBox(parent)
+        self._checkbox.hide()
+
+    def _indicator_rect(self, option) -> QRect:
+        style = self._checkbox.style()
+        size = style.subElementRect(QStyle.SubElement.SE_CheckBoxIndicator, QStyleOptionButton(), self._checkbox).size()
+        return QStyle.alignedRect(option.direction, Qt.AlignmentFlag.AlignCenter, size, option.rect)
+
+    def paint(self, painter, option, index):
+        background = QStyleOptionViewItem(option)
+        self.initStyleOption(background, index)
+        background.features &= ~QStyleOptionViewItem.ViewItemFeature.HasCheckIndicator
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawControl(QStyle.ControlElement.CE_ItemViewItem, background, painter, option.widget)
+
+        check = QStyleOptionButton()
+        check.rect = self._indicator_rect(option)
+        checked = index.data(Qt.ItemDataRole.CheckStateRole) == Qt.CheckState.Checked
+        check.state = QStyle.StateFlag.State_Enabled | (QStyle.StateFlag.State_On if checked else QStyle.StateFlag.State_Off)
+        self._checkbox.style().drawPrimitive(QStyle.PrimitiveElement.PE_IndicatorCheckBox, check, painter, self._checkbox)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton \
+                and option.rect.contains(event.position().toPoint()):
+            checked = index.data(Qt.ItemDataRole.CheckStateRole) == Qt.CheckState.Checked
+            new_state = Qt.CheckState.Unchecked if checked else Qt.CheckState.Checked
+            return model.setData(index, new_state, Qt.ItemDataRole.CheckStateRole)
+        # The press is consumed as well, so the view does not start an edit or selection
+        return event.type() in (QEvent.Type.MouseButtonPress, QEvent.Type.MouseButtonDblClick)
+
+
+class ButtonDelegate(QStyledItemDelegate):
+    '''
+    Paints the display text of a cell as a push button; clicked is emitted with the index of the released button.
+    '''
+
+    clicked = pyqtSignal(QModelIndex)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # Hidden button, so the cells are painted with the QPushButton rules of the stylesheet
+        self._button = QPushButton(parent)
+        self._button.hide()
+        self._pressed = None
+
+    def _button_rect(self, option) -> QRect:
+        size = self._button.sizeHint()
+        size.setWidth(min(size.width() + 20, option.rect.width() - 4))
+        return QStyle.alignedRect(option.direction, Qt.AlignmentFlag.AlignCenter, size, option.rect)
+
+    def paint(self, painter, option, index):
+        button = QStyleOptionButton()
+        button.rect = self._button_rect(option)
+        button.text = index.data(Qt.ItemDataRole.DisplayRole)
+        button.state = QStyle.StateFlag.State_Enabled
+        self._button.style().drawControl(QStyle.ControlElement.CE_PushButton, button, painter, self._button)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() not in (QEvent.Type.MouseButtonPress, QEvent.Type.MouseButtonRelease, QEvent.Type.MouseButtonDblClick):
+            return False
+        inside = self._button_rect(option).contains(event.position().toPoint())
+        if event.type() == QEvent.Type.MouseButtonPress:
+            self._pressed = (index.row(), index.column()) if inside else None
+        elif event.type() == QEvent.Type.MouseButtonRelease:
+            if inside and self._pressed == (index.row(), index.column()):
+                self.clicked.emit(index)
+            self._pressed = None
+        return True
+
+
+class MdatDelegate(QStyledItemDelegate):
+    '''
+    Paints MDAT wrapped over the row height; a double click opens the whole text in a read-only editor with a scroll bar.
+    '''
+
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        option.features |= QStyleOptionViewItem.ViewItemFeature.WrapText
+
+    def createEditor(self, parent, option, index):
+        editor = QPlainTextEdit(parent)
+        editor.setReadOnly(True)
+        editor.setLineWrapMode(QPlainTextEdit.LineWrapMode.WidgetWidth)
+        editor.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        return editor
+
+    def setEditorData(self, editor, index):
+        editor.setPlainText(index.data(Qt.ItemDataRole.DisplayRole))
+
+    def setModelData(self, editor, model, index):
+        # MDAT is only shown, not edited
+        pass
@@ -1,4 +1,3 @@
-import sqlite3
 from functools import partial
 
 from PyQt6.QtWidgets import (
@@ -10,6 +9,7 @@ from PyQt6.QtGui import QFontMetrics
 
 from config import PATHS, GLOBAL_VAL
 from backend.database import (
+    db_connect,
     db_add_pid_table,
     db_delete_pid_table,
     db_clear_pid_table
@@ -36,10 +36,6 @@ class PIDTab(QWidget):
         self.resize_timer.timeout.connect(self.adjust_column_widths)
         self.setStyleSheet(load_stylesheet("pid_tab.qss"))
 
-        # Datenbank-Verbindung öffnen
-        self.conn = sqlite3.connect(PATHS.DATABASE_PATH_PID)
-        self.cursor = self.conn.cursor()
-
         self.setupUI()
         self.load_pid_table_names()
 
@@ -113,10 +109,9 @@ class PIDTab(QWidget):
             table_name = self.dropdown.currentText()
 
         full_table_name = GLOBAL_VAL.PID_TABLE_PREFIX + table_name
-        query = f"SELECT mdat, BFS FROM {full_table_name}"
+        query = f"SELECT mdat, bf_unpack(BFS) FROM {full_table_name}"
         try:
-            self.cursor.execute(query)
-            rows = self.cursor.fetchall()
+            rows = db_connect(PATHS.DATABASE_PATH_PID).execute(query).fetchall()
         except Exception as e:
             print(f"Fehler beim Laden der Tabelle {full_table_name}: {e}")
             return
@@ -248,7 +243,3 @@ class PIDTab(QWidget):
     def resizeEvent(self, event):
         super().resizeEvent(event)
         self.resize_timer.start()
-
-    def __del__(self):
-        if self.conn:
-            self.conn.close()
@@ -3,6 +3,7 @@ import sys
 from PyQt6.QtWidgets import QApplication
 from gui.mainwindow import MainWindow
 from backend.auto_exec import auto_run
+from backend.database import db_shutdown
 
 #Generiere neue Testdaten
 
@@ -12,10 +13,13 @@ def test_run():
     gen_test_csv(100)
 
     app = QApplication(sys.argv)
+    # Pooled database connections and relink workers are closed once, when the application quits
+    app.aboutToQuit.connect(db_shutdown)
     
     window = MainWindow()
     window.show()
     
     sys.exit(app.exec())
 
-test_run()
\ No newline at end of file
+if __name__ == "__main__":
+    test_run()
\ No newline at end of file
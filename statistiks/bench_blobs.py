@@ -0,0 +1,58 @@
+#########################################################################
+#       Benchmark: Gepackte vs. dünn besetzte BLOBs der Bloomfilter     #
+#########################################################################
+
+import os, sys, random, time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import BLOOMFILTER_SETTINGS
+from backend.bloomfilter import BloomEncoder, RecordSchema, bf_record_fields, bf_blob_encode, bf_blob_decode
+from generate_csv import vornamen, nachnamen, geschlechter, zufaelliges_geburtsdatum
+
+
+ROWS        = 50000
+# Konfiguriertes Layout und ein dünn besetztes mit größeren Filtern und weniger Hashfunktionen
+LAYOUTS     = {"konfiguriert": {},
+               "duenn":        {"name": (4000, 10), "other": (1000, 5)}}
+
+
+def layout_fields(changes: dict) -> list[dict]:
+    fields = bf_record_fields()
+    for field, (_, group, _) in zip(fields, BLOOMFILTER_SETTINGS.RECORD_FIELDS):
+        if group in changes:
+            field["array_size"], field["hash_runs"] = changes[group]
+    return fields
+
+
+def bench_layout(records, changes: dict) -> dict:
+    schema = RecordSchema(layout_fields(changes))
+    filters = BloomEncoder(schema, use_table=False).encode_batch(records)
+    packed = [row.tobytes() for row in filters]
+    start = time.perf_counter()
+    bf_blob_decode(packed, schema.total_bytes)
+    decode_packed = time.perf_counter() - start
+    start = time.perf_counter()
+    blobs = bf_blob_encode(filters)
+    encode = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = bf_blob_decode(blobs, schema.total_bytes)
+    decode = time.perf_counter() - start
+    assert (decoded == filters).all()
+    return {"bits": schema.total_bits,
+            "fill": schema.popcounts(filters)[:, 0].mean() / schema.total_bits,
+            "packed": schema.total_bytes,
+            "stored": sum(map(len, blobs)) / len(blobs),
+            "sparse": sum(len(blob) < schema.total_bytes for blob in blobs) / len(blobs),
+            "encode": encode, "decode": decode, "decode_packed": decode_packed}
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    records = [(random.choice(vornamen), random.choice(nachnamen), zufaelliges_geburtsdatum(), random.choice(geschlechter))
+               for _ in range(ROWS)]
+    print(f"{ROWS} Filter je Layout\n")
+    for name, changes in LAYOUTS.items():
+        r = bench_layout(records, changes)
+        print(f"{name:>12}: {r['bits']:5d} Bits, {r['fill']:5.1%} gesetzt | "
+              f"BLOB {r['packed']:5d} -> {r['stored']:7.1f} Bytes ({r['sparse']:6.1%} dünn) | "
+              f"Kodieren {ROWS / r['encode'] / 1000:6.0f}k/s, Dekodieren {ROWS / r['decode'] / 1000:6.0f}k/s "
+              f"(nur gepackt {ROWS / r['decode_packed'] / 1000:6.0f}k/s)")
@@ -0,0 +1,66 @@
+#########################################################################
+#       Benchmark: Durchsatz der Kodierung "seeded" vs. "double"        #
+#########################################################################
+
+import os, sys, random, time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.bloomfilter import get_bloomfilter, bf_encode_records, bf_record_fields, bf_qgram_positions, bf_tokenize
+from backend.data import gen_qgram
+from config import BLOOMFILTER_SETTINGS
+from generate_csv import vornamen, nachnamen, geschlechter
+
+
+SAMPLES     = 5000
+SCHEMES     = ["seeded", "double"]
+
+
+def gen_records(n: int) -> list[tuple[str, str, str]]:
+    return [(random.choice(vornamen),
+             random.choice(nachnamen),
+             random.choice(geschlechter)) for _ in range(n)]
+
+
+def bench_hash(records, scheme: str) -> tuple[int, float]:
+    qgrams = [qgram for record in records for value in record for token in bf_tokenize(value, "word")
+              for qgram in gen_qgram(token, BLOOMFILTER_SETTINGS.QSIZE, BLOOMFILTER_SETTINGS.PADDING)]
+    start = time.perf_counter()
+    for qgram in qgrams:
+        bf_qgram_positions(qgram, BLOOMFILTER_SETTINGS.HASHRUNS_NAME, BLOOMFILTER_SETTINGS.HASH_SEEDS40,
+                           BLOOMFILTER_SETTINGS.ARRAY_SIZES["name"], scheme)
+    return len(qgrams), time.perf_counter() - start
+
+
+# Das Geburtsdatum wird nicht gemessen, dort dominiert das Parsen des Datums und nicht das Hashen
+def bench_single(records, scheme: str) -> float:
+    fields = [field for field in bf_record_fields() if field["normMode"] == "word"]
+    start = time.perf_counter()
+    for record in records:
+        for value, field in zip(record, fields):
+            get_bloomfilter(value, field["hash_runs"], field["hash_seeds"], field["array_size"], field["normMode"], scheme=scheme)
+    return time.perf_counter() - start
+
+
+def bench_batch(records, scheme: str) -> float:
+    fields = [field for field in bf_record_fields() if field["normMode"] == "word"]
+    start = time.perf_counter()
+    bf_encode_records(records, fields, use_table=False, scheme=scheme)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    records = gen_records(SAMPLES)
+    print(f"Datensätze (Vorname, Nachname, Geschlecht): {SAMPLES}, "
+          f"Hash-Durchläufe: {BLOOMFILTER_SETTINGS.HASHRUNS_NAME}/{BLOOMFILTER_SETTINGS.HASHRUNS_OTHER}\n")
+
+    results = {}
+    for scheme in SCHEMES:
+        amount, hashing = bench_hash(records, scheme)
+        results[scheme] = (hashing, bench_single(records, scheme), bench_batch(records, scheme))
+        _, single, batch = results[scheme]
+        print(f"{scheme:>7}: q-Gramme {amount / hashing:10.0f}/s | "
+              f"get_bloomfilter {SAMPLES / single:8.0f} Datensätze/s | "
+              f"bf_encode_records {SAMPLES / batch:8.0f} Datensätze/s")
+
+    print(f"\nSpeedup double vs. seeded: q-Gramme {results['seeded'][0] / results['double'][0]:.2f}x, "
+          f"get_bloomfilter {results['seeded'][1] / results['double'][1]:.2f}x")
@@ -0,0 +1,109 @@
+#########################################################################
+#       Benchmark: Import und Relink je Speicherprofil der SQLite-DB    #
+#########################################################################
+
+import os, sys, csv, random, shutil, tempfile, threading, time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bitarray import bitarray
+from backend.database import (create_db, db_connect, db_close_connections, db_insert_patient,
+                              db_insert_patient_from_file, db_topk_relink_bf)
+from config import DATABASE_SETTINGS, BLOOMFILTER_SETTINGS
+from generate_csv import vornamen, nachnamen, geschlechter, mdats, zufaelliges_geburtsdatum
+
+
+ROWS            = 20000     # Bulk-Import
+SINGLE_ROWS     = 300       # Einzelne Inserts, jeder mit eigenem Commit
+QUERIES         = 50        # Relink-Anfragen
+PROFILES        = list(DATABASE_SETTINGS.STORAGE_PROFILES)
+
+
+def gen_csv(path: str, n: int) -> None:
+    with open(path, mode='w', newline='', encoding="utf-8") as datei:
+        writer = csv.writer(datei)
+        for _ in range(n):
+            writer.writerow([random.choice(vornamen), random.choice(nachnamen), zufaelliges_geburtsdatum(),
+                             random.choice(geschlechter), random.choice(mdats)])
+
+
+def bench_import(csv_path: str, patient_db: str) -> tuple[float, int]:
+    # Parallel zum Import liest ein zweiter Thread, wie die GUI es tut; gezählt werden seine Abfragen
+    done, reads = threading.Event(), [0]
+
+    def reader():
+        while not done.is_set():
+            db_connect(patient_db).execute("SELECT COUNT(*) FROM Patientendaten").fetchone()
+            reads[0] += 1
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    start = time.perf_counter()
+    db_insert_patient_from_file("bench.csv", file_path=csv_path, patient_db_path=patient_db)
+    elapsed = time.perf_counter() - start
+    done.set()
+    thread.join()
+    return elapsed, reads[0]
+
+
+def bench_single(patient_db: str) -> float:
+    start = time.perf_counter()
+    for _ in range(SINGLE_ROWS):
+        db_insert_patient(random.choice(vornamen), random.choice(nachnamen), "1990-01-01",
+                          random.choice(geschlechter), patient_db_path=patient_db)
+    return time.perf_counter() - start
+
+
+def bench_relink(patient_db: str, queries: list[bitarray], use_cache: bool) -> float:
+    use_matrix_cache = BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE
+    BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE = use_cache
+    try:
+        start = time.perf_counter()
+        for bf in queries:
+            db_topk_relink_bf(bf, 10, patient_db_path=patient_db)
+        return time.perf_counter() - start
+    finally:
+        BLOOMFILTER_SETTINGS.USE_MATRIX_CACHE = use_matrix_cache
+
+
+def run_profile(profile: str, csv_path: str, directory: str) -> dict:
+    DATABASE_SETTINGS.STORAGE_PROFILE = profile
+    db_close_connections()
+    patient_db, pid_db = os.path.join(directory, f"{profile}_patient.db"), os.path.join(directory, f"{profile}_pid.db")
+    create_db(patient_db_path=patient_db, pid_db_path=pid_db)
+
+    results = {"journal": db_connect(patient_db).execute("PRAGMA journal_mode").fetchone()[0]}
+    results["import"], results["reads"] = bench_import(csv_path, patient_db)
+    results["single"] = bench_single(patient_db)
+
+    queries = []
+    for (blob,) in db_connect(patient_db).execute("SELECT bf_unpack(BF) FROM Patientendaten ORDER BY RANDOM() LIMIT ?", (QUERIES,)):
+        bf = bitarray()
+        bf.frombytes(blob)
+        queries.append(bf)
+    # Der erste Relink mit Cache baut ihn auf und wird nicht gemessen
+    bench_relink(patient_db, queries[:1], True)
+    results["relink_cache"] = bench_relink(patient_db, queries, True)
+    results["relink_blobs"] = bench_relink(patient_db, queries, False)
+    db_close_connections()
+    return results
+
+
+if __name__ == "__main__":
+    random.seed(42)
+    directory = tempfile.mkdtemp(prefix="bench_storage_")
+    csv_path = os.path.join(directory, "bench.csv")
+    gen_csv(csv_path, ROWS)
+    configured = DATABASE_SETTINGS.STORAGE_PROFILE
+    print(f"Bulk-Import: {ROWS} Zeilen, einzelne Inserts: {SINGLE_ROWS}, Relink-Anfragen (top 10): {QUERIES}\n")
+
+    try:
+        for profile in PROFILES:
+            results = run_profile(profile, csv_path, directory)
+            print(f"{profile:>8} ({results['journal']}): "
+                  f"Import {ROWS / results['import']:8.0f} Zeilen/s, {results['reads']:5d} Lesezugriffe parallel | "
+                  f"Inserts {SINGLE_ROWS / results['single']:6.0f}/s | "
+                  f"Relink {QUERIES / results['relink_cache']:6.1f}/s (Cache), {QUERIES / results['relink_blobs']:6.1f}/s (BLOBs)")
+    finally:
+        DATABASE_SETTINGS.STORAGE_PROFILE = configured
+        db_close_connections()
+        shutil.rmtree(directory, ignore_errors=True)
@@ -9,7 +9,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from bitarray import bitarray
 from test_csv import generate_csv
 from statistiks.test_settings import *
-from backend.bloomfilter import bf_extended_similarity, get_bloomfilter
+from backend.bloomfilter import bf_extended_similarity, RecordSchema, BloomEncoder
 from temp import achter
 
 
@@ -57,23 +57,21 @@ def run_typo_test(first_name, last_name, date_of_birth, gender,
     samplecount     = 250
 
     first_name      = first_name[:16]
-    array_sizes     = [fname_asize ,fname_asize,dob_asize,gender_asize]
 
     #generate_csv(first_name, last_name, date_of_birth, gender, samplecount, filename = read_filename)
     write_filename  =   f"statistiks/typo_{read_filename}_{file}_result.txt"
     read_filename   =   f"statistiks/typo_{read_filename}.csv"
-    bf_list = [
-                get_bloomfilter(first_name, hash_runs_fname, HASH_SEEDS100, fname_asize, 3, True, "word"),
-                get_bloomfilter(last_name, hash_runs_lname, HASH_SEEDS100, fname_asize, 3, True, "word"),
-                get_bloomfilter(date_of_birth, hash_runs_dob, HASH_SEEDS100, dob_asize, 3, True, "date"),
-                get_bloomfilter(gender, hash_runs_gen, HASH_SEEDS100, gender_asize, 3, True, "word")
-            ]
+    schema = RecordSchema([
+                {"name": "first_name", "hash_runs": hash_runs_fname, "hash_seeds": HASH_SEEDS100, "array_size": fname_asize, "normMode": "word"},
+                {"name": "last_name", "hash_runs": hash_runs_lname, "hash_seeds": HASH_SEEDS100, "array_size": fname_asize, "normMode": "word"},
+                {"name": "birthdate", "hash_runs": hash_runs_dob, "hash_seeds": HASH_SEEDS100, "array_size": dob_asize, "normMode": "date"},
+                {"name": "gender", "hash_runs": hash_runs_gen, "hash_seeds": HASH_SEEDS100, "array_size": gender_asize, "normMode": "word"}
+            ], qSize=3, padding=PADDING)
+    encoder = BloomEncoder(schema, use_table=False)
 
     initial_bf      =   bitarray()
-    ones = []
-    for bf in bf_list: 
-        initial_bf.extend(bf)
-        ones.append(bf.count(1))
+    initial_bf.frombytes(encoder.encode((first_name, last_name, date_of_birth, gender)))
+    ones = [initial_bf[start:end].count(1) for (_, start, end) in schema.segments()]
 
 
     sim           = []
@@ -87,20 +85,14 @@ def run_typo_test(first_name, last_name, date_of_birth, gender,
         for row in reader:
             fname, lname, dob, gender, fehler = row
             fname      = fname[:16]
-            temp_bf_list =[
-                get_bloomfilter(fname, hash_runs_fname, HASH_SEEDS100, fname_asize, 3, True, "word"),
-                get_bloomfilter(lname, hash_runs_lname, HASH_SEEDS100, fname_asize, 3, True, "word"),
-                get_bloomfilter(dob, hash_runs_dob, HASH_SEEDS100, dob_asize, 3, True, "date"),
-                get_bloomfilter(gender, hash_runs_gen, HASH_SEEDS100, gender_asize, 3, True, "word")
-            ]   
             temp_bf = bitarray()
-            for bf in temp_bf_list: temp_bf.extend(bf)
+            temp_bf.frombytes(encoder.encode((fname, lname, dob, gender)))
 
         
             out, _ = bf_extended_similarity(initial_bf,
                                               temp_bf,
-                                              array_sizes, 
-                                              ["first_name", "last_name", "birthdate", "gender"],
+                                              schema.sizes, 
+                                              schema.names,
                                               "total",
                                               [0.98, 0.95, 0.9])
             temp_sim = out[0]